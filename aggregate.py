@@ -0,0 +1,251 @@
+import pickle
+import tempfile
+from constants import *
+from utils import parseSchema, recordAccessMethod
+from recordDecoder import compiledScan, decoderFor, recordColumnOrder
+from queryOperations import readResetBookkeepings
+
+AGGREGATE_FUNCTIONS = ("count", "sum", "min", "max", "avg")
+
+def _number(value):
+    """numeric value of a column like SQLite sum(): text is converted, what is not a number counts as 0"""
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0
+
+def _initialState(function):
+    return [0, 0] if function == "avg" else (0 if function == "count" else None)
+
+def _step(function, state, value):
+    """fold one column value into the partial state of an aggregate, NULLs are ignored"""
+    if value is None:
+        return state
+    if function == "count":
+        return state + 1
+    if function == "sum":
+        return _number(value) if state is None else state + _number(value)
+    if function == "min":
+        return value if state is None or value < state else state
+    if function == "max":
+        return value if state is None or value > state else state
+    state[0] += _number(value)
+    state[1] += 1
+    return state
+
+def _merge(function, state, other):
+    """combine two partial states of the same group, e.g. one spilled and one in memory"""
+    if function == "count":
+        return state + other
+    if function == "avg":
+        return [state[0] + other[0], state[1] + other[1]]
+    if state is None or other is None:
+        return other if state is None else state
+    if function == "sum":
+        return state + other
+    if function == "min":
+        return min(state, other)
+    return max(state, other)
+
+def _final(function, state):
+    if function == "avg":
+        return state[0] / state[1] if state[1] else None
+    return state
+
+class hashAggregate:
+    """
+    GROUP BY operator: rows are consumed one at a time into a hash table of
+    group key -> partial aggregate states
+
+    the hash table holds at most maxGroups groups; when a new group does not fit,
+    the partial states of the whole table are spilled to numPartitions temporary
+    files by hash of the group key and the table starts over empty. results()
+    merges each partition on its own, so the memory needed is one partition,
+    partitions that are still too large are split again with another hash
+
+        @param groupBy: the positions of the group by columns in the rows
+        @param aggregates: [(function, position)] with function in AGGREGATE_FUNCTIONS;
+                position None is count(*)
+        @param maxGroups: memory budget, in number of groups held in memory
+        @param numPartitions: number of spill files
+        @param tempDir: directory of the spill files, the system default by default
+    """
+    def __init__(self, groupBy, aggregates, maxGroups=AGGREGATE_MAX_GROUPS, numPartitions=AGGREGATE_SPILL_PARTITIONS, tempDir=None):
+        for function, _ in aggregates:
+            if function not in AGGREGATE_FUNCTIONS:
+                raise ValueError("unknown aggregate function: {}".format(function))
+        self.groupBy = list(groupBy)
+        self.aggregates = list(aggregates)
+        self.maxGroups = maxGroups
+        self.numPartitions = numPartitions
+        self.tempDir = tempDir
+
+        self.table = {}
+        self.partitions = None
+
+        self.rowsConsumed = 0
+        self.spills = 0
+        self.spilledGroups = 0
+
+    def consume(self, row):
+        """
+        fold one row into its group
+            @param row: a tuple or list of column values
+        """
+        self.rowsConsumed += 1
+        key = tuple([row[position] for position in self.groupBy])
+
+        states = self.table.get(key)
+        if states is None:
+            if len(self.table) >= self.maxGroups:
+                self.partitions = self._spill(self.table, self.partitions, 0)
+                self.table = {}
+            states = self.table[key] = [_initialState(function) for function, _ in self.aggregates]
+
+        for i, (function, position) in enumerate(self.aggregates):
+            # count(*) counts every row
+            states[i] = _step(function, states[i], 1 if position is None else row[position])
+
+    def _spill(self, table, partitions, depth):
+        """append the partial states of table to the spill files, one pickled list per partition"""
+        if partitions is None:
+            partitions = [tempfile.TemporaryFile(dir=self.tempDir) for _ in range(self.numPartitions)]
+
+        chunks = [[] for _ in range(self.numPartitions)]
+        for key, states in table.items():
+            # a different hash at every depth so a partition that is too large splits up
+            chunks[hash((depth, key)) % self.numPartitions].append((key, states))
+        for partition, chunk in zip(partitions, chunks):
+            if chunk:
+                pickle.dump(chunk, partition, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.spills += 1
+        self.spilledGroups += len(table)
+        return partitions
+
+    def _mergePartition(self, partition, depth):
+        """yield the merged (key, states) of a spill file, repartitioning it if it does not fit"""
+        partition.seek(0)
+        table, subPartitions = {}, None
+
+        while True:
+            try:
+                chunk = pickle.load(partition)
+            except EOFError:
+                break
+            for key, states in chunk:
+                current = table.get(key)
+                if current is None:
+                    if len(table) >= self.maxGroups and depth < AGGREGATE_MAX_SPILL_DEPTH:
+                        subPartitions = self._spill(table, subPartitions, depth + 1)
+                        table = {}
+                    table[key] = states
+                else:
+                    table[key] = [_merge(function, a, b) for (function, _), a, b in zip(self.aggregates, current, states)]
+        partition.close()
+
+        if subPartitions is None:
+            yield from table.items()
+            return
+
+        self._spill(table, subPartitions, depth + 1)
+        for subPartition in subPartitions:
+            yield from self._mergePartition(subPartition, depth + 1)
+
+    def results(self):
+        """yield one tuple (group by values..., aggregate values...) per group, in no particular order"""
+        if self.partitions is None:
+            groups = self.table.items()
+        else:
+            self.partitions = self._spill(self.table, self.partitions, 0)
+            self.table = {}
+            groups = (group for partition in self.partitions for group in self._mergePartition(partition, 0))
+
+        for key, states in groups:
+            yield key + tuple(_final(function, state) for (function, _), state in zip(self.aggregates, states))
+
+    def stats(self):
+        """return the aggregation statistics"""
+        return {"rowsConsumed": self.rowsConsumed,
+                "groupsInMemory": len(self.table),
+                "spills": self.spills,
+                "spilledGroups": self.spilledGroups}
+
+def aggregateScan(fpt, pageSize, table, groupBy, aggregates, matches=None, maxGroups=AGGREGATE_MAX_GROUPS, tempDir=None):
+    """
+    SELECT groupBy..., aggregates... FROM table [WHERE matches(record)] GROUP BY groupBy
+
+    the table is read with a compiled decoder; without a predicate only the
+    referenced columns are decoded
+
+    return (list of result tuples sorted by group, the hashAggregate used)
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param table: the table name
+        @param groupBy: the (cleaned) column names to group on, e.g. ["Last_Name"]
+        @param aggregates: [(function, column name or None for count(*))]
+        @param matches: function(record) -> bool over the full record in record order
+        @param maxGroups: memory budget of the hash table, in groups
+        @param tempDir: directory of the spill files
+    """
+    schema = parseSchema(fpt, pageSize)
+    if matches is None:
+        columns = []
+        for name in list(groupBy) + [column for _, column in aggregates if column is not None]:
+            if name not in columns:
+                columns.append(name)
+        decode = decoderFor(schema, table, columns)
+    else:
+        columns = [name for name, _ in recordColumnOrder(schema[table]["sql"])]
+        decode = decoderFor(schema, table)
+
+    aggregator = hashAggregate([columns.index(name) for name in groupBy],
+                               [(function, None if column is None else columns.index(column)) for function, column in aggregates],
+                               maxGroups, tempDir=tempDir)
+
+    def _consume(row):
+        if matches is None or matches(row):
+            aggregator.consume(row)
+        return None
+
+    recordAccessMethod("hash-aggregate")
+    compiledScan(fpt, pageSize, schema[table]["rootPage"], decode, _consume)
+    return sorted(aggregator.results(), key=lambda row: [(value is not None, value) for value in row[:len(groupBy)]]), aggregator
+
+def db_A_Query_CountByLastName(pageSize):
+    """
+    DB: Without any index with page size of 4KB
+    Ops: count the employees per last name (scan + hash aggregation)
+    """
+    print("DB: Without any index with page size of 4KB")
+    print("Count the employees per last name (this is a Scan with a hash aggregation)")
+
+    with open(DB_PATH1, "rb") as db_binary:
+        rows, _ = aggregateScan(db_binary, pageSize, 'Employee', ['Last_Name'], [("count", None)])
+        for lastName, count in rows:
+            print("Last Name: {}, Count: {}".format(lastName, count))
+
+def db_D_Query_CountByState(pageSize):
+    """
+    DB: With primary index on "Emp ID" column but defined as clustered (use CREATE INDEX WITHOUT ROWID) with page size of 4KB
+    Ops: count the employees and their smallest and largest "Emp ID" per state (scan + hash aggregation)
+    """
+    print("DB: With primary index on \"Emp ID\" column but defined as clustered with page size of 4KB")
+    print("Count the employees and their smallest and largest \"Emp ID\" per state (this is a Scan with a hash aggregation)")
+
+    with open(DB_PATH4, "rb") as db_binary:
+        rows, _ = aggregateScan(db_binary, pageSize, 'Employee', ['State'], [("count", None), ("min", "Emp_ID"), ("max", "Emp_ID")])
+        for state, count, lowest, highest in rows:
+            print("State: {}, Count: {}, Emp ID: {} - {}".format(state, count, lowest, highest))
+
+if __name__ == "__main__":
+    db_A_Query_CountByLastName(PAGE_SIZE_4K)
+    readResetBookkeepings()
+    print("")
+    db_D_Query_CountByState(PAGE_SIZE_4K)
+    readResetBookkeepings()
@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from timeit import default_timer as time
+
+from bitstring import ConstBitStream
+from constants import *
+from aggregate import aggregateScan
+from btreeWriter import bulkLoadEmployees
+from csvParser import build_db_abstraction, cleaned_version, create_db, populate_data_to_db
+from metrics import metricsContext
+from queryOperations import btreeScan, tableBtreeEqualitySearch, indexBtreeEqualitySearch, indexBtreeRangeSearch
+from recordDecoder import compiledScan, decoderFor
+from utils import parseRootPage, parseSchema, readPage
+
+# the columns of the Employee export, same schema csvParser loads
+EMPLOYEE_COLUMNS = ["Emp ID", "Name Prefix", "First Name", "Middle Initial", "Last Name", "Gender",
+                    "E Mail", "Father's Name", "Date of Birth", "Age in Yrs.", "Weight in Kgs.",
+                    "Date of Joining", "Salary", "Last % Hike", "SSN", "Phone No. ", "City",
+                    "State", "Zip", "Region", "User Name"]
+
+FIRST_NAMES = ["Sherman", "Aleta", "Enoch", "Kiera", "Glenn", "Zenaida", "Rhett", "Shaina", "Daria", "Angel",
+               "Kimiko", "Beatrice", "Tommy", "Lane", "Flo", "Alphonse", "Jacquelyne", "Shirleen"]
+LAST_NAMES = ["Rowe", "Smith", "Jones", "Brown", "Lee", "Khan", "Diaz", "Moore", "Clark", "Lewis", "Walker",
+              "Hall", "Young", "King", "Wright", "Scott", "Green", "Baker", "Adams", "Nelson", "Hill",
+              "Ramirez", "Campbell", "Mitchell", "Roberts", "Carter", "Phillips", "Evans", "Turner", "Torres"]
+STATES = ["CA", "NY", "TX", "FL", "IL", "PA", "OH", "GA", "NC", "MI"]
+REGIONS = ["West", "Northeast", "South", "Midwest"]
+
+# the four layouts of the assignment: name -> (with_index, clustered, page size)
+LAYOUTS = {
+    "heap4k": (False, False, PAGE_SIZE_4K),
+    "heap16k": (False, False, PAGE_SIZE_16K),
+    "pkIndex": (True, False, PAGE_SIZE_4K),
+    "clustered": (True, True, PAGE_SIZE_4K),
+}
+
+QUERY_CLASSES = ["scan", "equality", "range"]
+
+# width of the benchmark Emp ID range, same as EMP_ID_RANGE
+RANGE_WIDTH = EMP_ID_RANGE[1] - EMP_ID_RANGE[0]
+
+def employeeRows(numRows, seed=443):
+    """
+    yield numRows synthetic Employee rows (lists in EMPLOYEE_COLUMNS order) without holding them in memory
+
+        @param numRows: number of employees
+        @param seed: random seed so that runs are reproducible
+    """
+    rng = random.Random(seed)
+    # about one employee every two ids, so a range of RANGE_WIDTH ids matches ~50 rows
+    empIDs = rng.sample(range(100000, 100000 + numRows * 2), numRows)
+
+    for empID in empIDs:
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        gender = rng.choice("MF")
+        yield [empID, "Mr." if gender == "M" else "Ms.", first, chr(rng.randint(65, 90)), last, gender,
+               "{}.{}@example.com".format(first.lower(), last.lower()),
+               "{} {}".format(rng.choice(FIRST_NAMES), last),
+               "{}/{}/{}".format(rng.randint(1, 12), rng.randint(1, 28), rng.randint(1960, 1998)),
+               rng.randint(20, 60), rng.randint(45, 99),
+               "{}/{}/{}".format(rng.randint(1, 12), rng.randint(1, 28), rng.randint(1985, 2017)),
+               rng.randint(40000, 200000), "{}%".format(rng.randint(0, 30)),
+               "{:03d}-{:02d}-{:04d}".format(rng.randint(100, 999), rng.randint(10, 99), rng.randint(1000, 9999)),
+               "{:03d}-{:03d}-{:04d}".format(rng.randint(200, 999), rng.randint(200, 999), rng.randint(1000, 9999)),
+               "City{}".format(rng.randint(1, 500)), rng.choice(STATES), rng.randint(10000, 99999),
+               rng.choice(REGIONS), "{}{}".format(first[0].lower(), last.lower())]
+
+def generateEmployeeCsv(csvPath, numRows, seed=443):
+    """
+    write a synthetic Employee csv and return the query parameters that match its content
+
+        @param csvPath: the output csv path
+        @param numRows: number of employees
+        @param seed: random seed so that runs are reproducible
+    """
+    empIDs = []
+    with open(csvPath, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(EMPLOYEE_COLUMNS)
+        for row in employeeRows(numRows, seed):
+            empIDs.append(row[0])
+            writer.writerow(row)
+
+    sortedIDs = sorted(empIDs)
+    lower = sortedIDs[len(sortedIDs) // 3]
+    return {"lastName": LAST_NAMES[0], "empID": sortedIDs[len(sortedIDs) // 2], "empIDRange": (lower, lower + RANGE_WIDTH)}
+
+def buildLayouts(csvPath, workDir, layouts=LAYOUTS):
+    """
+    load the csv into one database file per layout with the csvParser loader
+
+    return {layout: (db path, page size)}
+        @param csvPath: the employee csv
+        @param workDir: directory for the database files
+        @param layouts: {layout: (with_index, clustered, page size)}
+    """
+    col_dict, col_size_dict, col_names, unique_emp = build_db_abstraction(csvPath)
+    built = {}
+    for name, (withIndex, clustered, pageSize) in layouts.items():
+        dbPath = os.path.join(workDir, "{}.db".format(name))
+        if os.path.exists(dbPath):
+            os.remove(dbPath)
+        create_db(withIndex, clustered, pageSize, dbPath, "Employee", col_names, col_size_dict)
+        populate_data_to_db(col_names, col_dict, dbPath, "Employee", unique_emp)
+        for emp in unique_emp:
+            unique_emp[emp] = 0
+        built[name] = (dbPath, pageSize)
+    return built
+
+def dropFromPageCache(dbPath):
+    """
+    evict the file from the OS page cache so the next run is a cold cache run (best effort)
+        @param dbPath: the database file
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    with open(dbPath, 'rb') as db_binary:
+        os.fsync(db_binary.fileno())
+        os.posix_fadvise(db_binary.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return True
+
+def runQuery(layout, queryClass, dbPath, pageSize, params):
+    """
+    run one query class against one layout with the access path the db_X_Query_Y functions use
+
+    return the number of qualifying rows
+        @param layout: the layout name
+        @param queryClass: scan, equality or range
+        @param dbPath: the database file
+        @param pageSize: the page size of the database
+        @param params: the query parameters returned by generateEmployeeCsv
+    """
+    matches = []
+    lastName, empID = params["lastName"], params["empID"]
+    lower, upper = params["empIDRange"]
+
+    def _lastName(record):
+        if record and record[LAST_NAME_INDEX] == lastName:
+            matches.append(record)
+        return None
+
+    def _empID(record):
+        if record and record[0] == empID:
+            matches.append(record)
+            return record
+        return None
+
+    def _empIDRange(record):
+        if record and lower <= record[0] <= upper:
+            matches.append(record)
+        return None
+
+    def _indexEqual(record):
+        return record[1] if record[0] == empID else None
+
+    def _indexRange(record):
+        if record and lower <= record[0] <= upper:
+            matches.append(record)
+            return [record]
+        return []
+
+    # the table equality search prints the record it finds
+    with open(dbPath, "rb") as db_binary, open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        roots = parseRootPage(db_binary, pageSize)
+        tableRoot = ConstBitStream(readPage(roots['Employee'], db_binary, pageSize))
+
+        if queryClass == "scan":
+            btreeScan(tableRoot, db_binary, _lastName, pageSize)
+        elif layout in ("heap4k", "heap16k"):
+            btreeScan(tableRoot, db_binary, _empID if queryClass == "equality" else _empIDRange, pageSize)
+        elif layout == "clustered":
+            if queryClass == "equality":
+                indexBtreeEqualitySearch(tableRoot, db_binary, empID, _empID, pageSize)
+            else:
+                indexBtreeRangeSearch(tableRoot, db_binary, lower, upper, _indexRange, pageSize)
+        else:
+            indexRoot = ConstBitStream(readPage(roots['sqlite_autoindex_Employee_1'], db_binary, pageSize))
+            if queryClass == "equality":
+                rowid = indexBtreeEqualitySearch(indexRoot, db_binary, empID, _indexEqual, pageSize)
+                if rowid and rowid != -1:
+                    matches.append(rowid)
+                    tableBtreeEqualitySearch(tableRoot, db_binary, rowid, pageSize)
+            else:
+                for record in indexBtreeRangeSearch(indexRoot, db_binary, lower, upper, _indexRange, pageSize):
+                    tableBtreeEqualitySearch(tableRoot, db_binary, record[1], pageSize)
+
+    return len(matches)
+
+def runBenchmark(built, params, cacheModes=("warm", "cold"), repeat=3):
+    """
+    run every query class against every layout under warm and cold cache
+
+    return a list of result dictionaries, one per (layout, query class, cache mode)
+        @param built: {layout: (db path, page size)}
+        @param params: the query parameters
+        @param cacheModes: warm and/or cold
+        @param repeat: number of timed runs, the best one is reported
+    """
+    results = []
+    for layout, (dbPath, pageSize) in built.items():
+        for queryClass in QUERY_CLASSES:
+            for cacheMode in cacheModes:
+                if cacheMode == "warm":
+                    runQuery(layout, queryClass, dbPath, pageSize, params)
+
+                best = None
+                for _ in range(repeat):
+                    if cacheMode == "cold":
+                        dropFromPageCache(dbPath)
+                    with metricsContext("{}.{}.{}".format(layout, queryClass, cacheMode)) as metrics:
+                        startTime = time()
+                        rows = runQuery(layout, queryClass, dbPath, pageSize, params)
+                        elapsed = time() - startTime
+                    if best is None or elapsed < best[0]:
+                        best = (elapsed, rows, metrics)
+
+                elapsed, rows, metrics = best
+                results.append({
+                    "layout": layout,
+                    "query": queryClass,
+                    "cache": cacheMode,
+                    "seconds": elapsed,
+                    "rows": rows,
+                    "pagesRead": metrics.logicalReads,
+                    "pagesReadByType": dict(metrics.pageReadsByType),
+                    "pagesPerSecond": metrics.logicalReads / elapsed if elapsed else 0,
+                    "rowsPerSecond": rows / elapsed if elapsed else 0,
+                })
+    return results
+
+def compareWithBaseline(results, baseline, tolerance=0.2):
+    """
+    flag the results that regressed against a baseline run
+
+    return a list of human readable regression messages
+        @param results: the current results
+        @param baseline: the results of a previous run (the "results" list of its json report)
+        @param tolerance: allowed relative slowdown before a result is flagged
+    """
+    previous = {(r["layout"], r["query"], r["cache"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result["layout"], result["query"], result["cache"])
+        old = previous.get(key)
+        if old is None:
+            continue
+        if result["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append("{}: {:.4f}s -> {:.4f}s (+{:.0%})".format(".".join(key), old["seconds"], result["seconds"],
+                                                                         result["seconds"] / old["seconds"] - 1))
+        if result["pagesRead"] > old["pagesRead"]:
+            regressions.append("{}: pages read {} -> {}".format(".".join(key), old["pagesRead"], result["pagesRead"]))
+        if result["rows"] != old["rows"]:
+            regressions.append("{}: rows {} -> {}".format(".".join(key), old["rows"], result["rows"]))
+    return regressions
+
+def runDecodeBenchmark(dbPath, pageSize, repeat=3):
+    """
+    compare the per row cost of the bitstring record parser with the compiled decoders
+    on a full warm cache scan of the Employee table
+
+    return {decoder name: nanoseconds per row}
+        @param dbPath: the database file, a rowid Employee table
+        @param pageSize: the page size of the database
+        @param repeat: timed runs per decoder, best is reported
+    """
+    with open(dbPath, 'rb') as db_binary:
+        schema = parseSchema(db_binary, pageSize)
+        rootPage = schema['Employee']['rootPage']
+
+        def _bitstringScan():
+            rows = []
+            btreeScan(ConstBitStream(readPage(rootPage, db_binary, pageSize)), db_binary,
+                      lambda record: rows.append(record) if record else None, pageSize)
+            return len(rows)
+
+        def _compiledScan(decode):
+            rows = []
+            compiledScan(db_binary, pageSize, rootPage, decode, rows.append)
+            return len(rows)
+
+        decoders = {
+            "bitstring": _bitstringScan,
+            "compiled": lambda: _compiledScan(decoderFor(schema, 'Employee')),
+            "compiledSlots": lambda: _compiledScan(decoderFor(schema, 'Employee', rowType="slots")),
+            "compiledLastName": lambda: _compiledScan(decoderFor(schema, 'Employee', ["Last_Name"])),
+        }
+
+        perRow = {}
+        for name, scan in decoders.items():
+            best, numRows = None, 0
+            for _ in range(repeat):
+                start = time()
+                numRows = scan()
+                elapsed = time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            perRow[name] = best * 1e9 / max(numRows, 1)
+    return perRow
+
+def buildEmployeeTable(dbPath, numRows, seed=443, pageSize=PAGE_SIZE_4K):
+    """
+    create a heap Employee table with the csvParser schema and stream the synthetic rows
+    into it in one transaction, for table sizes (1M, 10M rows) the csv loader cannot hold in memory
+
+        @param dbPath: the database file, replaced if it exists
+        @param numRows: number of employees
+        @param seed: random seed so that runs are reproducible
+        @param pageSize: the page size of the database
+    """
+    if os.path.exists(dbPath):
+        os.remove(dbPath)
+    create_db(False, False, pageSize, dbPath, "Employee", EMPLOYEE_COLUMNS, {name: 32 for name in EMPLOYEE_COLUMNS})
+
+    connection = sqlite3.connect(dbPath)
+    connection.executemany("INSERT INTO Employee VALUES({})".format(",".join(["?"] * len(EMPLOYEE_COLUMNS))),
+                           employeeRows(numRows, seed))
+    connection.commit()
+    connection.close()
+
+# group by queries of the aggregation benchmark: name -> (group by columns, aggregates)
+AGGREGATE_QUERIES = {
+    "countByLastName": ([cleaned_version("Last Name")], [("count", None)]),
+    "salaryByState": ([cleaned_version("State")], [("count", None), ("avg", cleaned_version("Salary")),
+                                                    ("min", cleaned_version("Salary")), ("max", cleaned_version("Salary"))]),
+    # SELECT count(*): one global group, no column decoded
+    "countAll": ([], [("count", None)]),
+    # one group per employee: exceeds any budget below the table size and spills
+    "countByEmpID": ([cleaned_version("Emp ID")], [("count", None)]),
+}
+
+def runAggregateBenchmark(dbPath, pageSize, maxGroupsList=(AGGREGATE_MAX_GROUPS,), repeat=1):
+    """
+    run every aggregation query under each memory budget
+
+    return a list of result dictionaries with the throughput in rows/sec
+        @param dbPath: the database file with the Employee table
+        @param pageSize: the page size of the database
+        @param maxGroupsList: the budgets (groups in memory) to run with
+        @param repeat: timed runs per query, best is reported
+    """
+    results = []
+    for name, (groupBy, aggregates) in AGGREGATE_QUERIES.items():
+        for maxGroups in maxGroupsList:
+            best = None
+            for _ in range(repeat):
+                with open(dbPath, 'rb') as db_binary, tempfile.TemporaryDirectory() as tempDir:
+                    startTime = time()
+                    rows, aggregator = aggregateScan(db_binary, pageSize, 'Employee', groupBy, aggregates,
+                                                     maxGroups=maxGroups, tempDir=tempDir)
+                    elapsed = time() - startTime
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, len(rows), aggregator.stats())
+
+            elapsed, groups, stats = best
+            results.append({
+                "query": name,
+                "maxGroups": maxGroups,
+                "seconds": elapsed,
+                "rows": stats["rowsConsumed"],
+                "groups": groups,
+                "spills": stats["spills"],
+                "rowsPerSecond": stats["rowsConsumed"] / elapsed if elapsed else 0,
+            })
+    return results
+
+def printAggregateReport(results):
+    """print the aggregation results as a table"""
+    print("{:<16} {:>10} {:>10} {:>10} {:>9} {:>7} {:>12}".format(
+        "query", "maxGroups", "seconds", "rows", "groups", "spills", "rows/s"))
+    for r in results:
+        print("{:<16} {:>10} {:>10.3f} {:>10} {:>9} {:>7} {:>12.0f}".format(
+            r["query"], r["maxGroups"], r["seconds"], r["rows"], r["groups"], r["spills"], r["rowsPerSecond"]))
+
+def compareLoaders(csvPath, workDir, layouts=LAYOUTS, fillFactor=BULK_FILL_FACTOR):
+    """
+    load the csv into every layout with the csvParser (sqlite3 inserts) loader and with
+    the bottom-up btreeWriter, and compare the load time and the file size
+
+    return a list of result dictionaries, one per (layout, loader)
+        @param csvPath: the employee csv
+        @param workDir: directory for the database files
+        @param layouts: {layout: (with_index, clustered, page size)}
+        @param fillFactor: leaf fill factor of the btreeWriter
+    """
+    results = []
+    for name, (withIndex, clustered, pageSize) in layouts.items():
+        dbPath = os.path.join(workDir, "{}_sqlite3.db".format(name))
+        startTime = time()
+        buildLayouts(csvPath, workDir, {name: (withIndex, clustered, pageSize)})
+        elapsed = time() - startTime
+        os.replace(os.path.join(workDir, "{}.db".format(name)), dbPath)
+        results.append({"layout": name, "loader": "sqlite3", "seconds": elapsed, "bytes": os.path.getsize(dbPath)})
+
+        dbPath = os.path.join(workDir, "{}_bulk.db".format(name))
+        startTime = time()
+        bulkLoadEmployees(csvPath, dbPath, withIndex, clustered, pageSize, fillFactor)
+        elapsed = time() - startTime
+        results.append({"layout": name, "loader": "btreeWriter", "seconds": elapsed, "bytes": os.path.getsize(dbPath)})
+    return results
+
+def printReport(results, regressions):
+    """print the results as a table followed by the regressions, if any"""
+    print("{:<10} {:<9} {:<5} {:>10} {:>7} {:>8} {:>12} {:>12}  {}".format(
+        "layout", "query", "cache", "seconds", "rows", "pages", "pages/s", "rows/s", "pages by type"))
+    for r in results:
+        print("{:<10} {:<9} {:<5} {:>10.4f} {:>7} {:>8} {:>12.0f} {:>12.0f}  {}".format(
+            r["layout"], r["query"], r["cache"], r["seconds"], r["rows"], r["pagesRead"],
+            r["pagesPerSecond"], r["rowsPerSecond"],
+            ", ".join("{}={}".format(k, v) for k, v in sorted(r["pagesReadByType"].items()))))
+
+    if regressions:
+        print("\nREGRESSIONS:")
+        for regression in regressions:
+            print("  " + regression)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the four database layouts with scan, equality and range queries")
+    parser.add_argument("--rows", type=int, default=50000, help="number of synthetic employees")
+    parser.add_argument("--seed", type=int, default=443)
+    parser.add_argument("--workdir", default="bench_data", help="directory for the csv and database files")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per query, best is reported")
+    parser.add_argument("--cache", choices=["warm", "cold", "both"], default="both")
+    parser.add_argument("--reuse", action="store_true", help="reuse the databases already in workdir")
+    parser.add_argument("--output", help="write the json report here")
+    parser.add_argument("--baseline", help="json report of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown flagged as regression")
+    parser.add_argument("--decode", action="store_true", help="also compare the record decoders in ns/row")
+    parser.add_argument("--aggregate", action="store_true",
+                        help="only run the group by benchmark on a --rows heap table, e.g. --rows 1000000 or 10000000")
+    parser.add_argument("--max-groups", type=int, nargs="+", default=[AGGREGATE_MAX_GROUPS],
+                        help="hash aggregation memory budgets (groups in memory) to compare")
+    parser.add_argument("--bulk-load", action="store_true",
+                        help="only compare the load time and file size of the sqlite3 loader and the btreeWriter")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+
+    if args.bulk_load:
+        csvPath = os.path.join(args.workdir, "employees_{}.csv".format(args.rows))
+        if not (args.reuse and os.path.exists(csvPath)):
+            generateEmployeeCsv(csvPath, args.rows, args.seed)
+        print("{:<10} {:<12} {:>10} {:>12}".format("layout", "loader", "seconds", "bytes"))
+        for r in compareLoaders(csvPath, args.workdir):
+            print("{:<10} {:<12} {:>10.3f} {:>12}".format(r["layout"], r["loader"], r["seconds"], r["bytes"]))
+        sys.exit(0)
+
+    if args.aggregate:
+        dbPath = os.path.join(args.workdir, "aggregate_{}.db".format(args.rows))
+        if not (args.reuse and os.path.exists(dbPath)):
+            buildEmployeeTable(dbPath, args.rows, args.seed)
+        aggregateResults = runAggregateBenchmark(dbPath, PAGE_SIZE_4K, args.max_groups, args.repeat)
+        printAggregateReport(aggregateResults)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({"rows": args.rows, "seed": args.seed, "aggregate": aggregateResults}, f, indent=2)
+        sys.exit(0)
+    csvPath = os.path.join(args.workdir, "employees_{}.csv".format(args.rows))
+    paramsPath = os.path.join(args.workdir, "params.json")
+
+    if args.reuse and os.path.exists(paramsPath):
+        with open(paramsPath) as f:
+            params = json.load(f)
+        built = {name: (os.path.join(args.workdir, "{}.db".format(name)), pageSize)
+                 for name, (_, _, pageSize) in LAYOUTS.items()}
+    else:
+        params = generateEmployeeCsv(csvPath, args.rows, args.seed)
+        built = buildLayouts(csvPath, args.workdir)
+        with open(paramsPath, 'w') as f:
+            json.dump(params, f)
+
+    cacheModes = ("warm", "cold") if args.cache == "both" else (args.cache,)
+    results = runBenchmark(built, params, cacheModes, args.repeat)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compareWithBaseline(results, json.load(f)["results"], args.tolerance)
+
+    printReport(results, regressions)
+
+    if args.decode:
+        dbPath, pageSize = built["heap4k"]
+        print("\n{:<18} {:>10}".format("decoder", "ns/row"))
+        for name, nanoseconds in runDecodeBenchmark(dbPath, pageSize, args.repeat).items():
+            print("{:<18} {:>10.0f}".format(name, nanoseconds))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"rows": args.rows, "seed": args.seed, "params": params, "results": results}, f, indent=2)
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,253 @@
+from array import array
+from bitstring import ConstBitStream
+from constants import *
+from utils import parseSchema, readPage, recordAccessMethod, printEmpIDFullname
+from catalog import tableColumns, indexKeyColumns
+from keyCompare import compareKeys, indexComparator
+from queryOperations import indexBtreeKeyRangeSearch, readResetBookkeepings
+from recordDecoder import compiledGetMany, decoderFor, recordColumnOrder
+
+# bytes of a bitmap container: one bit per low 16 bits of a rowid
+_BITMAP_BYTES = (1 << 16) // 8
+
+# the positions of the bits set in every byte value
+_BYTE_BITS = [[bit for bit in range(8) if value >> bit & 1] for value in range(256)]
+
+def _bitmapOf(values):
+    """return the bitmap container (an int with one bit per value) of the low 16 bits in values"""
+    bits = bytearray(_BITMAP_BYTES)
+    for value in values:
+        bits[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(bits, "little")
+
+def _valuesOf(container):
+    """return the sorted low 16 bits held by an array or a bitmap container"""
+    if isinstance(container, array):
+        return container
+    values = array('H')
+    for i, byte in enumerate(container.to_bytes(_BITMAP_BYTES, "little")):
+        if byte:
+            values.extend(i * 8 + bit for bit in _BYTE_BITS[byte])
+    return values
+
+def _cardinality(container):
+    return len(container) if isinstance(container, array) else bin(container).count("1")
+
+def _compact(container):
+    """return the cheaper representation of a container: a sorted array up to BITMAP_ARRAY_MAX values, a bitmap above"""
+    if isinstance(container, array):
+        return container if len(container) <= BITMAP_ARRAY_MAX else _bitmapOf(container)
+    return _valuesOf(container) if _cardinality(container) <= BITMAP_ARRAY_MAX else container
+
+class rowidBitmap:
+    """
+    a compressed set of rowids in the layout of a roaring bitmap: the rowids are grouped by
+    their high bits into chunks of 65536, a sparse chunk is a sorted array('H') of its low
+    16 bits, a dense chunk (more than BITMAP_ARRAY_MAX rowids) a 8KB bitmap held in an int;
+    AND and OR work chunk by chunk and iterating yields the rowids in ascending order
+
+        @param rowids: the rowids to start with, in any order
+    """
+    def __init__(self, rowids=()):
+        self.chunks = {}
+        if rowids:
+            self.update(rowids)
+
+    def update(self, rowids):
+        """
+        add rowids to the set
+            @param rowids: the rowids to add, in any order
+        """
+        grouped = {}
+        for rowid in rowids:
+            grouped.setdefault(rowid >> 16, set()).add(rowid & 0xFFFF)
+        for high, lows in grouped.items():
+            container = self.chunks.get(high)
+            if container is not None:
+                lows.update(_valuesOf(container))
+            self.chunks[high] = _compact(array('H', sorted(lows)))
+
+    def __and__(self, other):
+        result = rowidBitmap()
+        for high in self.chunks.keys() & other.chunks.keys():
+            a, b = self.chunks[high], other.chunks[high]
+            if isinstance(a, array) or isinstance(b, array):
+                # probe the smaller array against the other container
+                if isinstance(b, array) and (not isinstance(a, array) or len(b) < len(a)):
+                    a, b = b, a
+                lookup = set(b) if isinstance(b, array) else b
+                if isinstance(lookup, set):
+                    container = array('H', [value for value in a if value in lookup])
+                else:
+                    container = array('H', [value for value in a if lookup >> value & 1])
+            else:
+                container = _compact(a & b)
+            if _cardinality(container):
+                result.chunks[high] = container
+        return result
+
+    def __or__(self, other):
+        result = rowidBitmap()
+        for high in self.chunks.keys() | other.chunks.keys():
+            a, b = self.chunks.get(high), other.chunks.get(high)
+            if a is None or b is None:
+                result.chunks[high] = a if b is None else b
+            elif isinstance(a, array) and isinstance(b, array):
+                result.chunks[high] = _compact(array('H', sorted(set(a).union(b))))
+            else:
+                result.chunks[high] = (a if isinstance(a, int) else _bitmapOf(a)) | (b if isinstance(b, int) else _bitmapOf(b))
+        return result
+
+    def __iter__(self):
+        for high in sorted(self.chunks):
+            base = high << 16
+            for low in _valuesOf(self.chunks[high]):
+                yield base | low
+
+    def __contains__(self, rowid):
+        container = self.chunks.get(rowid >> 16)
+        if container is None:
+            return False
+        low = rowid & 0xFFFF
+        if isinstance(container, array):
+            return low in container
+        return bool(container >> low & 1)
+
+    def __len__(self):
+        return sum(_cardinality(container) for container in self.chunks.values())
+
+    def sizeInBytes(self):
+        """return the memory the containers stand for: 2 bytes per array value, 8KB per bitmap"""
+        return sum(len(container) * 2 if isinstance(container, array) else _BITMAP_BYTES
+                   for container in self.chunks.values())
+
+def probeIndex(fpt, pageSize, schema, column, lower, upper):
+    """
+    return the rowidBitmap of the rows with lower <= column <= upper read from an index
+    of the table ordered on column (the PK autoindex or a secondary index), None if there is none
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param schema: the catalog returned by parseSchema, restricted to the queried table
+        @param column: the (cleaned) column name
+        @param lower: lower bound of the column, None for unbounded
+        @param upper: upper bound of the column, None for unbounded
+    """
+    for indexName in schema:
+        if schema[indexName]["type"] != "index" or indexKeyColumns(schema, indexName)[0][0] != column:
+            continue
+        # the first index column only: a prefix of the full key
+        comparator = indexComparator(schema, indexName)
+        if indexKeyColumns(schema, indexName)[0][2]:
+            lower, upper = upper, lower
+        indexPagestream = ConstBitStream(readPage(schema[indexName]["rootPage"], fpt, pageSize))
+        rowids = []
+
+        def _collect(record):
+            # the rowid is the last field of the index record
+            rowids.append(record[-1])
+            return None
+
+        indexBtreeKeyRangeSearch(indexPagestream, fpt, None if lower is None else (lower,),
+                                 None if upper is None else (upper,), _collect, pageSize, comparator)
+        return rowidBitmap(rowids)
+    return None
+
+def _inRange(value, lower, upper):
+    """whether lower <= value <= upper in SQLite's order, a None bound is open"""
+    return (lower is None or compareKeys((value,), (lower,)) >= 0) and (upper is None or compareKeys((value,), (upper,)) <= 0)
+
+def _evaluate(fpt, pageSize, schema, expression, residuals):
+    """
+    return the bitmap of an expression; under the ANDs at the top of the expression, the ranges
+    no index can answer are appended to residuals and checked on the fetched rows instead,
+    below an OR residuals is None as a row filter cannot stand for one side of an OR
+    """
+    if expression[0] == "range":
+        bitmap = probeIndex(fpt, pageSize, schema, *expression[1:])
+        if bitmap is None:
+            raise ValueError("no index on {}, only usable under the top level AND".format(expression[1]))
+        return bitmap
+
+    operator, operands = expression[0], expression[1:]
+    if operator not in ("and", "or"):
+        raise ValueError("unknown bitmap operator: {}".format(operator))
+
+    bitmaps = []
+    for operand in operands:
+        if operator == "and" and residuals is not None and operand[0] == "range" and not _hasIndex(schema, operand[1]):
+            residuals.append(operand[1:])
+            continue
+        bitmaps.append(_evaluate(fpt, pageSize, schema, operand, residuals if operator == "and" else None))
+    if not bitmaps:
+        raise ValueError("no index can answer any part of the expression, use a scan")
+
+    # intersect the smallest bitmaps first, the result can only shrink
+    if operator == "and":
+        bitmaps.sort(key=len)
+    result = bitmaps[0]
+    for bitmap in bitmaps[1:]:
+        result = result & bitmap if operator == "and" else result | bitmap
+    return result
+
+def _hasIndex(schema, column):
+    return any(entry["type"] == "index" and indexKeyColumns(schema, name)[0][0] == column for name, entry in schema.items())
+
+def bitmapQuery(fpt, pageSize, table, expression):
+    """
+    SELECT * FROM table WHERE expression, answered with rowid bitmaps
+
+    every indexed range of the expression is one index probe producing a rowidBitmap,
+    AND/OR are applied to the bitmaps before any table page is read, and the rowids left
+    are fetched in ascending order with one shared descent of the table btree, so the
+    table leaves are read in file order and at most once; a range on a column without
+    an index is only allowed under an AND and is checked on the fetched rows
+
+    return (the records in rowid order, the final bitmap)
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param table: the table name, a rowid table
+        @param expression: ("range", column, lower, upper), ("and", expression...) or ("or", expression...);
+                an equality is a range with lower == upper, a None bound is open
+    """
+    schema = parseSchema(fpt, pageSize)
+    if tableColumns(schema[table]["sql"])[2]:
+        raise ValueError("{} is a WITHOUT ROWID table, it has no rowids".format(table))
+    schema = {name: entry for name, entry in schema.items() if entry["tableName"] == table}
+
+    recordAccessMethod("bitmap")
+    residuals = []
+    bitmap = _evaluate(fpt, pageSize, schema, expression, residuals)
+
+    decode = decoderFor(schema, table)
+    columnNames = [name for name, _ in recordColumnOrder(schema[table]["sql"])]
+    residuals = [(columnNames.index(column), lower, upper) for column, lower, upper in residuals]
+
+    found = {}
+    compiledGetMany(fpt, pageSize, schema[table]["rootPage"], list(bitmap), decode, found)
+    records = [found[rowid] for rowid in bitmap if rowid in found]
+    return [record for record in records
+            if all(_inRange(record[position], lower, upper) for position, lower, upper in residuals)], bitmap
+
+def db_C_Query_Bitmap(pageSize):
+    """
+    DB: With primary index on "Emp ID" column (Unclusterd Index) with page size of 4KB
+    Ops: print the employees whose "Emp ID" is in either of two ranges and whose last name is "Rowe"
+        (two bitmaps from the Emp ID index OR'ed, sorted rowid fetch, last name checked on the rows)
+    """
+    print("DB: With primary index on \"Emp ID\" column (Unclusterd Index) with page size of 4KB")
+    print("Query and print the employees in two \"Emp ID\" ranges whose last name is \"Rowe\" (this is a bitmap OR of two index probes)")
+
+    with open(DB_PATH3, "rb") as db_binary:
+        lower, upper = EMP_ID_RANGE
+        middle = (lower + upper) // 2
+        expression = ("and",
+                      ("or", ("range", "Emp_ID", lower, middle), ("range", "Emp_ID", middle + 1, upper)),
+                      ("range", "Last_Name", LAST_NAME, LAST_NAME))
+        records, _ = bitmapQuery(db_binary, pageSize, 'Employee', expression)
+        for record in records:
+            printEmpIDFullname(record)
+
+if __name__ == "__main__":
+    db_C_Query_Bitmap(PAGE_SIZE_4K)
+    readResetBookkeepings()
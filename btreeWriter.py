@@ -0,0 +1,498 @@
+import sqlite3
+import struct
+from constants import *
+from catalog import tableColumns
+from recordDecoder import recordColumnOrder
+from keyCompare import keyOrder
+
+SQLITE_HEADER_STRING = b"SQLite format 3\x00"
+
+def encodeVarint(value):
+    """
+    return the SQLite varint encoding of a 64-bit integer: 7 bits per byte, big endian,
+    and a 9th byte holding 8 bits for the values that need more than 56 bits
+
+        @param value: the integer, negative values are encoded in two's complement
+    """
+    if 0 <= value < 0x80:
+        return bytes((value,))
+    value &= 0xFFFFFFFFFFFFFFFF
+    if value > 0x00FFFFFFFFFFFFFF:
+        out = [value & 0xFF]
+        value >>= 8
+        for _ in range(8):
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        return bytes(reversed(out))
+
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+def _integerSerialType(value):
+    """return (serial type, body bytes) of an integer, in the smallest serial type that holds it"""
+    if value == 0:
+        return 8, b""
+    if value == 1:
+        return 9, b""
+    for serialType, size in ((1, 1), (2, 2), (3, 3), (4, 4), (5, 6), (6, 8)):
+        if -(1 << (size * 8 - 1)) <= value < (1 << (size * 8 - 1)):
+            return serialType, value.to_bytes(size, "big", signed=True)
+    raise OverflowError("integer does not fit in 64 bits: {}".format(value))
+
+def encodeRecord(values):
+    """
+    return the SQLite record format of a row: the header (its size, then one serial type
+    per column) followed by the body
+
+        @param values: the column values (None, int, float, str or bytes) in record order
+    """
+    serialTypes, body = [], []
+    for value in values:
+        # text first, most columns are text
+        if isinstance(value, str):
+            data = value.encode("utf-8")
+            serialTypes.append(len(data) * 2 + 13)
+            body.append(data)
+        elif value is None:
+            serialTypes.append(0)
+        elif isinstance(value, int):
+            serialType, data = _integerSerialType(int(value))
+            serialTypes.append(serialType)
+            body.append(data)
+        elif isinstance(value, float):
+            serialTypes.append(7)
+            body.append(struct.pack(">d", value))
+        else:
+            data = bytes(value)
+            serialTypes.append(len(data) * 2 + 12)
+            body.append(data)
+
+    # serial types below 0x80 are their own one byte varint
+    header = bytes(serialTypes) if max(serialTypes, default=0) < 0x80 else b"".join(encodeVarint(serialType) for serialType in serialTypes)
+    # the header size counts its own varint
+    headerSize = len(header) + 1
+    if headerSize > 0x7F:
+        headerSize = len(header) + len(encodeVarint(len(header) + 2))
+    return encodeVarint(headerSize) + header + b"".join(body)
+
+def columnAffinity(declaredType):
+    """return the SQLite type affinity of a declared column type (the rules of section 3.1 of datatype3)"""
+    declaredType = declaredType.upper()
+    if "INT" in declaredType:
+        return "INTEGER"
+    if "CHAR" in declaredType or "CLOB" in declaredType or "TEXT" in declaredType:
+        return "TEXT"
+    if "BLOB" in declaredType or not declaredType:
+        return "BLOB"
+    if "REAL" in declaredType or "FLOA" in declaredType or "DOUB" in declaredType:
+        return "REAL"
+    return "NUMERIC"
+
+def applyAffinity(value, affinity):
+    """
+    convert a value the way SQLite does when it is stored in a column of the affinity,
+    e.g. the csv text "181162" stored in an INT column becomes the integer 181162
+
+        @param value: the value to store
+        @param affinity: the column affinity from columnAffinity
+    """
+    if value is None or affinity == "BLOB":
+        return value
+    if affinity == "TEXT":
+        return str(value) if isinstance(value, (int, float)) else value
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            return int(text)
+        except ValueError:
+            try:
+                value = float(text)
+            except ValueError:
+                return value
+    if isinstance(value, float) and affinity != "REAL" and value.is_integer() and abs(value) < (1 << 63):
+        return int(value)
+    if isinstance(value, int) and affinity == "REAL":
+        return float(value)
+    return value
+
+def _localPayloadSize(payloadSize, usableSize, isTable):
+    """return the bytes of a payload stored in the cell itself, the rest goes to overflow pages"""
+    maxLocal = usableSize - 35 if isTable else ((usableSize - 12) * 64 // 255) - 23
+    if payloadSize <= maxLocal:
+        return payloadSize
+    minLocal = ((usableSize - 12) * 32 // 255) - 23
+    local = minLocal + ((payloadSize - minLocal) % (usableSize - 4))
+    return local if local <= maxLocal else minLocal
+
+class pageFile:
+    """
+    the output database file: hands out page numbers in order and writes pages at their offset;
+    page 1 (header and sqlite_master) is reserved and written last
+
+        @param dbPath: the database file, truncated
+        @param pageSize: the page size of the database
+    """
+    def __init__(self, dbPath, pageSize):
+        self.fpt = open(dbPath, "wb")
+        self.pageSize = pageSize
+        self.usableSize = pageSize - RESERVED_PER_PAGE
+        self.nextPage = 2
+
+    def allocate(self):
+        pageNum = self.nextPage
+        self.nextPage += 1
+        return pageNum
+
+    @property
+    def numPages(self):
+        return self.nextPage - 1
+
+    def write(self, pageNum, data):
+        self.fpt.seek((pageNum - 1) * self.pageSize)
+        self.fpt.write(data)
+
+    def writeOverflow(self, data):
+        """write data to a chain of overflow pages and return the first page number"""
+        chunkSize = self.usableSize - POINTER_SIZE
+        pageNums = [self.allocate() for _ in range(0, len(data), chunkSize)]
+        for i, pageNum in enumerate(pageNums):
+            nxtPage = pageNums[i + 1] if i + 1 < len(pageNums) else 0
+            chunk = data[i * chunkSize:(i + 1) * chunkSize]
+            self.write(pageNum, nxtPage.to_bytes(POINTER_SIZE, "big") + chunk + bytes(self.pageSize - POINTER_SIZE - len(chunk)))
+        return pageNums[0]
+
+    def cellSize(self, payload, isTable, prefixSize):
+        """return the size of the cell of a payload, prefixSize being the child pointer and varints before it"""
+        local = _localPayloadSize(len(payload), self.usableSize, isTable)
+        return prefixSize + local + (POINTER_SIZE if local < len(payload) else 0)
+
+    def payloadCell(self, prefix, payload, isTable):
+        """return the cell bytes prefix + local payload (+ first overflow page), writing the overflow chain"""
+        local = _localPayloadSize(len(payload), self.usableSize, isTable)
+        if local == len(payload):
+            return prefix + payload
+        return prefix + payload[:local] + self.writeOverflow(payload[local:]).to_bytes(POINTER_SIZE, "big")
+
+    def buildPage(self, pageType, cells, rightMostPointer=None, headerOffset=0):
+        """
+        return the bytes of a btree page with the cells packed at the end of the page
+
+            @param pageType: one of the four btree page flags
+            @param cells: the cell bytes in key order
+            @param rightMostPointer: the right most child of an interior page
+            @param headerOffset: 100 on page 1, after the database header
+        """
+        page = bytearray(self.pageSize)
+        isLeaf = pageType in (LEAF_TABLE_BTREE_PAGE_FLAG, LEAF_INDEX_BTREE_PAGE_FLAG)
+        headerSize = LEAF_BTREE_PAGE_HEADER_SIZE if isLeaf else INTERIOR_BTREE_PAGE_HEADER_SIZE
+
+        contentStart = self.usableSize
+        for i, cell in enumerate(cells):
+            contentStart -= len(cell)
+            page[contentStart:contentStart + len(cell)] = cell
+            pointerOffset = headerOffset + headerSize + i * CELL_POINTER_SIZE
+            page[pointerOffset:pointerOffset + CELL_POINTER_SIZE] = contentStart.to_bytes(CELL_POINTER_SIZE, "big")
+
+        if headerOffset + headerSize + len(cells) * CELL_POINTER_SIZE > contentStart:
+            raise ValueError("the cells do not fit in one page")
+
+        # type, first freeblock, number of cells, cell content start (0 is 65536), fragmented bytes
+        page[headerOffset] = pageType
+        page[headerOffset + BTREE_NUM_CELLS_OFFSET:headerOffset + BTREE_NUM_CELLS_OFFSET + 2] = len(cells).to_bytes(2, "big")
+        page[headerOffset + BTREE_START_CELLCONTENT_AREA_OFFSET:headerOffset + BTREE_START_CELLCONTENT_AREA_OFFSET + 2] = \
+            (contentStart & 0xFFFF).to_bytes(2, "big")
+        if not isLeaf:
+            page[headerOffset + 8:headerOffset + 12] = rightMostPointer.to_bytes(POINTER_SIZE, "big")
+        return bytes(page)
+
+    def close(self):
+        self.fpt.close()
+
+class tableBtreeBuilder:
+    """
+    bottom-up builder of a rowid table btree: the rows arrive in rowid order, leaf
+    pages are written as soon as they are full (up to fillFactor of the page) and the
+    interior levels are built from the (page, largest rowid) of the level below
+
+        @param pages: the pageFile
+        @param fillFactor: fraction of a leaf page filled before starting the next one
+    """
+    def __init__(self, pages, fillFactor=BULK_FILL_FACTOR):
+        self.pages = pages
+        self.leafBudget = max(int(pages.usableSize * fillFactor), LEAF_BTREE_PAGE_HEADER_SIZE)
+        self.cells = []
+        self.used = LEAF_BTREE_PAGE_HEADER_SIZE
+        self.lastRowid = None
+        # (page number, largest rowid) of every leaf page written
+        self.leaves = []
+
+    def add(self, rowid, payload):
+        """
+        append a row
+            @param rowid: the rowid, larger than the one of the previous row
+            @param payload: the record from encodeRecord
+        """
+        if self.lastRowid is not None and rowid <= self.lastRowid:
+            raise ValueError("rowids must be added in increasing order: {} after {}".format(rowid, self.lastRowid))
+
+        prefix = encodeVarint(len(payload)) + encodeVarint(rowid)
+        size = self.pages.cellSize(payload, True, len(prefix)) + CELL_POINTER_SIZE
+        if self.cells and self.used + size > self.leafBudget:
+            self._writeLeaf()
+        self.cells.append(self.pages.payloadCell(prefix, payload, True))
+        self.used += size
+        self.lastRowid = rowid
+
+    def _writeLeaf(self):
+        pageNum = self.pages.allocate()
+        self.pages.write(pageNum, self.pages.buildPage(LEAF_TABLE_BTREE_PAGE_FLAG, self.cells))
+        self.leaves.append((pageNum, self.lastRowid))
+        self.cells, self.used = [], LEAF_BTREE_PAGE_HEADER_SIZE
+
+    def finish(self):
+        """write the remaining pages and return the root page number"""
+        if self.cells or not self.leaves:
+            self._writeLeaf()
+
+        level = self.leaves
+        while len(level) > 1:
+            level = self._interiorLevel(level)
+        return level[0][0]
+
+    def _interiorLevel(self, children):
+        """write one interior level over children [(page, largest rowid)] and return its own"""
+        parents = []
+        last = len(children) - 1
+        start = 0
+        while start <= last:
+            used, i = INTERIOR_BTREE_PAGE_HEADER_SIZE, start
+            while i < last:
+                size = POINTER_SIZE + len(encodeVarint(children[i][1])) + CELL_POINTER_SIZE
+                if used + size > self.pages.usableSize:
+                    break
+                used += size
+                i += 1
+            # never leave the last child alone on a page without cells
+            if i + 1 == last:
+                i -= 1
+
+            cells = [children[j][0].to_bytes(POINTER_SIZE, "big") + encodeVarint(children[j][1]) for j in range(start, i)]
+            pageNum = self.pages.allocate()
+            self.pages.write(pageNum, self.pages.buildPage(INTERIROR_TABLE_BTREE_PAGE_FLAG, cells, children[i][0]))
+            parents.append((pageNum, children[i][1]))
+            start = i + 1
+        return parents
+
+class indexBtreeBuilder:
+    """
+    bottom-up builder of an index btree (an index, or a WITHOUT ROWID table): the
+    records arrive in key order; every record is stored once, so when a leaf page
+    is full the next record moves up as the divider of the two leaves
+
+        @param pages: the pageFile
+        @param fillFactor: fraction of a leaf page filled before starting the next one
+    """
+    def __init__(self, pages, fillFactor=BULK_FILL_FACTOR):
+        self.pages = pages
+        self.leafBudget = max(int(pages.usableSize * fillFactor), LEAF_BTREE_PAGE_HEADER_SIZE)
+        self.payloads = []
+        self.used = LEAF_BTREE_PAGE_HEADER_SIZE
+        # a full leaf and the record after it, kept until we know another record follows
+        self.heldLeaf = None
+        self.heldDivider = None
+        self.leaves = []
+        self.dividers = []
+
+    def _size(self, payload, prefixSize=0):
+        return self.pages.cellSize(payload, False, prefixSize + len(encodeVarint(len(payload)))) + CELL_POINTER_SIZE
+
+    def add(self, payload):
+        """
+        append a record
+            @param payload: the record from encodeRecord, not smaller than the previous one
+        """
+        if self.heldLeaf is not None:
+            self._writeLeaf(self.heldLeaf)
+            self.dividers.append(self.heldDivider)
+            self.heldLeaf = self.heldDivider = None
+
+        size = self._size(payload)
+        if self.payloads and self.used + size > self.leafBudget:
+            # the record becomes the divider if any record follows it
+            self.heldLeaf, self.heldDivider = self.payloads, payload
+            self.payloads, self.used = [], LEAF_BTREE_PAGE_HEADER_SIZE
+            return
+        self.payloads.append(payload)
+        self.used += size
+
+    def _writeLeaf(self, payloads):
+        cells = [self.pages.payloadCell(encodeVarint(len(payload)), payload, False) for payload in payloads]
+        pageNum = self.pages.allocate()
+        self.pages.write(pageNum, self.pages.buildPage(LEAF_INDEX_BTREE_PAGE_FLAG, cells))
+        self.leaves.append(pageNum)
+
+    def finish(self):
+        """write the remaining pages and return the root page number"""
+        if self.heldLeaf is not None:
+            # the last record has no record after it: it goes into a leaf of its own and
+            # the last record of the held leaf becomes the divider
+            self._writeLeaf(self.heldLeaf[:-1])
+            self.dividers.append(self.heldLeaf[-1])
+            self.payloads = [self.heldDivider]
+        if self.payloads or not self.leaves:
+            self._writeLeaf(self.payloads)
+
+        children, dividers = self.leaves, self.dividers
+        while len(children) > 1:
+            children, dividers = self._interiorLevel(children, dividers)
+        return children[0]
+
+    def _interiorLevel(self, children, dividers):
+        """write one interior level over children and the dividers between them, return its own"""
+        parents, parentDividers = [], []
+        last = len(children) - 1
+        start = 0
+        while start <= last:
+            used, i = INTERIOR_BTREE_PAGE_HEADER_SIZE, start
+            while i < last:
+                size = self._size(dividers[i], POINTER_SIZE)
+                if used + size > self.pages.usableSize:
+                    break
+                used += size
+                i += 1
+            # never leave the last child alone on a page without cells
+            if i + 1 == last:
+                i -= 1
+
+            cells = [self.pages.payloadCell(children[j].to_bytes(POINTER_SIZE, "big") + encodeVarint(len(dividers[j])), dividers[j], False)
+                     for j in range(start, i)]
+            pageNum = self.pages.allocate()
+            self.pages.write(pageNum, self.pages.buildPage(INTERIOR_INDEX_BTREE_PAGE_FLAG, cells, children[i]))
+            parents.append(pageNum)
+            if i < last:
+                parentDividers.append(dividers[i])
+            start = i + 1
+        return parents, parentDividers
+
+def _databaseHeader(pageSize, numPages):
+    """return the 100 byte database file header"""
+    version = sqlite3.sqlite_version_info
+    header = bytearray(DATABASE_FILE_HEADER_SIZE)
+    header[0:16] = SQLITE_HEADER_STRING
+    header[16:18] = (1 if pageSize == 65536 else pageSize).to_bytes(2, "big")
+    # file format write/read version 1 (rollback journal), reserved bytes, payload fractions 64/32/32
+    header[18:24] = bytes([1, 1, RESERVED_PER_PAGE, 64, 32, 32])
+    struct.pack_into(">IIIIIIIIIIII", header, 24,
+                     1,         # file change counter
+                     numPages,  # database size in pages
+                     0, 0,      # no freelist
+                     1,         # schema cookie
+                     4,         # schema format
+                     0, 0,      # default cache size, no auto vacuum
+                     1,         # UTF-8
+                     0, 0, 0)   # user version, incremental vacuum, application id
+    struct.pack_into(">II", header, 92, 1, version[0] * 1000000 + version[1] * 1000 + version[2])
+    return bytes(header)
+
+def bulkLoad(dbPath, pageSize, tableName, createSql, rows, fillFactor=BULK_FILL_FACTOR):
+    """
+    write a new database file with one table and its primary key index directly,
+    without sqlite3: the btrees are built bottom-up from the rows
+
+    -rowid table: the rows become rowids 1, 2, ... in the order given
+    -rowid table with a PRIMARY KEY: also the sqlite_autoindex_<table>_1 index,
+        sorted in memory on (key, rowid)
+    -WITHOUT ROWID table: the rows must come sorted on the primary key
+
+    return {"pages": number of pages, "rows": number of rows}
+        @param dbPath: the database file, replaced
+        @param pageSize: 512 to 65536
+        @param tableName: the table name
+        @param createSql: the CREATE TABLE statement, without semicolon
+        @param rows: the rows, values in declared column order (csv text is converted by column affinity)
+        @param fillFactor: fraction of every leaf page filled
+    """
+    columns, primaryKey, withoutRowid = tableColumns(createSql)
+    names = [name for name, _ in columns]
+    affinities = [columnAffinity(declaredType) for _, declaredType in columns]
+    # an INTEGER PRIMARY KEY is the rowid itself and is stored as NULL
+    rowidAlias = primaryKey[0] if not withoutRowid and len(primaryKey) == 1 and dict(columns)[primaryKey[0]].upper() == "INTEGER" else None
+    recordOrder = [names.index(name) for name, _ in recordColumnOrder(createSql)]
+    keyPositions = [names.index(name) for name in primaryKey]
+
+    pages = pageFile(dbPath, pageSize)
+    tree = indexBtreeBuilder(pages, fillFactor) if withoutRowid else tableBtreeBuilder(pages, fillFactor)
+    indexEntries = [] if primaryKey and not withoutRowid and rowidAlias is None else None
+    previousKey, numRows = None, 0
+
+    for rowid, row in enumerate(rows, 1):
+        values = [applyAffinity(value, affinity) for value, affinity in zip(row, affinities)]
+        numRows += 1
+
+        if withoutRowid:
+            key = [keyOrder(values[position]) for position in keyPositions]
+            if previousKey is not None and key <= previousKey:
+                raise ValueError("a WITHOUT ROWID table needs rows sorted on a unique primary key: {}".format(row))
+            previousKey = key
+            tree.add(encodeRecord([values[position] for position in recordOrder]))
+            continue
+
+        if rowidAlias is not None:
+            rowid = values[names.index(rowidAlias)]
+            values[names.index(rowidAlias)] = None
+        tree.add(rowid, encodeRecord(values))
+        if indexEntries is not None:
+            indexEntries.append(([values[position] for position in keyPositions], rowid))
+
+    master = [("table", tableName, tableName, tree.finish(), createSql)]
+
+    if indexEntries is not None:
+        indexEntries.sort(key=lambda entry: ([keyOrder(value) for value in entry[0]], entry[1]))
+        for (key, _), (nxtKey, _) in zip(indexEntries, indexEntries[1:]):
+            if key == nxtKey:
+                raise ValueError("duplicate primary key: {}".format(key))
+        index = indexBtreeBuilder(pages, fillFactor)
+        for key, rowid in indexEntries:
+            index.add(encodeRecord(key + [rowid]))
+        master.append(("index", "sqlite_autoindex_{}_1".format(tableName), tableName, index.finish(), None))
+
+    # page 1: the header and the sqlite_master table, a single leaf
+    cells = []
+    for rowid, entry in enumerate(master, 1):
+        payload = encodeRecord(list(entry))
+        cells.append(pages.payloadCell(encodeVarint(len(payload)) + encodeVarint(rowid), payload, True))
+    firstPage = bytearray(pages.buildPage(LEAF_TABLE_BTREE_PAGE_FLAG, cells, headerOffset=DATABASE_FILE_HEADER_SIZE))
+    firstPage[:DATABASE_FILE_HEADER_SIZE] = _databaseHeader(pageSize, pages.numPages)
+    pages.write(1, bytes(firstPage))
+    pages.close()
+
+    return {"pages": pages.numPages, "rows": numRows}
+
+def bulkLoadEmployees(csvPath, dbPath, withIndex, clustered, pageSize, fillFactor=BULK_FILL_FACTOR):
+    """
+    the bulkLoad version of create_db + populate_data_to_db: same schema, same rows
+    (the first row of every Emp ID), sorted on Emp ID for the indexed layouts
+
+        @param csvPath: the employee csv
+        @param dbPath: the database file
+        @param withIndex: "Emp ID" is the primary key
+        @param clustered: WITHOUT ROWID table
+        @param pageSize: the page size of the database
+        @param fillFactor: fraction of every leaf page filled
+    """
+    from csvParser import build_db_abstraction, table_definition_sql
+
+    col_dict, col_size_dict, col_names, _ = build_db_abstraction(csvPath)
+    seen, rows = set(), []
+    for values in zip(*[col_dict[name] for name in col_names]):
+        if values[0] not in seen:
+            seen.add(values[0])
+            rows.append(values)
+    if withIndex:
+        rows.sort(key=lambda values: int(values[0]))
+
+    return bulkLoad(dbPath, pageSize, "Employee", table_definition_sql(withIndex, clustered, col_names, col_size_dict), rows, fillFactor)
@@ -0,0 +1,155 @@
+import re
+from constants import *
+
+def _splitTopLevel(definition):
+    """split a column list on the commas that are not inside parentheses"""
+    items, depth, current = [], 0, ""
+    for char in definition:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            items.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        items.append(current.strip())
+    return items
+
+def _columnList(definition):
+    """return the column names of "(a, b DESC, c COLLATE NOCASE)" without order or collation"""
+    return [item.split()[0].strip('"`[]') for item in _splitTopLevel(definition)]
+
+def tableColumns(sql):
+    """
+    parse a CREATE TABLE statement
+
+    return (list of (column name, declared type), list of primary key columns, without rowid)
+        @param sql: the CREATE TABLE statement from sqlite_master
+    """
+    body = sql[sql.index("(") + 1:sql.rindex(")")]
+    columns, primaryKey = [], []
+
+    for item in _splitTopLevel(body):
+        upper = item.upper()
+        # table constraints: PRIMARY KEY(a, b), UNIQUE(...), CHECK(...), FOREIGN KEY ...
+        if upper.startswith(("PRIMARY KEY", "CONSTRAINT", "UNIQUE", "CHECK", "FOREIGN")):
+            if "PRIMARY KEY" in upper:
+                primaryKey = _columnList(item[item.index("(") + 1:item.rindex(")")])
+            continue
+
+        parts = item.split(None, 1)
+        name = parts[0].strip('"`[]')
+        declaredType = re.split(r"\b(PRIMARY|NOT|NULL|UNIQUE|DEFAULT|COLLATE|CHECK|REFERENCES)\b",
+                                parts[1], flags=re.IGNORECASE)[0].strip() if len(parts) > 1 else ""
+        columns.append((name, declaredType))
+        if "PRIMARY KEY" in upper:
+            primaryKey = [name]
+
+    withoutRowid = "WITHOUT ROWID" in sql[sql.rindex(")"):].upper()
+    return columns, primaryKey, withoutRowid
+
+def indexColumns(schema, indexName):
+    """
+    return the columns stored in each record of an index, in record order;
+    for an index on a rowid table the last field of the record is the rowid
+
+        @param schema: the catalog returned by parseSchema
+        @param indexName: the index name, e.g. sqlite_autoindex_Employee_1
+    """
+    entry = schema[indexName]
+    columns, primaryKey, withoutRowid = tableColumns(schema[entry["tableName"]]["sql"])
+
+    if entry["sql"]:
+        definition = entry["sql"]
+        keyColumns = _columnList(definition[definition.index("(") + 1:definition.rindex(")")])
+    else:
+        # automatic index created for the PRIMARY KEY (or a UNIQUE constraint) of the table
+        keyColumns = primaryKey
+
+    if withoutRowid:
+        # the record of a WITHOUT ROWID index also stores the primary key columns it does not include
+        return keyColumns + [name for name in primaryKey if name not in keyColumns]
+    return keyColumns + ["rowid"]
+
+def _keyItem(item):
+    """return (column name, collation or None, descending) of "b COLLATE NOCASE DESC" in an index column list"""
+    words = item.split()
+    upper = [word.upper() for word in words]
+    collation = words[upper.index("COLLATE") + 1].upper() if "COLLATE" in upper[:-1] else None
+    return words[0].strip('"`[]'), collation, upper[-1] == "DESC"
+
+def _columnCollations(sql):
+    """return {column name: collation} for the columns of a CREATE TABLE declared with COLLATE"""
+    body = sql[sql.index("(") + 1:sql.rindex(")")]
+    collations = {}
+    for item in _splitTopLevel(body):
+        match = re.search(r"\bCOLLATE\s+(\w+)", item, flags=re.IGNORECASE)
+        if match and not item.upper().startswith(("PRIMARY KEY", "CONSTRAINT", "UNIQUE", "CHECK", "FOREIGN")):
+            collations[item.split()[0].strip('"`[]')] = match.group(1).upper()
+    return collations
+
+def indexKeyColumns(schema, name):
+    """
+    return the sort order of the records of an index, or of a WITHOUT ROWID table,
+    as a list of (column name, collation, descending) in record order;
+    a column without COLLATE in the index uses the collation of the table column, BINARY by default,
+    the rowid (or the primary key columns) appended to the record compare BINARY ascending
+
+        @param schema: the catalog returned by parseSchema
+        @param name: the index name, or the name of a WITHOUT ROWID table
+    """
+    entry = schema[name]
+    tableSql = schema[entry["tableName"]]["sql"]
+    _, primaryKey, withoutRowid = tableColumns(tableSql)
+    collations = _columnCollations(tableSql)
+
+    if entry["sql"] and entry["type"] == "index":
+        definition = entry["sql"]
+        items = [_keyItem(item) for item in _splitTopLevel(definition[definition.index("(") + 1:definition.rindex(")")])]
+    else:
+        # automatic index or WITHOUT ROWID table: ordered on the PRIMARY KEY definition
+        items = [(column, None, False) for column in primaryKey]
+        for item in re.findall(r"PRIMARY\s+KEY\s*\(([^)]*)\)", tableSql, flags=re.IGNORECASE)[:1]:
+            items = [_keyItem(part) for part in _splitTopLevel(item)]
+
+    keyColumns = [(column, collation or collations.get(column, "BINARY"), descending) for column, collation, descending in items]
+    if entry["type"] == "table":
+        return keyColumns
+
+    names = [column for column, _, _ in keyColumns]
+    if withoutRowid:
+        return keyColumns + [(column, collations.get(column, "BINARY"), False) for column in primaryKey if column not in names]
+    return keyColumns + [("rowid", "BINARY", False)]
+
+def tableIndexes(schema, tableName):
+    """
+    return the names of the indexes of a table
+        @param schema: the catalog returned by parseSchema
+        @param tableName: the table name
+    """
+    return [name for name, entry in schema.items() if entry["type"] == "index" and entry["tableName"] == tableName]
+
+def coveringIndex(schema, tableName, referencedColumns, keyColumn=None):
+    """
+    return the name of an index whose records contain every referenced column,
+    so the query can be answered from index pages only; None if there is none
+
+        @param schema: the catalog returned by parseSchema
+        @param tableName: the table name
+        @param referencedColumns: every column the query reads (predicate and output)
+        @param keyColumn: if given, the index must also be ordered on this column first
+    """
+    wanted = set(referencedColumns)
+    _, _, withoutRowid = tableColumns(schema[tableName]["sql"])
+
+    for name in tableIndexes(schema, tableName):
+        # the primary key index of a WITHOUT ROWID table is the table itself
+        if withoutRowid and schema[name]["rootPage"] == schema[tableName]["rootPage"]:
+            continue
+        columns = indexColumns(schema, name)
+        if wanted.issubset(columns) and (keyColumn is None or columns[0] == keyColumn):
+            return name
+    return None
@@ -18,6 +18,74 @@ PAGE_SIZE_16K = 16384
 POINTER_SIZE = 4
 RESERVED_PER_PAGE = 0
 
+# read-ahead for full scans: max pages fetched by one large read
+READ_AHEAD_DEPTH = 32
+USE_FADVISE = True
+
+# background prefetch of interior-page children: max pages held/in flight and worker threads
+PREFETCH_DEPTH = 64
+PREFETCH_THREADS = 4
+
+# query result cache bounds: number of cached queries and total cached rows
+RESULT_CACHE_ENTRIES = 128
+RESULT_CACHE_ROWS = 100000
+
+# planner: leaves sampled per btree for column histograms, selectivity assumed without statistics
+PLANNER_SAMPLE_LEAVES = 8
+DEFAULT_SELECTIVITY = 0.1
+
+# hash aggregation: groups held in memory before spilling, spill files, max re-partitioning depth
+AGGREGATE_MAX_GROUPS = 100000
+AGGREGATE_SPILL_PARTITIONS = 16
+AGGREGATE_MAX_SPILL_DEPTH = 4
+
+# joins: hash join build rows held in memory, spill files per side, max re-partitioning depth,
+# rows per pickled spill chunk, rowids fetched per table descent when an index orders a merge join input
+JOIN_MAX_BUILD_ROWS = 100000
+JOIN_PARTITIONS = 16
+JOIN_MAX_PARTITION_DEPTH = 4
+JOIN_SPILL_CHUNK = 1024
+JOIN_FETCH_BATCH = 256
+
+# bulk btree writer: fraction of every leaf page filled
+BULK_FILL_FACTOR = 0.9
+
+# parallel csv parsing: smallest byte range handed to a process, byte ranges per process
+CSV_MIN_CHUNK_BYTES = 1 << 20
+CSV_CHUNKS_PER_WORKER = 4
+
+# rowid bitmaps: a chunk of 65536 rowids holding more rowids than this is stored as a bitmap, not an array
+BITMAP_ARRAY_MAX = 4096
+
+# approximate answers: pages read per query, confidence level of the intervals, walks per page of budget at most
+SAMPLE_PAGE_BUDGET = 200
+SAMPLE_CONFIDENCE = 0.95
+SAMPLE_WALKS_PER_PAGE = 4
+
+# key location cache: max number of key -> (page, cell index) entries
+LOCATION_CACHE_ENTRIES = 100000
+
+# two tier page cache: byte budgets of the plain and of the compressed pages, codec ("zlib" or "lzma") and level
+PAGE_CACHE_HOT_BYTES = 4 * 1024 * 1024
+PAGE_CACHE_COMPRESSED_BYTES = 16 * 1024 * 1024
+PAGE_CACHE_CODEC = "zlib"
+PAGE_CACHE_LEVEL = 1
+
+# shard router: the column the shards are partitioned on
+SHARD_KEY_COLUMN = "Emp_ID"
+
+# result sinks: rows per batch, formatted bytes buffered before a write, batches queued for a slow consumer
+RESULT_SINK_BATCH_ROWS = 1024
+RESULT_SINK_BUFFER_BYTES = 1024 * 1024
+RESULT_SINK_QUEUE_BATCHES = 8
+
+# memory governor: bytes a query may hold in rows and page copies, share of it a page cache may take
+QUERY_MEMORY_BUDGET = 64 * 1024 * 1024
+MEMORY_PAGE_CACHE_SHARE = 0.5
+
+# upper bounds (milliseconds) of the per page read latency histogram buckets
+LATENCY_BUCKETS_MS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+
 DB_PATH1="C:\\Users\\Max You\\Desktop\\COURSES\\CSC443\\db1.db"
 DB_PATH2="C:\\Users\\Max You\\Desktop\\COURSES\\CSC443\\db2.db"
 DB_PATH3="C:\\Users\\Max You\\Desktop\\COURSES\\CSC443\\db3.db"
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import sqlite3
+import sys
 import csv
 from constants import *
 
@@ -53,6 +54,87 @@ def build_db_abstraction(csv_file_path):
             
     return column_dict, max_attribute_length, col_names, unique_emp
 
+def scan_csv_columns(csv_file_path):
+    """
+    the column names and max value sizes of build_db_abstraction, read one row at a time
+    so that nothing but the sizes is kept in memory
+    @return a list of column names, a dictionary of max value size for each column
+    """
+    with open(csv_file_path, 'r') as data_file:
+        iterator = csv.reader(data_file, delimiter=',')
+        col_names = iterator.__next__()
+        max_attribute_length = dict.fromkeys(col_names, 0)
+
+        for row_data in iterator:
+            for name, col_data in zip(col_names, row_data):
+                if len(col_data) > max_attribute_length[name]:
+                    max_attribute_length[name] = len(col_data)
+
+    return col_names, max_attribute_length
+
+def stream_populate_db(csv_file_path, db_path, table, budget=None, batch_rows=RESULT_SINK_BATCH_ROWS):
+    """
+    populate_data_to_db without build_db_abstraction: the rows are read from the csv and
+    inserted in batches, only the employee ids seen so far are kept in memory; once they
+    exceed the memory budget they are spilled to a temporary table and checked there
+
+        @param csv_file_path: the employee csv
+        @param db_path: the database path that want to be populated with data (create_db first)
+        @param table: the table name
+        @param budget: the memoryBudget the seen employee ids are charged to, the one of the running query by default
+        @param batch_rows: rows inserted per executemany
+    """
+    from memoryGovernor import currentBudget, memoryBudget
+
+    budget = budget or currentBudget() or memoryBudget()
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    # an empty file name is a temporary database, on disk once it outgrows its cache;
+    # attached first as it cannot be attached within the insert transaction
+    cursor.execute("ATTACH DATABASE '' AS spill;")
+    unique_employees, unique_bytes, spilled = set(), 0, False
+
+    with open(csv_file_path, 'r') as data_file:
+        iterator = csv.reader(data_file, delimiter=',')
+        col_names = iterator.__next__()
+        insert_definition = 'INSERT INTO {} VALUES({});'.format(table, ",".join(['?'] * len(col_names)))
+        batch = []
+
+        for row_data in iterator:
+            # a blank line is read as an empty row
+            if not row_data:
+                continue
+
+            # if the employee has been seen ==> skip to the nxt record
+            emp_id = row_data[0]
+            if spilled:
+                cursor.execute('INSERT OR IGNORE INTO spill.unique_employees VALUES(?);', (emp_id,))
+                if cursor.rowcount == 0:
+                    continue
+            else:
+                if emp_id in unique_employees:
+                    continue
+                unique_employees.add(emp_id)
+                unique_bytes += sys.getsizeof(emp_id)
+                budget.charge(sys.getsizeof(emp_id))
+                if budget.exceeded():
+                    cursor.execute('CREATE TABLE spill.unique_employees(emp_id PRIMARY KEY);')
+                    cursor.executemany('INSERT INTO spill.unique_employees VALUES(?);', ((e,) for e in unique_employees))
+                    budget.recordSpill(len(unique_employees), unique_bytes)
+                    budget.release(unique_bytes)
+                    unique_employees, unique_bytes, spilled = set(), 0, True
+
+            batch.append(row_data)
+            if len(batch) >= batch_rows:
+                cursor.executemany(insert_definition, batch)
+                batch = []
+
+        cursor.executemany(insert_definition, batch)
+
+    budget.release(unique_bytes)
+    connection.commit()
+    connection.close()
+
 def cleaned_version(name):
     """
     make a clean versino of the name so that no error occurs in the CREATE TABLE statement
@@ -90,6 +172,21 @@ def create_db(with_index, clustered, page_size, db_path, table_name, col_names,
     cursor.execute('PRAGMA page_size={};'.format(page_size))
     connection.commit()
 
+    cursor.execute(table_definition_sql(with_index, clustered, col_names, attr_size) + ";")
+    connection.commit()
+    
+    connection.close()
+
+def table_definition_sql(with_index, clustered, col_names, attr_size):
+    """
+    return the CREATE TABLE statement of the Employee table (without the final semicolon),
+    also used by the btreeWriter bulk loader so both produce the same schema
+
+        @param with_index: make "Emp ID" the primary key
+        @param clustered: create a WITHOUT ROWID table
+        @param col_names: a list of column names in the csv file
+        @param attr_size: a dictionary of max value size for each column
+    """
     # build skeleton sql string
     table_definition = "CREATE TABLE Employee("
 
@@ -125,12 +222,8 @@ def create_db(with_index, clustered, page_size, db_path, table_name, col_names,
     # handle cluster
     if clustered:
         table_definition += " WITHOUT ROWID"
-    table_definition += ";"
 
-    cursor.execute(table_definition)
-    connection.commit()
-    
-    connection.close()
+    return table_definition
 
 
 # insert data row by row into the database
@@ -0,0 +1,199 @@
+import hashlib
+import os
+import pickle
+from collections import Counter
+from constants import *
+from utils import parseSchema, readPage, readCounts, fileSignature, isWalMode, recordAccessMethod, printEmpIDFullname
+from queryOperations import readResetBookkeepings
+from recordDecoder import decodeCells, decoderFor
+from resultCache import normalizePredicate
+from walReader import walFile
+
+def _fingerprint(pages):
+    """return the checksum of the bytes of a btree page followed by its overflow pages"""
+    digest = hashlib.blake2b(digest_size=16)
+    for page in pages:
+        digest.update(page)
+    return digest.digest()
+
+class _recordingSource:
+    """page source that remembers the pages read through it, to learn the overflow pages of a btree page"""
+    def __init__(self, fpt):
+        self.fpt = fpt
+        self.pageNums = []
+        self.pages = []
+
+    def fetchPage(self, pageNum, pageSize):
+        page = readPage(pageNum, self.fpt, pageSize)
+        self.pageNums.append(pageNum)
+        self.pages.append(page)
+        return page
+
+class incrementalScanState:
+    """
+    what the last run of every incremental scan saw, per btree page:
+    page number -> (fingerprint, overflow pages, child pages or None, matching rows as [(cell index, row)])
+
+        @param persistPath: optional pickle file the state is loaded from and saved to
+    """
+    def __init__(self, persistPath=None):
+        self.persistPath = persistPath
+        # (database path, table, normalized predicate) -> {"signature", "rootPage", "pages"}
+        self.scans = {}
+
+        if persistPath and os.path.exists(persistPath):
+            self.load()
+
+    def save(self):
+        """write the state to persistPath, replacing the previous file atomically"""
+        if not self.persistPath:
+            return
+        tmpPath = self.persistPath + ".tmp"
+        with open(tmpPath, "wb") as out:
+            pickle.dump(self.scans, out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, self.persistPath)
+
+    def load(self):
+        with open(self.persistPath, "rb") as f:
+            self.scans = pickle.load(f)
+
+    def invalidate(self, dbPath=None):
+        """
+        forget the scans of dbPath, or every scan when no path is given
+            @param dbPath: path of the database file
+        """
+        path = os.path.abspath(dbPath) if dbPath else None
+        for key in [key for key in self.scans if path is None or key[0] == path]:
+            del self.scans[key]
+
+def _rowsInTreeOrder(pages, pageNum):
+    """yield the matching rows of the subtree of pageNum in btree order"""
+    _, _, children, rows = pages[pageNum]
+    if children is None:
+        for _, row in rows:
+            yield row
+        return
+
+    # the record of interior cell i (index btrees only) sits between child i and child i + 1
+    rowsByCell = {}
+    for cellIndex, row in rows:
+        rowsByCell.setdefault(cellIndex, []).append(row)
+    for i, child in enumerate(children):
+        yield from _rowsInTreeOrder(pages, child)
+        yield from rowsByCell.get(i, ())
+
+def incrementalScan(state, dbPath, pageSize, table, predicate, matches):
+    """
+    full scan of table for the rows matching a predicate that only decodes the pages
+    changed since the last run with the same predicate
+
+    every btree page is still read and fingerprinted (with its overflow pages), but a page whose
+    fingerprint matches the last run reuses its stored matching rows, and for an interior page
+    its stored child pointers; a split, merge or move changes the parent page, whose children are
+    then taken from the new page and checked in turn, so the affected subtree is re-scanned.
+    pages are matched by number and content, so a page moved to another number is re-decoded.
+    when the fileSignature did not change (rollback journal mode) nothing is read at all; in WAL
+    mode the pages are read through walFile, so the commits not yet checkpointed are seen
+
+    return (the matching rows in btree order, statistics of the run including the rows added
+            and removed since the last run)
+        @param state: an incrementalScanState
+        @param dbPath: path of the database file
+        @param pageSize: the page size of the database
+        @param table: the table name
+        @param predicate: the predicate tuple identifying the query, see resultCache.normalizePredicate
+        @param matches: function(record) -> bool evaluating the predicate on a decoded row
+    """
+    key = (os.path.abspath(dbPath), table, normalizePredicate(predicate))
+    previous = state.scans.get(key)
+    stats = {"pagesRead": 0, "pagesDecoded": 0, "pagesReused": 0, "rowsAdded": 0, "rowsRemoved": 0}
+
+    db_binary = open(dbPath, "rb")
+    walMode = isWalMode(db_binary)
+    if walMode:
+        db_binary = walFile(db_binary)
+
+    with db_binary:
+        signature = fileSignature(db_binary)
+        if previous is not None and previous.get("signature") == signature and not walMode:
+            recordAccessMethod("incremental-unchanged")
+            stats["pagesReused"] = len(previous["pages"])
+            return list(_rowsInTreeOrder(previous["pages"], previous["rootPage"])), stats
+
+        schema = parseSchema(db_binary, pageSize)
+        rootPage = schema[table]["rootPage"]
+        decode = decoderFor(schema, table)
+        # a table dropped and created again starts over
+        oldPages = previous["pages"] if previous is not None and previous["rootPage"] == rootPage else {}
+        newPages = {}
+        added, removed = Counter(), Counter()
+
+        recordAccessMethod("incremental-scan")
+        pending = [(rootPage, 0)]
+        while pending:
+            pageNum, level = pending.pop()
+            page = readPage(pageNum, db_binary, pageSize)
+            readCounts(page[0], level)
+            stats["pagesRead"] += 1
+
+            old = oldPages.get(pageNum)
+            if old is not None:
+                overflow = [readPage(overflowNum, db_binary, pageSize) for overflowNum in old[1]]
+                stats["pagesRead"] += len(overflow)
+                if _fingerprint([page] + overflow) == old[0]:
+                    stats["pagesReused"] += 1
+                    newPages[pageNum] = old
+                    if old[2] is not None:
+                        pending.extend((child, level + 1) for child in reversed(old[2]))
+                    continue
+                removed.update(row for _, row in old[3])
+
+            # new or changed page: decode it and learn its overflow pages
+            source = _recordingSource(db_binary)
+            children, rows = [], []
+            for cellIndex, (child, row) in enumerate(decodeCells(page, decode, source, pageSize)):
+                if child:
+                    children.append(child)
+                if row is not None and matches(row):
+                    rows.append((cellIndex, row))
+            isInterior = page[0] in (INTERIROR_TABLE_BTREE_PAGE_FLAG, INTERIOR_INDEX_BTREE_PAGE_FLAG)
+            if isInterior:
+                children.append(int.from_bytes(page[8:12], "big"))
+
+            stats["pagesDecoded"] += 1
+            stats["pagesRead"] += len(source.pageNums)
+            added.update(row for _, row in rows)
+            newPages[pageNum] = (_fingerprint([page] + source.pages), source.pageNums, children if isInterior else None, rows)
+            if isInterior:
+                pending.extend((child, level + 1) for child in reversed(children))
+
+        # the pages of the last run that are no longer in the tree
+        for pageNum, old in oldPages.items():
+            if pageNum not in newPages:
+                removed.update(row for _, row in old[3])
+
+    # a row that only moved to another page is neither added nor removed
+    stats["rowsAdded"] = sum((added - removed).values())
+    stats["rowsRemoved"] = sum((removed - added).values())
+    state.scans[key] = {"signature": signature, "rootPage": rootPage, "pages": newPages}
+    return list(_rowsInTreeOrder(newPages, rootPage)), stats
+
+def db_A_Query_IncrementalLastName(pageSize):
+    """
+    DB: Without any index with page size of 4KB
+    Ops: print the employees whose last name is "Rowe", decoding only the pages changed since the last run
+    """
+    print("DB: Without any index with page size of 4KB")
+    print("Query and print the employees whose last name is \"Rowe\" (this is an incremental Scan)")
+
+    state = incrementalScanState(DB_PATH1 + ".incremental")
+    rows, stats = incrementalScan(state, DB_PATH1, pageSize, 'Employee', ("eq", "Last_Name", LAST_NAME),
+                                  lambda record: record[LAST_NAME_INDEX] == LAST_NAME)
+    state.save()
+    for record in rows:
+        printEmpIDFullname(record)
+    print(stats)
+
+if __name__ == "__main__":
+    db_A_Query_IncrementalLastName(PAGE_SIZE_4K)
+    readResetBookkeepings()
@@ -0,0 +1,137 @@
+import os
+from constants import *
+from metrics import currentMetrics
+
+class readAheadFile:
+    """
+    wrap a db file pointer so a full scan reads runs of ascending leaf pages
+    with one large read instead of one small read per page
+
+    btreeScan hands the child pointers of every interior page to schedule();
+    when the traversal asks for the first page of an ascending run of
+    consecutive page numbers, the whole run (up to readAheadDepth pages)
+    is read into a preallocated buffer and the following pages are served
+    from it
+
+        @param fpt: the file pointer of the db file (opened in "rb")
+        @param pageSize: the page size of the database
+        @param readAheadDepth: max number of pages fetched by one read
+        @param useFadvise: hint the kernel with posix_fadvise(WILLNEED) for each scheduled run
+    """
+    def __init__(self, fpt, pageSize, readAheadDepth=READ_AHEAD_DEPTH, useFadvise=USE_FADVISE):
+        self.fpt = fpt
+        self.fd = fpt.fileno()
+        self.pageSize = pageSize
+        self.readAheadDepth = max(1, readAheadDepth)
+        self.useFadvise = useFadvise and hasattr(os, 'posix_fadvise')
+
+        # preallocated read-ahead buffer and the page range it currently holds
+        self.buffer = bytearray(pageSize * self.readAheadDepth)
+        self.bufferView = memoryview(self.buffer)
+        self.bufferStart = 0
+        self.bufferPages = 0
+
+        # upcoming child pages of the last decoded interior page: page -> position
+        self.upcoming = []
+        self.upcomingPos = {}
+
+        self.resetStats()
+
+    def schedule(self, pageNums):
+        """
+        remember the child pages the traversal is about to visit, in visiting order
+            @param pageNums: the child page numbers of an interior page
+        """
+        self.upcoming = list(pageNums)
+        self.upcomingPos = {pageNum: i for i, pageNum in enumerate(self.upcoming)}
+
+        if self.useFadvise:
+            for start, length in self._runs(0, len(self.upcoming), len(self.upcoming)):
+                os.posix_fadvise(self.fd, (start - 1) * self.pageSize, length * self.pageSize, os.POSIX_FADV_WILLNEED)
+                self.syscalls += 1
+
+    def fetchPage(self, pageNum, pageSize):
+        """
+        return the page as bytes, from the read-ahead buffer if possible
+            @param pageNum: the page number to fetch
+            @param pageSize: the page size of the database
+        """
+        if self.bufferStart <= pageNum < self.bufferStart + self.bufferPages:
+            self.readAheadHits += 1
+            start = (pageNum - self.bufferStart) * pageSize
+            return bytes(self.bufferView[start:start + pageSize])
+
+        pos = self.upcomingPos.get(pageNum)
+        if pos is not None:
+            # read the ascending run that starts at this page in one go
+            _, length = next(self._runs(pos, len(self.upcoming), self.readAheadDepth))
+            if length > 1:
+                self._fill(pageNum, length)
+                self.readAheadHits += 1
+                return bytes(self.bufferView[:pageSize])
+
+        self.syscalls += 1
+        self.pagesRead += 1
+        page = os.pread(self.fd, pageSize, (pageNum - 1) * pageSize)
+
+        metrics = currentMetrics()
+        if metrics is not None:
+            metrics.recordPhysicalRead(1, len(page))
+        return page
+
+    def _runs(self, begin, end, maxLength):
+        """
+        yield (first page, number of pages) for each ascending run of consecutive
+        page numbers in self.upcoming[begin:end], each run at most maxLength long
+        """
+        i = begin
+        while i < end:
+            start, length = self.upcoming[i], 1
+            while i + length < end and length < maxLength and self.upcoming[i + length] == start + length:
+                length += 1
+            yield start, length
+            i += length
+
+    def _fill(self, firstPage, numPages):
+        """read numPages pages starting at firstPage into the read-ahead buffer with one syscall"""
+        size = numPages * self.pageSize
+        offset = (firstPage - 1) * self.pageSize
+        if hasattr(os, 'preadv'):
+            read = os.preadv(self.fd, [self.bufferView[:size]], offset)
+        else:
+            self.fpt.seek(offset, 0)
+            read = self.fpt.readinto(self.bufferView[:size])
+
+        self.bufferStart = firstPage
+        self.bufferPages = read // self.pageSize
+        self.syscalls += 1
+        self.largeReads += 1
+        self.pagesRead += self.bufferPages
+
+        metrics = currentMetrics()
+        if metrics is not None:
+            metrics.recordPhysicalRead(self.bufferPages, read)
+
+    def stats(self):
+        """return the io statistics of the scan since the last reset"""
+        return {"syscalls": self.syscalls,
+                "largeReads": self.largeReads,
+                "pagesRead": self.pagesRead,
+                "readAheadHits": self.readAheadHits}
+
+    def resetStats(self):
+        """reset the io statistics, typically before each scan"""
+        self.syscalls = 0
+        self.largeReads = 0
+        self.pagesRead = 0
+        self.readAheadHits = 0
+
+    def __getattr__(self, name):
+        # behave like the wrapped file pointer for everything else (seek, read, close ...)
+        return getattr(self.fpt, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fpt.close()
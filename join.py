@@ -0,0 +1,322 @@
+import os
+import pickle
+import tempfile
+from itertools import chain
+from constants import *
+from metrics import currentMetrics
+from utils import parseSchema, recordAccessMethod
+from catalog import tableColumns, tableIndexes, indexColumns
+from recordDecoder import compiledRows, compiledGetMany, decoderFor, indexDecoderFor, recordColumnOrder
+from queryOperations import readResetBookkeepings
+from keyCompare import keyOrder
+
+class countingPageSource:
+    """
+    page source counting the pages read through it, so each input of a join
+    reports its own page reads even when both sides are the same file
+
+        @param fpt: the file pointer of the db, or another page source
+    """
+    def __init__(self, fpt):
+        self.fpt = fpt
+        self.pagesRead = 0
+
+    def fetchPage(self, pageNum, pageSize):
+        self.pagesRead += 1
+        if hasattr(self.fpt, 'fetchPage'):
+            return self.fpt.fetchPage(pageNum, pageSize)
+
+        page = os.pread(self.fpt.fileno(), pageSize, (pageNum - 1) * pageSize)
+        metrics = currentMetrics()
+        if metrics is not None:
+            metrics.recordPhysicalRead(1, len(page))
+        return page
+
+    def __getattr__(self, name):
+        # behave like the wrapped file pointer for everything else (seek, read ...)
+        return getattr(self.fpt, name)
+
+class joinInput:
+    """
+    one side of a join: the table of a db file, the join key and the columns to output
+
+    ordering tells whether the rows can be read in join key order:
+    "table" when the table btree is WITHOUT ROWID on the key, "index" when an
+    index of a rowid table starts with the key (the Emp ID autoindex), None otherwise
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param table: the table name
+        @param keyColumn: the (cleaned) join column name, e.g. "Emp_ID"
+        @param columns: the column names to output, all columns in record order by default
+    """
+    def __init__(self, fpt, pageSize, table, keyColumn, columns=None):
+        self.source = countingPageSource(fpt)
+        self.pageSize = pageSize
+        self.table = table
+        self.schema = parseSchema(self.source, pageSize)
+        self.rootPage = self.schema[table]["rootPage"]
+        self.columns = list(columns) if columns else [name for name, _ in recordColumnOrder(self.schema[table]["sql"])]
+        self.keyPosition = self.columns.index(keyColumn)
+
+        _, primaryKey, withoutRowid = tableColumns(self.schema[table]["sql"])
+        self.ordering, self.orderIndex = None, None
+        if withoutRowid and primaryKey[:1] == [keyColumn]:
+            self.ordering = "table"
+        elif not withoutRowid:
+            for indexName in tableIndexes(self.schema, table):
+                if indexColumns(self.schema, indexName)[0] == keyColumn:
+                    self.ordering, self.orderIndex = "index", indexName
+                    break
+
+    @property
+    def pagesRead(self):
+        return self.source.pagesRead
+
+    def orderedWithoutLookups(self):
+        """whether orderedRows reads one btree only: the clustered table or a covering index"""
+        if self.ordering == "index":
+            return set(self.columns).issubset(indexColumns(self.schema, self.orderIndex))
+        return self.ordering == "table"
+
+    def rows(self):
+        """yield the rows in table btree order"""
+        return compiledRows(self.source, self.pageSize, self.rootPage, decoderFor(self.schema, self.table, self.columns))
+
+    def orderedRows(self):
+        """yield the rows in join key order, only for an ordered input"""
+        if self.ordering == "table":
+            yield from self.rows()
+            return
+
+        indexRoot = self.schema[self.orderIndex]["rootPage"]
+        if self.orderedWithoutLookups():
+            # covering index: the table btree is never read
+            yield from compiledRows(self.source, self.pageSize, indexRoot, indexDecoderFor(self.schema, self.orderIndex, self.columns))
+            return
+
+        decode = decoderFor(self.schema, self.table, self.columns)
+        pending = []
+
+        def _fetch():
+            # one shared descent of the table for a batch of rowids, then back to the index order
+            found = {}
+            compiledGetMany(self.source, self.pageSize, self.rootPage, sorted(set(pending)), decode, found)
+            rows = [found[rowid] for rowid in pending if rowid in found]
+            del pending[:]
+            return rows
+
+        for (rowid,) in compiledRows(self.source, self.pageSize, indexRoot, indexDecoderFor(self.schema, self.orderIndex, ["rowid"])):
+            pending.append(rowid)
+            if len(pending) == JOIN_FETCH_BATCH:
+                yield from _fetch()
+        yield from _fetch()
+
+def mergeJoin(leftRows, rightRows, leftKey, rightKey):
+    """
+    equi-join of two inputs ordered on the join key, in one pass over each;
+    the right rows of a key are buffered to pair them with every left row of the key
+
+    yield left row + right row tuples in key order
+        @param leftRows: the left rows ordered on leftKey
+        @param rightRows: the right rows ordered on rightKey
+        @param leftKey: the position of the join key in the left rows
+        @param rightKey: the position of the join key in the right rows
+    """
+    right = iter(rightRows)
+    current = next(right, None)
+    group, groupKey = [], None
+
+    for left in leftRows:
+        # NULL never joins
+        if left[leftKey] is None:
+            continue
+        key = keyOrder(left[leftKey])
+
+        if key != groupKey:
+            while current is not None and keyOrder(current[rightKey]) < key:
+                current = next(right, None)
+            group, groupKey = [], key
+            while current is not None and keyOrder(current[rightKey]) == key:
+                group.append(tuple(current))
+                current = next(right, None)
+            if current is None and not group:
+                return
+
+        for match in group:
+            yield tuple(left) + match
+
+class graceHashJoin:
+    """
+    equi-join of unordered inputs
+
+    the build side is hashed in memory; if it holds more than maxBuildRows rows,
+    both sides are partitioned by hash of the join key into numPartitions temporary
+    files and every pair of partitions is joined on its own, partitions whose
+    build side is still too large are partitioned again with another hash
+
+        @param maxBuildRows: memory budget, in build side rows held in memory
+        @param numPartitions: number of spill files per side
+        @param tempDir: directory of the spill files, the system default by default
+    """
+    def __init__(self, maxBuildRows=JOIN_MAX_BUILD_ROWS, numPartitions=JOIN_PARTITIONS, tempDir=None):
+        self.maxBuildRows = maxBuildRows
+        self.numPartitions = numPartitions
+        self.tempDir = tempDir
+        self.partitions = 0
+        self.spilledRows = 0
+
+    def _partition(self, rows, key, depth):
+        """write rows to numPartitions spill files by hash of the key, one pickled list per chunk"""
+        partitions = [tempfile.TemporaryFile(dir=self.tempDir) for _ in range(self.numPartitions)]
+        chunks = [[] for _ in range(self.numPartitions)]
+
+        for row in rows:
+            if row[key] is None:
+                continue
+            # a different hash at every depth so a partition that is too large splits up
+            i = hash((depth, row[key])) % self.numPartitions
+            chunks[i].append(tuple(row))
+            self.spilledRows += 1
+            if len(chunks[i]) == JOIN_SPILL_CHUNK:
+                pickle.dump(chunks[i], partitions[i], protocol=pickle.HIGHEST_PROTOCOL)
+                chunks[i] = []
+
+        for partition, chunk in zip(partitions, chunks):
+            if chunk:
+                pickle.dump(chunk, partition, protocol=pickle.HIGHEST_PROTOCOL)
+            partition.seek(0)
+        self.partitions += self.numPartitions
+        return partitions
+
+    def _read(self, partition):
+        """yield the rows of a spill file and close it"""
+        while True:
+            try:
+                chunk = pickle.load(partition)
+            except EOFError:
+                break
+            yield from chunk
+        partition.close()
+
+    def rows(self, buildRows, probeRows, buildKey, probeKey, buildIsLeft=False, depth=0):
+        """
+        yield left row + right row tuples
+
+            @param buildRows: the rows hashed in memory, the smaller input
+            @param probeRows: the rows looked up in the hash table
+            @param buildKey: the position of the join key in the build rows
+            @param probeKey: the position of the join key in the probe rows
+            @param buildIsLeft: the build rows are the left side of the output
+            @param depth: the partitioning depth
+        """
+        table, count = {}, 0
+        buildRows = iter(buildRows)
+        overflow = False
+
+        for row in buildRows:
+            if row[buildKey] is None:
+                continue
+            table.setdefault(row[buildKey], []).append(tuple(row))
+            count += 1
+            if count > self.maxBuildRows and depth < JOIN_MAX_PARTITION_DEPTH:
+                overflow = True
+                break
+
+        if not overflow:
+            for probe in probeRows:
+                matches = table.get(probe[probeKey]) if probe[probeKey] is not None else None
+                if matches:
+                    probe = tuple(probe)
+                    for match in matches:
+                        yield match + probe if buildIsLeft else probe + match
+            return
+
+        # the build side does not fit: partition what is in memory, the rest of it and the probe side
+        buildPartitions = self._partition(chain((row for rows in table.values() for row in rows), buildRows), buildKey, depth)
+        table = None
+        probePartitions = self._partition(probeRows, probeKey, depth)
+
+        for buildPartition, probePartition in zip(buildPartitions, probePartitions):
+            yield from self.rows(self._read(buildPartition), self._read(probePartition), buildKey, probeKey, buildIsLeft, depth + 1)
+
+class tableJoin:
+    """
+    inner equi-join of two joinInputs: a merge join when both are ordered on
+    the join key, a Grace hash join with the right input as build side otherwise
+
+    an input ordered by a non covering index needs one table lookup per row in
+    index order, which reads far more pages than a scan: such inputs only take
+    part in a merge join when the strategy is forced
+
+        @param left: the left joinInput
+        @param right: the right joinInput, the build side of a hash join
+        @param strategy: "merge" or "hash", chosen from the input ordering by default
+        @param maxBuildRows: hash join memory budget, in build side rows
+        @param tempDir: directory of the hash join spill files
+    """
+    def __init__(self, left, right, strategy=None, maxBuildRows=JOIN_MAX_BUILD_ROWS, tempDir=None):
+        self.left = left
+        self.right = right
+        if strategy is None:
+            strategy = "merge" if left.orderedWithoutLookups() and right.orderedWithoutLookups() else "hash"
+        self.strategy = strategy
+        self.hashJoin = graceHashJoin(maxBuildRows, tempDir=tempDir)
+        self.rowsJoined = 0
+
+    def rows(self):
+        """yield left row + right row tuples"""
+        if self.strategy == "merge":
+            recordAccessMethod("merge-join")
+            joined = mergeJoin(self.left.orderedRows(), self.right.orderedRows(), self.left.keyPosition, self.right.keyPosition)
+        else:
+            recordAccessMethod("hash-join")
+            joined = self.hashJoin.rows(self.right.rows(), self.left.rows(), self.right.keyPosition, self.left.keyPosition)
+
+        for row in joined:
+            self.rowsJoined += 1
+            yield row
+
+    def stats(self):
+        """return the join statistics, pages are counted per side"""
+        return {"strategy": self.strategy,
+                "rowsJoined": self.rowsJoined,
+                "leftPagesRead": self.left.pagesRead,
+                "rightPagesRead": self.right.pagesRead,
+                "partitions": self.hashJoin.partitions,
+                "spilledRows": self.hashJoin.spilledRows}
+
+def db_C_D_Query_Join(pageSize):
+    """
+    DB: (c) joined with (d), both ordered on "Emp ID" (autoindex and clustered btree) with page size of 4KB
+    Ops: count the "Emp ID" of (c) that are also in (d) (merge join, the autoindex of (c) covers "Emp ID")
+    """
+    print("DB: (c) With primary index on \"Emp ID\" joined with (d) clustered on \"Emp ID\" with page size of 4KB")
+    print("Count the \"Emp ID\" found in both databases (this is a Merge join)")
+
+    with open(DB_PATH3, "rb") as left, open(DB_PATH4, "rb") as right:
+        join = tableJoin(joinInput(left, pageSize, 'Employee', 'Emp_ID', ['Emp_ID']),
+                         joinInput(right, pageSize, 'Employee', 'Emp_ID', ['Emp_ID']))
+        print("Count: {}".format(sum(1 for _ in join.rows())))
+        print("Join: {}".format(join.stats()))
+
+def db_A_D_Query_Join(pageSize):
+    """
+    DB: (a) without any index joined with (d) clustered on "Emp ID" with page size of 4KB
+    Ops: count the employees of (a) with the same "Emp ID" and last name in (d) (hash join, (a) is unordered)
+    """
+    print("DB: (a) Without any index joined with (d) clustered on \"Emp ID\" with page size of 4KB")
+    print("Count the employees with the same \"Emp ID\" and last name in both databases (this is a Hash join)")
+
+    with open(DB_PATH1, "rb") as left, open(DB_PATH4, "rb") as right:
+        join = tableJoin(joinInput(left, pageSize, 'Employee', 'Emp_ID', ['Emp_ID', 'Last_Name']),
+                         joinInput(right, pageSize, 'Employee', 'Emp_ID', ['Emp_ID', 'Last_Name']))
+        print("Count: {}".format(sum(1 for row in join.rows() if row[1] == row[3])))
+        print("Join: {}".format(join.stats()))
+
+if __name__ == "__main__":
+    db_C_D_Query_Join(PAGE_SIZE_4K)
+    readResetBookkeepings()
+    print("")
+    db_A_D_Query_Join(PAGE_SIZE_4K)
+    readResetBookkeepings()
@@ -0,0 +1,104 @@
+from functools import cmp_to_key
+from catalog import indexKeyColumns
+
+COLLATIONS = ("BINARY", "NOCASE", "RTRIM")
+
+# NOCASE only folds the 26 ASCII letters, like sqlite3StrICmp
+_ASCII_LOWER = {code: code + 32 for code in range(ord("A"), ord("Z") + 1)}
+
+def typeClass(value):
+    """
+    return the storage class rank of a value in SQLite's record order:
+    0 NULL, 1 INTEGER or REAL, 2 TEXT, 3 BLOB
+        @param value: a decoded column value
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    return 3
+
+def collate(value, collation="BINARY"):
+    """
+    return the text value as it compares under a collation; other values are returned as is
+    (text compared code point by code point orders like the memcmp of its UTF-8 bytes)
+
+        @param value: a decoded column value
+        @param collation: BINARY, NOCASE or RTRIM
+    """
+    if not isinstance(value, str) or collation == "BINARY":
+        return value
+    if collation == "NOCASE":
+        return value.translate(_ASCII_LOWER)
+    if collation == "RTRIM":
+        return value.rstrip(" ")
+    raise ValueError("unknown collation: {}".format(collation))
+
+def keyOrder(value, collation="BINARY"):
+    """
+    return a sort key of one column value in SQLite's ascending record order:
+    NULL < numbers (integers and reals compared by value) < text (by collation) < blob (memcmp)
+
+        @param value: a decoded column value
+        @param collation: the collation of the column
+    """
+    rank = typeClass(value)
+    if rank == 0:
+        return (0,)
+    if rank == 3:
+        return (3, bytes(value))
+    return (rank, collate(value, collation))
+
+def compareKeys(a, b, collations=None, descending=None):
+    """
+    compare two index keys column by column like SQLite compares index records
+
+    only the columns both keys have are compared, so a key prefix such as (last name,)
+    compares equal to every record that starts with it
+
+    return -1, 0 or 1 as a sorts before, with or after b in the index
+        @param a: a tuple or list of column values
+        @param b: a tuple or list of column values
+        @param collations: the collation of each column, BINARY by default
+        @param descending: whether each column is sorted DESC, ascending by default
+    """
+    for i in range(min(len(a), len(b))):
+        collation = collations[i] if collations and i < len(collations) else "BINARY"
+        x, y = keyOrder(a[i], collation), keyOrder(b[i], collation)
+        if x != y:
+            result = -1 if x < y else 1
+            return -result if descending and i < len(descending) and descending[i] else result
+    return 0
+
+class keyComparator:
+    """
+    the sort order of the records of one index: a collation and a direction per column
+
+        @param collations: the collation of each record column
+        @param descending: whether each record column is sorted DESC
+    """
+    def __init__(self, collations, descending=None):
+        for collation in collations:
+            if collation not in COLLATIONS:
+                raise ValueError("unknown collation: {}".format(collation))
+        self.collations = list(collations)
+        self.descending = list(descending) if descending else [False] * len(self.collations)
+
+    def compare(self, a, b):
+        """return -1, 0 or 1 as key a sorts before, with or after key b (prefixes compare equal)"""
+        return compareKeys(a, b, self.collations, self.descending)
+
+    def sortKey(self):
+        """return a key function that sorts full keys in the index order, e.g. sorted(keys, key=comparator.sortKey())"""
+        return cmp_to_key(self.compare)
+
+def indexComparator(schema, name):
+    """
+    return the keyComparator of an index, or of a WITHOUT ROWID table, from its definition
+        @param schema: the catalog returned by parseSchema
+        @param name: the index name, or the name of a WITHOUT ROWID table
+    """
+    keyColumns = indexKeyColumns(schema, name)
+    return keyComparator([collation for _, collation, _ in keyColumns], [descending for _, _, descending in keyColumns])
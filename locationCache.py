@@ -0,0 +1,334 @@
+import os
+import pickle
+from collections import OrderedDict
+from constants import *
+from utils import parseSchema, readPage, readCounts, recordAccessMethod, printFullnameOnly, fileSignature, isWalMode
+from catalog import tableColumns, coveringIndex
+from keyCompare import indexComparator
+from queryOperations import readResetBookkeepings
+from recordDecoder import readVarint, decoderFor, indexDecoderFor, compiledScan, _payload
+
+def _cellPointers(page):
+    """return (page type, number of cells, offset of the cell pointer array) of a btree page given as bytes"""
+    pageType = page[0]
+    numCells = int.from_bytes(page[BTREE_NUM_CELLS_OFFSET:BTREE_NUM_CELLS_OFFSET + 2], "big")
+    isLeaf = pageType in (LEAF_TABLE_BTREE_PAGE_FLAG, LEAF_INDEX_BTREE_PAGE_FLAG)
+    return pageType, numCells, LEAF_BTREE_PAGE_HEADER_SIZE if isLeaf else INTERIOR_BTREE_PAGE_HEADER_SIZE
+
+def _cellOffset(page, cellPointers, i):
+    return int.from_bytes(page[cellPointers + i * 2:cellPointers + i * 2 + 2], "big")
+
+def _tableCell(page, cellOffset, decode, fpt, pageSize):
+    """return (rowid, decoded row) of a table leaf cell"""
+    payloadSize, p = readVarint(page, cellOffset)
+    rowid, p = readVarint(page, p)
+    buf, pos = _payload(page, p, payloadSize, LEAF_TABLE_BTREE_PAGE_FLAG, fpt, pageSize)
+    return rowid, decode(buf, pos, rowid)
+
+def _indexCell(page, pageType, cellOffset, decode, fpt, pageSize):
+    """return (left child or None, decoded record) of an index btree cell"""
+    child, p = None, cellOffset
+    if pageType == INTERIOR_INDEX_BTREE_PAGE_FLAG:
+        child = int.from_bytes(page[cellOffset:cellOffset + POINTER_SIZE], "big")
+        p += POINTER_SIZE
+    payloadSize, p = readVarint(page, p)
+    buf, pos = _payload(page, p, payloadSize, pageType, fpt, pageSize)
+    return child, decode(buf, pos)
+
+def locateRowid(fpt, pageSize, rootPage, rowid, decode, level=0):
+    """
+    descend a table btree to a rowid with a binary search of every page
+
+    return (leaf page, cell index, decoded row), None if the rowid does not exist
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param rootPage: the page to descend from
+        @param rowid: the rowid to look up
+        @param decode: a decoder from decoderFor for the rows of the table
+        @param level: the depth of the current page in the btree (0 = root)
+    """
+    page = readPage(rootPage, fpt, pageSize)
+    pageType, numCells, cellPointers = _cellPointers(page)
+    readCounts(pageType, level)
+
+    if pageType == INTERIROR_TABLE_BTREE_PAGE_FLAG:
+        # the first cell whose key is >= rowid has the rowid in its left child
+        low, high = 0, numCells
+        while low < high:
+            middle = (low + high) // 2
+            cellOffset = _cellOffset(page, cellPointers, middle)
+            if readVarint(page, cellOffset + POINTER_SIZE)[0] < rowid:
+                low = middle + 1
+            else:
+                high = middle
+        if low < numCells:
+            cellOffset = _cellOffset(page, cellPointers, low)
+            child = int.from_bytes(page[cellOffset:cellOffset + POINTER_SIZE], "big")
+        else:
+            child = int.from_bytes(page[8:12], "big")
+        return locateRowid(fpt, pageSize, child, rowid, decode, level + 1)
+
+    i = _findRowid(page, numCells, cellPointers, rowid)
+    if i is None:
+        return None
+    return (rootPage, i, _tableCell(page, _cellOffset(page, cellPointers, i), decode, fpt, pageSize)[1])
+
+def _findRowid(page, numCells, cellPointers, rowid):
+    """return the cell index of rowid in a table leaf page, None if it is not there"""
+    low, high = 0, numCells
+    while low < high:
+        middle = (low + high) // 2
+        currentRowid = _rowidAt(page, cellPointers, middle)
+        if currentRowid == rowid:
+            return middle
+        if currentRowid < rowid:
+            low = middle + 1
+        else:
+            high = middle
+    return None
+
+def _rowidAt(page, cellPointers, i):
+    """return the rowid of the cell i of a table leaf page"""
+    _, p = readVarint(page, _cellOffset(page, cellPointers, i))
+    return readVarint(page, p)[0]
+
+def _lowerBound(page, pageType, numCells, cellPointers, key, decode, comparator, fpt, pageSize):
+    """
+    return (index of the first cell of an index page whose record is >= key,
+    {cell index: (left child, record)} of the cells decoded by the binary search)
+    """
+    low, high, cells = 0, numCells, {}
+    while low < high:
+        middle = (low + high) // 2
+        cells[middle] = _indexCell(page, pageType, _cellOffset(page, cellPointers, middle), decode, fpt, pageSize)
+        if comparator.compare(cells[middle][1], key) < 0:
+            low = middle + 1
+        else:
+            high = middle
+    if low < numCells and low not in cells:
+        cells[low] = _indexCell(page, pageType, _cellOffset(page, cellPointers, low), decode, fpt, pageSize)
+    return low, cells
+
+def locateKey(fpt, pageSize, rootPage, key, decode, comparator, level=0):
+    """
+    descend an index btree (an index or a WITHOUT ROWID table) to the first record
+    starting with key, with a binary search of every page
+
+    return (page, cell index, decoded record), None if no record starts with key;
+    the page is an interior page when the record is held by an interior cell
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param rootPage: the page to descend from
+        @param key: tuple of the first values of the record
+        @param decode: a decoder from indexDecoderFor/decoderFor for the records of the btree
+        @param comparator: the keyComparator of the btree
+        @param level: the depth of the current page in the btree (0 = root)
+    """
+    page = readPage(rootPage, fpt, pageSize)
+    pageType, numCells, cellPointers = _cellPointers(page)
+    readCounts(pageType, level)
+
+    low, cells = _lowerBound(page, pageType, numCells, cellPointers, key, decode, comparator, fpt, pageSize)
+
+    if pageType == INTERIOR_INDEX_BTREE_PAGE_FLAG:
+        child = cells[low][0] if low < numCells else int.from_bytes(page[8:12], "big")
+        found = locateKey(fpt, pageSize, child, key, decode, comparator, level + 1)
+        if found is not None:
+            return found
+
+    if low < numCells and comparator.compare(cells[low][1], key) == 0:
+        return (rootPage, low, cells[low][1])
+    return None
+
+class keyLocationCache:
+    """
+    LRU cache of key -> (page, cell index) for hot point lookups
+
+    every location is kept with the fileSignature of the database it was found in: after a
+    write the entry is stale and the lookup falls back to a normal descent, whose result
+    replaces it, as a deleted row can stay intact on a page moved to the freelist. a hit
+    reads only the cached page and confirms the key is still in it. a database in WAL mode
+    is not cached, its commits do not change the signature. keys are expected to be unique (Emp ID, rowid)
+
+        @param maxEntries: max number of cached locations
+        @param persistPath: optional pickle file the cache is loaded from and saved to
+    """
+    def __init__(self, maxEntries=LOCATION_CACHE_ENTRIES, persistPath=None):
+        self.maxEntries = maxEntries
+        self.persistPath = persistPath
+
+        # (database path, root page, key) -> (page, cell index, file signature), least recently used first
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.relocations = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.bypassed = 0
+
+        if persistPath and os.path.exists(persistPath):
+            self.load()
+
+    def _verify(self, fpt, pageSize, location, rootPage, key, decode, comparator):
+        """return (cell index, decoded row) of key in the cached page, None if it is not there anymore"""
+        page = readPage(location[0], fpt, pageSize)
+        pageType, numCells, cellPointers = _cellPointers(page)
+        readCounts(pageType)
+
+        if comparator is None:
+            if pageType != LEAF_TABLE_BTREE_PAGE_FLAG:
+                return None
+            # the cached cell first, then a binary search of the page
+            i = location[1]
+            if i >= numCells or _rowidAt(page, cellPointers, i) != key:
+                i = _findRowid(page, numCells, cellPointers, key)
+            return None if i is None else (i, _tableCell(page, _cellOffset(page, cellPointers, i), decode, fpt, pageSize)[1])
+
+        if pageType not in (LEAF_INDEX_BTREE_PAGE_FLAG, INTERIOR_INDEX_BTREE_PAGE_FLAG):
+            return None
+        i = location[1]
+        if i < numCells:
+            record = _indexCell(page, pageType, _cellOffset(page, cellPointers, i), decode, fpt, pageSize)[1]
+            if comparator.compare(record, key) == 0:
+                return i, record
+        i, cells = _lowerBound(page, pageType, numCells, cellPointers, key, decode, comparator, fpt, pageSize)
+        if i < numCells and comparator.compare(cells[i][1], key) == 0:
+            return i, cells[i][1]
+        return None
+
+    def lookup(self, fpt, pageSize, rootPage, key, decode, comparator=None):
+        """
+        return the row of key, None if there is none
+
+            @param fpt: the file pointer of the db
+            @param pageSize: the page size of the db
+            @param rootPage: the root page of the btree
+            @param key: a rowid for a table btree, a tuple of the first record values for an index btree
+            @param decode: a decoder from decoderFor/indexDecoderFor for the rows of the btree
+            @param comparator: the keyComparator of an index btree, None for a table btree
+        """
+        if isWalMode(fpt):
+            self.bypassed += 1
+            found = self._locate(fpt, pageSize, rootPage, key, decode, comparator)
+            return None if found is None else found[2]
+
+        cacheKey = (os.path.abspath(getattr(fpt, "name", "")), rootPage, key)
+        signature = fileSignature(fpt)
+        location = self.entries.get(cacheKey)
+
+        if location is not None and location[2] != signature:
+            # the database was written since the location was cached
+            self.invalidations += 1
+            del self.entries[cacheKey]
+            location = None
+
+        if location is not None:
+            verified = self._verify(fpt, pageSize, location, rootPage, key, decode, comparator)
+            if verified is not None:
+                self.hits += 1
+                recordAccessMethod("location-cache hit")
+                if verified[0] != location[1]:
+                    self.relocations += 1
+                    self.entries[cacheKey] = (location[0], verified[0], signature)
+                self.entries.move_to_end(cacheKey)
+                return verified[1]
+            # the page moved or changed
+            self.invalidations += 1
+            del self.entries[cacheKey]
+
+        self.misses += 1
+        recordAccessMethod("location-cache miss")
+        found = self._locate(fpt, pageSize, rootPage, key, decode, comparator)
+        if found is None:
+            return None
+
+        self.entries[cacheKey] = found[:2] + (signature,)
+        if len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+        return found[2]
+
+    def _locate(self, fpt, pageSize, rootPage, key, decode, comparator):
+        """descend the btree to key, see locateRowid and locateKey"""
+        if comparator is None:
+            return locateRowid(fpt, pageSize, rootPage, key, decode)
+        return locateKey(fpt, pageSize, rootPage, key, decode, comparator)
+
+    def save(self):
+        """write the cache to persistPath, replacing the previous file atomically"""
+        if not self.persistPath:
+            return
+        tmpPath = self.persistPath + ".tmp"
+        with open(tmpPath, "wb") as out:
+            pickle.dump(list(self.entries.items()), out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, self.persistPath)
+
+    def load(self):
+        """load the cache from persistPath; stale locations are dropped on their next lookup"""
+        with open(self.persistPath, "rb") as f:
+            for cacheKey, location in pickle.load(f):
+                # a location saved without the file signature cannot be validated
+                if len(location) == 3:
+                    self.entries[cacheKey] = location
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """return the hit/miss statistics of the cache"""
+        return {"hits": self.hits,
+                "relocations": self.relocations,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "bypassed": self.bypassed,
+                "entries": len(self.entries)}
+
+def cachedEmpIDLookup(cache, fpt, pageSize, empID):
+    """
+    return the Employee record with the Emp ID, None if there is none, going through the location cache
+
+    -WITHOUT ROWID table on Emp ID: one cached location in the clustered btree
+    -Emp ID index: one cached location in the index for the rowid, one in the table for the record
+    -no index: a scan, nothing is cached
+
+        @param cache: a keyLocationCache
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param empID: the Emp ID to look up
+    """
+    schema = parseSchema(fpt, pageSize)
+    columns, primaryKey, withoutRowid = tableColumns(schema['Employee']['sql'])
+    keyColumn = columns[EMP_ID_INDEX][0]
+    tableRoot = schema['Employee']['rootPage']
+    decode = decoderFor(schema, 'Employee')
+
+    if withoutRowid and primaryKey[:1] == [keyColumn]:
+        return cache.lookup(fpt, pageSize, tableRoot, (empID,), decode, indexComparator(schema, 'Employee'))
+
+    indexName = coveringIndex(schema, 'Employee', [keyColumn], keyColumn)
+    if indexName:
+        record = cache.lookup(fpt, pageSize, schema[indexName]['rootPage'], (empID,),
+                              indexDecoderFor(schema, indexName), indexComparator(schema, indexName))
+        # the rowid is the last field of the index record
+        return None if record is None else cache.lookup(fpt, pageSize, tableRoot, record[-1], decode)
+
+    recordAccessMethod("scan")
+    return compiledScan(fpt, pageSize, tableRoot, decode, lambda record: record[EMP_ID_INDEX] == empID)
+
+def db_C_Query_CachedLookup(pageSize):
+    """
+    DB: With primary index on "Emp ID" column (Unclusterd Index) with page size of 4KB
+    Ops: look up the same "Emp ID" twice, the second lookup reads one index page and one table page
+    """
+    print("DB: With primary index on \"Emp ID\" column (Unclusterd Index) with page size of 4KB")
+    print("Query and print the full name of the employee with the \"Emp ID\" twice (this is an equality search through the location cache)")
+
+    cache = keyLocationCache()
+    with open(DB_PATH3, "rb") as db_binary:
+        for _ in range(2):
+            record = cachedEmpIDLookup(cache, db_binary, pageSize, EMP_ID)
+            if record:
+                printFullnameOnly(record)
+    print(cache.stats())
+
+if __name__ == "__main__":
+    db_C_Query_CachedLookup(PAGE_SIZE_4K)
+    readResetBookkeepings()
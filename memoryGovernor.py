@@ -0,0 +1,262 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from bitstring import ConstBitStream
+from constants import *
+from metrics import metricsContext
+from utils import parseSchema, readPage
+from queryOperations import indexBtreeRangeSearch
+from pageCache import compressedPageCache
+from resultSinks import binarySink, readBinaryRows
+
+# the memory budget of the query running in the current thread/context; None when not governed
+_currentBudget = ContextVar('memoryBudget', default=None)
+
+def rowBytes(row):
+    """estimate the memory held by a buffered row: the tuple/list and each of its values"""
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+def readPeakRss():
+    """
+    return (peak resident set size in bytes, current resident set size in bytes) of the process,
+    VmHWM and VmRSS of /proc/self/status, or the max RSS of getrusage where there is no /proc
+    """
+    try:
+        with open("/proc/self/status") as status:
+            fields = dict(line.split(":", 1) for line in status if ":" in line)
+        return int(fields["VmHWM"].split()[0]) * 1024, int(fields["VmRSS"].split()[0]) * 1024
+    except (OSError, KeyError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return peak, None
+
+def _resetPeakRss():
+    """reset VmHWM to the current RSS (linux 4.0+), return whether it was reset"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clearRefs:
+            clearRefs.write("5")
+        return True
+    except OSError:
+        return False
+
+class memoryBudget:
+    """
+    the memory a query may hold in buffered rows (estimated with rowBytes) and page copies
+
+    operators charge what they keep and release what they drop; the budget itself never fails
+    a charge, an operator over budget is expected to stream or spill (see spillingBuffer)
+
+        @param limitBytes: the bytes the query may hold
+        @param name: the name of the query
+    """
+    def __init__(self, limitBytes=QUERY_MEMORY_BUDGET, name=None):
+        self.limitBytes = limitBytes
+        self.name = name
+        self.usedBytes = {"rows": 0, "pages": 0}
+        self.peakBytes = 0
+        self.spills = 0
+        self.spilledRows = 0
+        self.spilledBytes = 0
+        self.peakRss = None
+        self.peakRssReset = False
+        self.metrics = None
+
+    def used(self):
+        return self.usedBytes["rows"] + self.usedBytes["pages"]
+
+    def remaining(self):
+        return max(0, self.limitBytes - self.used())
+
+    def exceeded(self):
+        return self.used() > self.limitBytes
+
+    def charge(self, numBytes, kind="rows"):
+        """
+        account numBytes more held by the query
+            @param numBytes: estimated bytes
+            @param kind: "rows" or "pages"
+        """
+        self.usedBytes[kind] += numBytes
+        self.peakBytes = max(self.peakBytes, self.used())
+
+    def release(self, numBytes, kind="rows"):
+        self.usedBytes[kind] -= numBytes
+
+    def recordSpill(self, numRows, numBytes):
+        self.spills += 1
+        self.spilledRows += numRows
+        self.spilledBytes += numBytes
+
+    def toDict(self):
+        """return the memory report, with the page read counts when run in memoryContext"""
+        report = {"query": self.name,
+                  "limitBytes": self.limitBytes,
+                  "peakBytes": self.peakBytes,
+                  "rowBytes": self.usedBytes["rows"],
+                  "pageBytes": self.usedBytes["pages"],
+                  "spills": self.spills,
+                  "spilledRows": self.spilledRows,
+                  "spilledBytes": self.spilledBytes,
+                  "peakRss": self.peakRss,
+                  "peakRssReset": self.peakRssReset}
+        if self.metrics is not None:
+            report["logicalReads"] = self.metrics.logicalReads
+            report["physicalReads"] = self.metrics.physicalReads
+            report["pageReadsByType"] = dict(self.metrics.pageReadsByType)
+        return report
+
+def currentBudget():
+    """return the memoryBudget of the running query, or None when it is not governed"""
+    return _currentBudget.get()
+
+@contextmanager
+def memoryContext(name=None, limitBytes=QUERY_MEMORY_BUDGET):
+    """
+    run the with block as one query under a memory budget, with its page reads collected
+    by metricsContext and the peak RSS of the process during the block
+
+        with memoryContext("range", 16 * 1024 * 1024) as budget:
+            rows = governedRangeSearch(db_binary, PAGE_SIZE_4K, indexName, lower, upper, ops)
+        print(budget.toDict())
+
+    the peak RSS is the peak of the block when the kernel lets VmHWM be reset, the peak of
+    the process so far otherwise (peakRssReset tells which)
+        @param name: the name of the query
+        @param limitBytes: the bytes the query may hold
+    """
+    budget = memoryBudget(limitBytes, name)
+    budget.peakRssReset = _resetPeakRss()
+    token = _currentBudget.set(budget)
+    try:
+        with metricsContext(name) as metrics:
+            budget.metrics = metrics
+            yield budget
+    finally:
+        _currentBudget.reset(token)
+        budget.peakRss = readPeakRss()[0]
+
+class spillingBuffer:
+    """
+    list of rows charged to a memory budget: once the budget is exceeded the rows held are
+    written to a temporary file (the binarySink format) and released, iterating yields every
+    row in the order appended, the spilled ones read back from the file
+
+        @param budget: the memoryBudget, the one of the running query by default
+    """
+    def __init__(self, budget=None):
+        self.budget = budget or currentBudget() or memoryBudget()
+        self.rows = []
+        self.rowBytes = 0
+        self.spilled = 0
+        self.file = None
+        self.sink = None
+
+    def append(self, row):
+        size = rowBytes(row)
+        self.rows.append(row)
+        self.rowBytes += size
+        self.budget.charge(size)
+        if self.budget.exceeded():
+            self.spill()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def spill(self):
+        """write the rows held to the temporary file and release their memory"""
+        if not self.rows:
+            return
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix="spill-")
+            self.sink = binarySink(self.file)
+        self.file.seek(0, os.SEEK_END)
+        before = self.sink.bytesWritten
+        self.sink.write(self.rows)
+        self.sink.flush()
+        self.budget.recordSpill(len(self.rows), self.sink.bytesWritten - before)
+        self.budget.release(self.rowBytes)
+        self.spilled += len(self.rows)
+        self.rows = []
+        self.rowBytes = 0
+
+    def __iter__(self):
+        # iterate once every row is appended, a spill moves the file position
+        if self.file is not None:
+            self.file.seek(0)
+            yield from readBinaryRows(self.file)
+        yield from self.rows
+
+    def __len__(self):
+        return self.spilled + len(self.rows)
+
+    def close(self):
+        """drop the rows and the temporary file"""
+        self.budget.release(self.rowBytes)
+        self.rows = []
+        self.rowBytes = 0
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class spillingOps:
+    """
+    ops callback for the searches that gather the results of ops into lists while they recurse
+    (indexBtreeRangeSearch ...): the results go to a spillingBuffer and nothing is gathered
+
+        @param buffer: the spillingBuffer
+        @param ops: the ops of the search, returning the list of results of a record
+    """
+    def __init__(self, buffer, ops):
+        self.buffer = buffer
+        self.ops = ops
+
+    def __call__(self, record):
+        self.buffer.extend(self.ops(record))
+        return []
+
+def governedRangeSearch(fpt, pageSize, name, lower, upper, ops, budget=None):
+    """
+    indexBtreeRangeSearch on an index (or a WITHOUT ROWID table) with its results held in a
+    spillingBuffer under the memory budget instead of one list per level of the recursion
+
+    return the spillingBuffer of the results, in index order
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param name: the index name, or the name of a WITHOUT ROWID table
+        @param lower: lower bound of the range search
+        @param upper: upper bound of the range search
+        @param ops: the operation on each record, returning a list of results
+        @param budget: the memoryBudget, the one of the running query by default
+    """
+    schema = parseSchema(fpt, pageSize)
+    buffer = spillingBuffer(budget)
+    rootPagestream = ConstBitStream(readPage(schema[name]["rootPage"], fpt, pageSize))
+    indexBtreeRangeSearch(rootPagestream, fpt, lower, upper, spillingOps(buffer, ops), pageSize)
+    return buffer
+
+def governedPageCache(fpt, pageSize, budget=None, share=MEMORY_PAGE_CACHE_SHARE):
+    """
+    return a compressedPageCache sized to a share of what is left of the memory budget,
+    a quarter of it for the plain pages; the page copies it may hold are charged up front
+
+        @param fpt: the file pointer of the db file
+        @param pageSize: the page size of the database
+        @param budget: the memoryBudget, the one of the running query by default
+        @param share: the fraction of the remaining budget given to the cache
+    """
+    budget = budget or currentBudget() or memoryBudget()
+    cacheBytes = int(budget.remaining() * share)
+    # at least one plain page, a page in flight is always held
+    hotBytes = max(pageSize, cacheBytes // 4)
+    compressedBytes = max(0, cacheBytes - hotBytes)
+    budget.charge(hotBytes + compressedBytes, "pages")
+    return compressedPageCache(fpt, pageSize, hotBytes, compressedBytes)
@@ -0,0 +1,176 @@
+import json
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from constants import *
+
+# the metrics of the query running in the current thread/context; None when instrumentation is off
+_currentMetrics = ContextVar('queryMetrics', default=None)
+
+PAGE_TYPE_NAMES = {
+    -1: "header",
+    INTERIROR_TABLE_BTREE_PAGE_FLAG: "tableInterior",
+    LEAF_TABLE_BTREE_PAGE_FLAG: "tableLeaf",
+    INTERIOR_INDEX_BTREE_PAGE_FLAG: "indexInterior",
+    LEAF_INDEX_BTREE_PAGE_FLAG: "indexLeaf",
+}
+
+class queryMetrics:
+    """
+    page-read instrumentation of one query
+
+    unlike the process-wide readCounts bookkeeping, one object is created per
+    query by metricsContext() and only sees the reads of that query in the
+    thread/context it runs in
+
+        @param name: the name of the query, used as label when exporting
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.pageReadsByType = {}
+        self.pageReadsByLevel = {}
+        self.logicalReads = 0
+        self.physicalReads = 0
+        self.physicalBytes = 0
+        self.bytesDecoded = 0
+        self.cellsExamined = 0
+        self.accessMethods = {}
+        self.latencyBuckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latencySum = 0
+
+    def recordLogicalRead(self, elapsedMs):
+        self.logicalReads += 1
+        self.latencySum += elapsedMs
+        self.latencyBuckets[bisect_left(LATENCY_BUCKETS_MS, elapsedMs)] += 1
+
+    def recordPhysicalRead(self, numPages, numBytes):
+        self.physicalReads += numPages
+        self.physicalBytes += numBytes
+
+    def recordPageVisit(self, pageFlag, level):
+        typeName = PAGE_TYPE_NAMES.get(pageFlag, str(pageFlag))
+        self.pageReadsByType[typeName] = self.pageReadsByType.get(typeName, 0) + 1
+        if level is not None:
+            self.pageReadsByLevel[level] = self.pageReadsByLevel.get(level, 0) + 1
+
+    def recordAccessMethod(self, method):
+        self.accessMethods[method] = self.accessMethods.get(method, 0) + 1
+
+    def toDict(self):
+        """return all the metrics as a json serializable dictionary"""
+        return {
+            "query": self.name,
+            "pageReadsByType": dict(self.pageReadsByType),
+            "pageReadsByLevel": {str(level): count for level, count in sorted(self.pageReadsByLevel.items())},
+            "logicalReads": self.logicalReads,
+            "physicalReads": self.physicalReads,
+            "physicalBytes": self.physicalBytes,
+            "bytesDecoded": self.bytesDecoded,
+            "cellsExamined": self.cellsExamined,
+            "accessMethods": dict(self.accessMethods),
+            "latencyHistogramMs": {
+                "buckets": [[bound, count] for bound, count in zip(list(LATENCY_BUCKETS_MS) + ["+Inf"], self.latencyBuckets)],
+                "sum": self.latencySum,
+                "count": self.logicalReads,
+            },
+        }
+
+    def toJSON(self, path=None):
+        """
+        return the metrics as a json string, also written to path if given
+            @param path: optional output file path
+        """
+        text = json.dumps(self.toDict(), indent=2)
+        if path:
+            with open(path, 'w') as out:
+                out.write(text)
+        return text
+
+    def toPrometheus(self, path=None):
+        """
+        return the metrics in the prometheus text exposition format, also written to path if given
+            @param path: optional output file path
+        """
+        return exportPrometheus([self], path)
+
+def _escapeLabel(value):
+    """escape a label value for the prometheus text format: backslash, double quote and newline"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def exportPrometheus(metricsList, path=None):
+    """
+    render several queryMetrics into one prometheus text file (e.g. for the node exporter textfile collector)
+        @param metricsList: a list of queryMetrics
+        @param path: optional output file path
+    """
+    lines = []
+
+    def _family(name, kind, helpText):
+        lines.append("# HELP sqlite_reader_{} {}".format(name, helpText))
+        lines.append("# TYPE sqlite_reader_{} {}".format(name, kind))
+
+    def _sample(name, labels, value):
+        # a query without a name has no query label
+        labelStr = ",".join('{}="{}"'.format(k, _escapeLabel(v)) for k, v in labels if v is not None)
+        lines.append("sqlite_reader_{}{} {}".format(name, "{" + labelStr + "}" if labelStr else "", value))
+
+    _family("page_reads_total", "counter", "B-tree page visits by page type")
+    for m in metricsList:
+        for typeName, count in sorted(m.pageReadsByType.items()):
+            _sample("page_reads_total", [("query", m.name), ("type", typeName)], count)
+
+    _family("page_reads_by_level_total", "counter", "B-tree page visits by tree level (0 = root)")
+    for m in metricsList:
+        for level, count in sorted(m.pageReadsByLevel.items()):
+            _sample("page_reads_by_level_total", [("query", m.name), ("level", level)], count)
+
+    for name, attr, helpText in [("logical_reads_total", "logicalReads", "pages requested through readPage"),
+                                 ("physical_reads_total", "physicalReads", "pages read from the file"),
+                                 ("physical_bytes_total", "physicalBytes", "bytes read from the file"),
+                                 ("bytes_decoded_total", "bytesDecoded", "record body bytes decoded"),
+                                 ("cells_examined_total", "cellsExamined", "cells parsed")]:
+        _family(name, "counter", helpText)
+        for m in metricsList:
+            _sample(name, [("query", m.name)], getattr(m, attr))
+
+    _family("access_method_total", "counter", "access methods used by the query")
+    for m in metricsList:
+        for method, count in sorted(m.accessMethods.items()):
+            _sample("access_method_total", [("query", m.name), ("method", method)], count)
+
+    _family("page_read_latency_ms", "histogram", "latency of each page read in milliseconds")
+    for m in metricsList:
+        cumulative = 0
+        for bound, count in zip(list(LATENCY_BUCKETS_MS) + ["+Inf"], m.latencyBuckets):
+            cumulative += count
+            _sample("page_read_latency_ms_bucket", [("query", m.name), ("le", bound)], cumulative)
+        _sample("page_read_latency_ms_sum", [("query", m.name)], m.latencySum)
+        _sample("page_read_latency_ms_count", [("query", m.name)], m.logicalReads)
+
+    text = "\n".join(lines) + "\n"
+    if path:
+        with open(path, 'w') as out:
+            out.write(text)
+    return text
+
+def currentMetrics():
+    """return the queryMetrics of the running query, or None when instrumentation is off"""
+    return _currentMetrics.get()
+
+@contextmanager
+def metricsContext(name=None):
+    """
+    collect the metrics of every page read done inside the with block
+
+        with metricsContext("db_A_Query_A") as m:
+            db_A_Query_A(PAGE_SIZE_4K)
+        m.toJSON("db_A_Query_A.json")
+
+        @param name: the name of the query
+    """
+    metrics = queryMetrics(name)
+    token = _currentMetrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _currentMetrics.reset(token)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+import argparse
+import lzma
+import os
+import zlib
+from collections import OrderedDict
+from timeit import default_timer as time
+from constants import *
+from metrics import currentMetrics
+from utils import parseSchema
+from recordDecoder import compiledScan, decoderFor
+
+PAGE_CACHE_CODECS = ("zlib", "lzma")
+
+class compressedPageCache:
+    """
+    wrap a db file pointer (or another page source) with a two tier page cache:
+    a hot tier of plain pages and a second tier of compressed pages, each LRU within
+    a byte budget
+
+    a page evicted from the hot tier is compressed into the second tier; a miss in the
+    hot tier decompresses the page from the second tier before going to disk, and the
+    page moves back to the hot tier. the compressed copy is kept while the page is hot,
+    so a page is compressed once for as long as it stays cached
+
+        @param fpt: the file pointer of the db file (opened in "rb"), or a page source with fetchPage
+        @param pageSize: the page size of the database
+        @param hotBytes: byte budget of the plain pages
+        @param compressedBytes: byte budget of the compressed pages
+        @param codec: "zlib" or "lzma"
+        @param level: compression level, zlib level or lzma preset
+    """
+    def __init__(self, fpt, pageSize, hotBytes=PAGE_CACHE_HOT_BYTES, compressedBytes=PAGE_CACHE_COMPRESSED_BYTES,
+                 codec=PAGE_CACHE_CODEC, level=PAGE_CACHE_LEVEL):
+        if codec not in PAGE_CACHE_CODECS:
+            raise ValueError("unknown page cache codec: {}".format(codec))
+        self.fpt = fpt
+        self.pageSize = pageSize
+        self.hotBytes = hotBytes
+        self.compressedBytes = compressedBytes
+        self.codec = codec
+
+        if codec == "zlib":
+            self.compress = lambda page: zlib.compress(page, level)
+            self.decompress = zlib.decompress
+        else:
+            self.compress = lambda page: lzma.compress(page, preset=level)
+            self.decompress = lzma.decompress
+
+        # page -> bytes, least recently used first
+        self.hot = OrderedDict()
+        self.hotUsed = 0
+        # page -> compressed bytes, or the plain bytes when compressing does not make it smaller
+        self.compressed = OrderedDict()
+        self.compressedUsed = 0
+
+        self.resetStats()
+
+    def fetchPage(self, pageNum, pageSize):
+        """
+        return the page as bytes: from the hot tier, the compressed tier or the disk
+            @param pageNum: the page number to fetch
+            @param pageSize: the page size of the database
+        """
+        page = self.hot.get(pageNum)
+        if page is not None:
+            self.hot.move_to_end(pageNum)
+            self.hotHits += 1
+            return page
+
+        stored = self.compressed.get(pageNum)
+        if stored is not None:
+            self.compressed.move_to_end(pageNum)
+            startTime = time()
+            page = self.decompress(stored) if len(stored) < pageSize else stored
+            self.decompressSeconds += time() - startTime
+            self.compressedHits += 1
+        else:
+            page = self._readFromSource(pageNum, pageSize)
+            self.diskReads += 1
+
+        self._putHot(pageNum, page)
+        return page
+
+    def _readFromSource(self, pageNum, pageSize):
+        fetchPage = getattr(self.fpt, 'fetchPage', None)
+        if fetchPage is not None:
+            # a page source accounts for its own physical reads
+            return fetchPage(pageNum, pageSize)
+
+        page = os.pread(self.fpt.fileno(), pageSize, (pageNum - 1) * pageSize)
+        metrics = currentMetrics()
+        if metrics is not None:
+            metrics.recordPhysicalRead(1, len(page))
+        return page
+
+    def _putHot(self, pageNum, page):
+        self.hot[pageNum] = page
+        self.hotUsed += len(page)
+        while self.hotUsed > self.hotBytes and self.hot:
+            evictedNum, evicted = self.hot.popitem(last=False)
+            self.hotUsed -= len(evicted)
+            if evictedNum not in self.compressed:
+                self._putCompressed(evictedNum, evicted)
+
+    def _putCompressed(self, pageNum, page):
+        startTime = time()
+        stored = self.compress(page)
+        self.compressSeconds += time() - startTime
+        if len(stored) >= len(page):
+            # incompressible: keep the plain page, still cheaper than a disk read
+            stored = page
+            self.incompressible += 1
+
+        self.compressions += 1
+
+        self.compressed[pageNum] = stored
+        self.compressedUsed += len(stored)
+        while self.compressedUsed > self.compressedBytes and self.compressed:
+            _, dropped = self.compressed.popitem(last=False)
+            self.compressedUsed -= len(dropped)
+            self.compressedEvictions += 1
+
+    def reset(self):
+        """forget every cached page, typically after the database file was written"""
+        self.hot.clear()
+        self.compressed.clear()
+        self.hotUsed = self.compressedUsed = 0
+
+    def stats(self):
+        """return the cache statistics since the last resetStats"""
+        return {"codec": self.codec,
+                "hotHits": self.hotHits,
+                "compressedHits": self.compressedHits,
+                "diskReads": self.diskReads,
+                "diskReadsAvoided": self.hotHits + self.compressedHits,
+                "hotPages": len(self.hot),
+                "compressedPages": len(self.compressed),
+                "hotBytes": self.hotUsed,
+                "compressedBytes": self.compressedUsed,
+                # plain bytes the second tier stands for per byte it holds
+                "compressionRatio": len(self.compressed) * self.pageSize / self.compressedUsed if self.compressedUsed else None,
+                "compressions": self.compressions,
+                "incompressible": self.incompressible,
+                "compressSeconds": self.compressSeconds,
+                "decompressSeconds": self.decompressSeconds,
+                "decompressMicrosecondsPerPage": self.decompressSeconds * 1e6 / self.compressedHits if self.compressedHits else None,
+                "compressedEvictions": self.compressedEvictions}
+
+    def resetStats(self):
+        """reset the cache statistics, the cached pages are kept"""
+        self.hotHits = 0
+        self.compressedHits = 0
+        self.diskReads = 0
+        self.compressions = 0
+        self.incompressible = 0
+        self.compressSeconds = 0.0
+        self.decompressSeconds = 0.0
+        self.compressedEvictions = 0
+
+    def close(self):
+        self.reset()
+        self.fpt.close()
+
+    def __getattr__(self, name):
+        # behave like the wrapped file pointer for everything else (seek, read, schedule ...)
+        return getattr(self.fpt, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def repeatedScanReport(dbPath, pageSize, table, scans=3, hotBytes=PAGE_CACHE_HOT_BYTES,
+                       compressedBytes=PAGE_CACHE_COMPRESSED_BYTES, codec=PAGE_CACHE_CODEC, level=PAGE_CACHE_LEVEL):
+    """
+    run the same full scan of table (compiledScan) several times through a compressedPageCache
+
+    return a list with the statistics and the seconds of every scan
+        @param dbPath: path of the database file
+        @param pageSize: the page size of the database
+        @param table: the table name
+        @param scans: number of scans
+        @param hotBytes: byte budget of the plain pages
+        @param compressedBytes: byte budget of the compressed pages
+        @param codec: "zlib" or "lzma"
+        @param level: compression level
+    """
+    report = []
+    with compressedPageCache(open(dbPath, "rb"), pageSize, hotBytes, compressedBytes, codec, level) as cache:
+        schema = parseSchema(cache, pageSize)
+        decode = decoderFor(schema, table)
+        for _ in range(scans):
+            cache.resetStats()
+            startTime = time()
+            compiledScan(cache, pageSize, schema[table]["rootPage"], decode, lambda record: None)
+            stats = cache.stats()
+            stats["seconds"] = time() - startTime
+            report.append(stats)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="repeated full scans through the two tier compressed page cache")
+    parser.add_argument("db", help="the database file, e.g. the 16KB page layout")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE_16K)
+    parser.add_argument("--table", default="Employee")
+    parser.add_argument("--scans", type=int, default=3)
+    parser.add_argument("--hot-bytes", type=int, default=PAGE_CACHE_HOT_BYTES)
+    parser.add_argument("--compressed-bytes", type=int, default=PAGE_CACHE_COMPRESSED_BYTES)
+    parser.add_argument("--codec", choices=PAGE_CACHE_CODECS, default=PAGE_CACHE_CODEC)
+    parser.add_argument("--level", type=int, default=PAGE_CACHE_LEVEL)
+    args = parser.parse_args()
+
+    print("{:<5} {:>9} {:>9} {:>10} {:>9} {:>7} {:>12} {:>9}".format(
+        "scan", "seconds", "hot hits", "zip hits", "disk", "ratio", "us/unzip", "avoided"))
+    for i, r in enumerate(repeatedScanReport(args.db, args.page_size, args.table, args.scans, args.hot_bytes,
+                                             args.compressed_bytes, args.codec, args.level)):
+        print("{:<5} {:>9.3f} {:>9} {:>10} {:>9} {:>7} {:>12} {:>9}".format(
+            i + 1, r["seconds"], r["hotHits"], r["compressedHits"], r["diskReads"],
+            "-" if r["compressionRatio"] is None else "{:.2f}".format(r["compressionRatio"]),
+            "-" if r["decompressMicrosecondsPerPage"] is None else "{:.1f}".format(r["decompressMicrosecondsPerPage"]),
+            r["diskReadsAvoided"]))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import csv
+import gc
+import io
+import locale
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer as time
+from constants import *
+from csvParser import build_db_abstraction
+
+# parallel front-end of csvParser.build_db_abstraction: the export is cut into byte ranges
+# that end on record boundaries, every range is parsed by its own process and the results
+# are merged in file order so the output is the same as the serial parser's
+
+# bytes counted at once when looking for the quotes before a range boundary
+QUOTE_SCAN_BLOCK = 1 << 24
+
+def _count_quotes(data, start, end):
+    """count the double quotes in data[start:end] a block at a time, an mmap has no count()"""
+    quotes = 0
+    for offset in range(start, end, QUOTE_SCAN_BLOCK):
+        quotes += data[offset:min(offset + QUOTE_SCAN_BLOCK, end)].count(b'"')
+    return quotes
+
+@contextlib.contextmanager
+def _gc_paused():
+    """
+    pause the cyclic garbage collector: holding millions of parsed cells alive makes every
+    collection rescan them, which costs more than the parsing; strings and lists of strings
+    have no reference cycles to collect
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _record_boundary(data, start, candidate):
+    """
+    return the offset just after the first newline at or after candidate that is not inside
+    a quoted field, len(data) if there is none
+
+    a newline ends a record when the quotes between start (a record boundary) and it are
+    balanced; an escaped quote ("") counts twice so it does not change the parity
+        @param data: the bytes of the file (an mmap)
+        @param start: a record boundary before candidate
+        @param candidate: where to start looking for the newline
+    """
+    quotes = _count_quotes(data, start, candidate)
+    while True:
+        newline = data.find(b'\n', candidate)
+        if newline < 0:
+            return len(data)
+        quotes += _count_quotes(data, candidate, newline)
+        if quotes % 2 == 0:
+            return newline + 1
+        candidate = newline + 1
+
+def split_csv_ranges(csv_file_path, num_chunks, min_chunk_bytes=CSV_MIN_CHUNK_BYTES):
+    """
+    cut the csv file into byte ranges that each hold whole records
+
+    return (the header range, a list of (start, end) data ranges in file order)
+        @param csv_file_path: path to the csv file
+        @param num_chunks: the number of data ranges wanted
+        @param min_chunk_bytes: ranges are at least this large, a small file gives fewer ranges
+    """
+    size = os.path.getsize(csv_file_path)
+    if size == 0:
+        return (0, 0), []
+
+    with open(csv_file_path, 'rb') as data_file, \
+            mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header_end = _record_boundary(data, 0, 0)
+        chunk_bytes = max(min_chunk_bytes, (size - header_end) // max(1, num_chunks))
+
+        ranges, start = [], header_end
+        while start < size:
+            end = size if start + chunk_bytes >= size else _record_boundary(data, start, start + chunk_bytes)
+            ranges.append((start, end))
+            start = end
+
+    return (0, header_end), ranges
+
+def _read_records(csv_file_path, start, end):
+    """return the csv records of a byte range, decoded the way open(path, 'r') does"""
+    with open(csv_file_path, 'rb') as data_file:
+        data_file.seek(start)
+        data = data_file.read(end - start)
+    # same encoding and universal newlines as the text mode file of the serial parser
+    text = io.TextIOWrapper(io.BytesIO(data), encoding=locale.getpreferredencoding(False))
+    return list(csv.reader(text, delimiter=','))
+
+def _parse_range(task):
+    """
+    parse one byte range in a worker process, return what _columns_of returns for its records
+        @param task: (csv_file_path, start, end, number of columns)
+    """
+    csv_file_path, start, end, num_columns = task
+    with _gc_paused():
+        return _columns_of(_read_records(csv_file_path, start, end), num_columns)
+
+def _columns_of(rows, num_columns):
+    """return (the values of each column, the max value size of each column, the Emp IDs in first seen order)"""
+    if all(len(row) == num_columns for row in rows):
+        # whole rows: transpose once instead of appending cell by cell
+        columns = [list(values) for values in zip(*rows)] if rows else [[] for _ in range(num_columns)]
+    else:
+        # short or blank rows only fill their first columns, like the serial parser
+        columns = [[] for _ in range(num_columns)]
+        for row_data in rows:
+            for index, col_data in enumerate(row_data):
+                columns[index].append(col_data)
+
+    widths = [max(map(len, values), default=0) for values in columns]
+    return columns, widths, list(dict.fromkeys(columns[0]))
+
+def parallel_build_db_abstraction(csv_file_path, workers=None, min_chunk_bytes=CSV_MIN_CHUNK_BYTES):
+    """
+    same result as csvParser.build_db_abstraction, parsed by a pool of processes
+
+    the file is cut in CSV_CHUNKS_PER_WORKER ranges per worker so a slow range does not
+    hold up the others; the column lists are concatenated in file order, the column widths
+    are the max over the ranges and the Emp IDs keep the order they are first seen in the file.
+    a quote inside an unquoted field (not valid RFC 4180) can mislead the range cutting
+
+    @return a list of dictionary that contains all data from each columns,
+    a list of dictionary that contains the max size value for each column,
+    the column names and the dictionary of unique employees
+        @param csv_file_path: path to the csv file
+        @param workers: number of processes, os.cpu_count() by default
+        @param min_chunk_bytes: smallest byte range handed to a process
+    """
+    workers = workers or os.cpu_count() or 1
+    (header_start, header_end), ranges = split_csv_ranges(csv_file_path, workers * CSV_CHUNKS_PER_WORKER, min_chunk_bytes)
+
+    col_names = (_read_records(csv_file_path, header_start, header_end) or [[]])[0]
+    column_dict = {name: [] for name in col_names}
+    max_attribute_length = {name: 0 for name in col_names}
+    unique_emp = {}
+
+    def _merge(results):
+        # merge in file order
+        for columns, widths, emp_ids in results:
+            for name, values, width in zip(col_names, columns, widths):
+                column_dict[name].extend(values)
+                if width > max_attribute_length[name]:
+                    max_attribute_length[name] = width
+            for emp_id in emp_ids:
+                unique_emp.setdefault(emp_id, 0)
+
+    tasks = [(csv_file_path, start, end, len(col_names)) for start, end in ranges]
+    with _gc_paused():
+        if workers == 1 or len(tasks) <= 1:
+            _merge(map(_parse_range, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                _merge(executor.map(_parse_range, tasks))
+
+    return column_dict, max_attribute_length, col_names, unique_emp
+
+def speedup_report(csv_file_path, worker_counts=None, repeat=1):
+    """
+    time the serial parser and the parallel parser with each number of workers,
+    and check that every parallel result is the same as the serial one
+
+    return a list of {"workers", "seconds", "speedup", "identical"}; workers 0 is the serial parser
+        @param csv_file_path: path to the csv file
+        @param worker_counts: the numbers of workers to try, 1 up to os.cpu_count() doubling by default
+        @param repeat: timed runs per setting, best is reported
+    """
+    if worker_counts is None:
+        worker_counts, count = [], 1
+        while count < (os.cpu_count() or 1):
+            worker_counts.append(count)
+            count *= 2
+        worker_counts.append(os.cpu_count() or 1)
+
+    def _best(parse):
+        best, result = None, None
+        for _ in range(repeat):
+            startTime = time()
+            result = parse()
+            elapsed = time() - startTime
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    serial_seconds, expected = _best(lambda: build_db_abstraction(csv_file_path))
+    report = [{"workers": 0, "seconds": serial_seconds, "speedup": 1.0, "identical": True}]
+    for workers in worker_counts:
+        seconds, result = _best(lambda: parallel_build_db_abstraction(csv_file_path, workers))
+        # dictionaries compare equal regardless of order, the Emp ID order matters to the loaders
+        identical = result == expected and list(result[3]) == list(expected[3])
+        report.append({"workers": workers, "seconds": seconds, "speedup": serial_seconds / seconds, "identical": identical})
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare the serial and the parallel csv parser")
+    parser.add_argument("csv", help="the employee csv export")
+    parser.add_argument("--workers", type=int, nargs="+", help="numbers of processes to try")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per setting, best is reported")
+    args = parser.parse_args()
+
+    print("{} bytes, {} cores".format(os.path.getsize(args.csv), os.cpu_count()))
+    print("{:<8} {:>10} {:>8} {:>10}".format("workers", "seconds", "speedup", "identical"))
+    for r in speedup_report(args.csv, args.workers, args.repeat):
+        print("{:<8} {:>10.3f} {:>8.2f} {:>10}".format(r["workers"] or "serial", r["seconds"], r["speedup"], str(r["identical"])))
@@ -0,0 +1,355 @@
+import random
+from bisect import bisect_left
+from bitstring import ConstBitStream
+from constants import *
+from utils import *
+from catalog import tableColumns, indexColumns, tableIndexes
+from keyCompare import keyOrder
+from queryOperations import _pageInfo, btreeScan, indexBtreeRangeSearch, tableBtreeGetMany
+
+class btreeStatistics:
+    """
+    statistics of one btree collected from its pages on disk
+
+        @param name: the table/index name
+        @param rootPage: the root page of the tree
+        @param isIndex: whether the tree is an index btree (index or WITHOUT ROWID table)
+    """
+    def __init__(self, name, rootPage, isIndex):
+        self.name = name
+        self.rootPage = rootPage
+        self.isIndex = isIndex
+        self.height = 1
+        self.interiorPages = 0
+        self.leafCount = 1
+        self.fillFactor = 0
+        self.rowsPerLeaf = 0
+        self.minKey = None
+        self.maxKey = None
+        # sorted keys separating consecutive leaves, from every interior level
+        self.separators = []
+        # column position -> {value: fraction of the sampled rows}
+        self.histograms = {}
+
+    def totalPages(self):
+        return self.interiorPages + self.leafCount
+
+    def estimatedRows(self):
+        return self.rowsPerLeaf * self.leafCount + (len(self.separators) if self.isIndex else 0)
+
+    def leavesInRange(self, lower, upper):
+        """estimate the number of leaves holding keys in [lower, upper] from the leaf separators"""
+        first = bisect_left(self.separators, lower)
+        last = bisect_left(self.separators, upper)
+        return min(self.leafCount, last - first + 1)
+
+    def rowsInRange(self, lower, upper):
+        """
+        estimate the number of rows with keys in [lower, upper]; numeric keys are
+        interpolated linearly inside the first and last leaf of the range
+        """
+        if not isinstance(lower, (int, float)) or self.minKey is None:
+            return self.leavesInRange(lower, upper) * self.rowsPerLeaf
+
+        bounds = [self.minKey] + self.separators + [self.maxKey]
+
+        def _position(key):
+            # fractional leaf number of key in the key order
+            i = min(max(bisect_left(self.separators, key), 0), len(bounds) - 2)
+            low, high = bounds[i], bounds[i + 1]
+            fraction = 0 if high <= low else min(max((key - low) / (high - low), 0), 1)
+            return i + fraction
+
+        return max(1, (_position(upper) - _position(lower)) * self.rowsPerLeaf)
+
+    def selectivity(self, position, value):
+        """fraction of the rows whose column at position equals value, from the sampled histogram"""
+        histogram = self.histograms.get(position)
+        if not histogram:
+            return DEFAULT_SELECTIVITY
+        # a value that was not sampled is rarer than the rarest sampled one
+        return histogram.get(value, min(histogram.values()) / 2)
+
+    def __repr__(self):
+        return ("{}: height={} interior={} leaves={} fill={:.0%} rows/leaf={:.1f} keys=[{}, {}]"
+                .format(self.name, self.height, self.interiorPages, self.leafCount, self.fillFactor,
+                        self.rowsPerLeaf, self.minKey, self.maxKey))
+
+def _pageFill(currentPageBitstream, pageSize, headerOffset):
+    """return the fraction of the page used by the header, cell pointers and cells"""
+    pageType, numCells, toPosition, _ = _pageInfo(currentPageBitstream)
+    contentStart = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', BTREE_START_CELLCONTENT_AREA_OFFSET) or 65536
+    fragmented = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:1', 7)
+
+    # sum the free blocks chained from offset 1 of the page header
+    freeBlocks = 0
+    freeBlock = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', 1)
+    while freeBlock:
+        freeBlocks += bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', freeBlock + 2)
+        freeBlock = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', freeBlock)
+
+    unallocated = contentStart - (headerOffset + toPosition + numCells * CELL_POINTER_SIZE)
+    return 1 - (unallocated + freeBlocks + fragmented) / pageSize
+
+def _leafKeys(currentPageBitstream, fpt, pageSize):
+    """return (first key, last key, records) of a leaf page; the key is the rowid for table leaves"""
+    pageType, numCells, toPosition, _ = _pageInfo(currentPageBitstream)
+    keys, records = [], []
+    for i in range(0, numCells):
+        cellOffset = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', i * 2 + toPosition)
+        _, record = parse_cell_content(cellOffset, currentPageBitstream, pageType, fpt, pageSize)
+        if pageType == LEAF_TABLE_BTREE_PAGE_FLAG:
+            _, _, varintBytes = readVarintAtOffset(cellOffset, currentPageBitstream)
+            keys.append(readVarintAtOffset(cellOffset + varintBytes, currentPageBitstream)[0])
+        else:
+            keys.append(record[0])
+        records.append(record)
+    return (keys[0] if keys else None), (keys[-1] if keys else None), records
+
+def collectTreeStatistics(fpt, pageSize, name, rootPage, sampleLeaves=PLANNER_SAMPLE_LEAVES, seed=None):
+    """
+    collect the statistics of a btree by reading its interior pages level by level,
+    its left most and right most leaves and sampleLeaves random leaves
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param name: the table/index name
+        @param rootPage: the root page of the tree
+        @param sampleLeaves: number of random leaves decoded for the column histograms
+        @param seed: random seed of the leaf sample
+    """
+    level, fills = [rootPage], []
+    stats = None
+
+    while True:
+        children = []
+        for pageNum in level:
+            pageBitstream = ConstBitStream(readPage(pageNum, fpt, pageSize))
+            pageType, numCells, toPosition, rightMostPointer = _pageInfo(pageBitstream)
+            if stats is None:
+                stats = btreeStatistics(name, rootPage, pageType in (INTERIOR_INDEX_BTREE_PAGE_FLAG, LEAF_INDEX_BTREE_PAGE_FLAG))
+            if not rightMostPointer:
+                break
+
+            stats.interiorPages += 1
+            fills.append(_pageFill(pageBitstream, pageSize, 0))
+            for i in range(0, numCells):
+                cellOffset = bitstreamReadAtOffset(pageBitstream, int, 'bytes:2', i * 2 + toPosition)
+                child, record = parse_cell_content(cellOffset, pageBitstream, pageType, fpt, pageSize)
+                if pageType == INTERIROR_TABLE_BTREE_PAGE_FLAG:
+                    stats.separators.append(readVarintAtOffset(cellOffset + POINTER_SIZE, pageBitstream)[0])
+                else:
+                    stats.separators.append(record[0])
+                children.append(child)
+            children.append(rightMostPointer)
+
+        if not children:
+            # the pages of this level are the leaves
+            break
+        stats.height += 1
+        level = children
+
+    stats.separators.sort()
+    stats.leafCount = len(level)
+
+    # read the first and last leaf for the key range, plus a random sample for the histograms
+    rng = random.Random(seed)
+    sampled = sorted(set([level[0], level[-1]] + rng.sample(level, min(sampleLeaves, len(level)))), key=level.index)
+    cellCounts, leafFills, values = [], [], {}
+    for pageNum in sampled:
+        pageBitstream = ConstBitStream(readPage(pageNum, fpt, pageSize))
+        firstKey, lastKey, records = _leafKeys(pageBitstream, fpt, pageSize)
+        if pageNum == level[0]:
+            stats.minKey = firstKey
+        if pageNum == level[-1]:
+            stats.maxKey = lastKey
+        cellCounts.append(len(records))
+        leafFills.append(_pageFill(pageBitstream, pageSize, DATABASE_FILE_HEADER_SIZE if pageNum == 1 else 0))
+        for record in records:
+            for position, value in enumerate(record):
+                counts = values.setdefault(position, {})
+                counts[value] = counts.get(value, 0) + 1
+
+    stats.rowsPerLeaf = sum(cellCounts) / len(cellCounts)
+    stats.fillFactor = (sum(fills) + sum(leafFills) * stats.leafCount / len(leafFills)) / (stats.interiorPages + stats.leafCount)
+    numSampled = sum(cellCounts)
+    if sampleLeaves and numSampled:
+        stats.histograms = {position: {value: count / numSampled for value, count in counts.items()}
+                            for position, counts in values.items()}
+    return stats
+
+def collectStatistics(fpt, pageSize, sampleLeaves=PLANNER_SAMPLE_LEAVES, seed=None):
+    """
+    return (schema, {table/index name: btreeStatistics}) for every btree of the database
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param sampleLeaves: number of random leaves decoded per tree for the histograms
+        @param seed: random seed of the leaf sample
+    """
+    schema = parseSchema(fpt, pageSize)
+    return schema, {name: collectTreeStatistics(fpt, pageSize, name, entry["rootPage"], sampleLeaves, seed)
+                    for name, entry in schema.items() if entry["rootPage"]}
+
+def _pagesTouched(pages, rows):
+    """expected number of distinct pages hit by rows random lookups over pages pages (Cardenas)"""
+    if pages <= 0:
+        return 0
+    return pages * (1 - (1 - 1 / pages) ** rows)
+
+def candidatePlans(schema, statistics, table, predicate, referencedColumns):
+    """
+    return every usable access path for the predicate as a list of plan dictionaries
+    {"method", "tree", "estimatedPages", "estimatedRows"} sorted by estimated page reads
+
+    predicates are ("eq", column, value) or ("range", column, lower, upper) on the cleaned column names
+
+        @param schema: the catalog returned by parseSchema
+        @param statistics: the statistics returned by collectStatistics
+        @param table: the table name
+        @param predicate: the predicate tuple
+        @param referencedColumns: every column the query reads
+    """
+    op, column = predicate[0], predicate[1]
+    lower, upper = (predicate[2], predicate[2]) if op == "eq" else (predicate[2], predicate[3])
+
+    columns, primaryKey, withoutRowid = tableColumns(schema[table]["sql"])
+    columnNames = [name for name, _ in columns]
+    tableStats = statistics[table]
+    totalRows = max(1, tableStats.estimatedRows())
+
+    def _rowsMatching(stats, position, leaves):
+        if op == "eq":
+            return totalRows * stats.selectivity(position, lower) if stats.histograms else 1
+        return min(totalRows, stats.rowsInRange(lower, upper))
+
+    plans = [{"method": "scan", "tree": table, "estimatedPages": tableStats.totalPages(),
+              "estimatedRows": totalRows * (tableStats.selectivity(columnNames.index(column), lower)
+                                            if op == "eq" else DEFAULT_SELECTIVITY)}]
+
+    if withoutRowid and primaryKey[:1] == [column]:
+        leaves = tableStats.leavesInRange(lower, upper)
+        plans.append({"method": "clustered-index", "tree": table,
+                      "estimatedPages": tableStats.height - 1 + leaves,
+                      "estimatedRows": _rowsMatching(tableStats, 0, leaves)})
+
+    for indexName in tableIndexes(schema, table):
+        recordColumns = indexColumns(schema, indexName)
+        if indexName not in statistics or recordColumns[0] != column:
+            continue
+        indexStats = statistics[indexName]
+        leaves = indexStats.leavesInRange(lower, upper)
+        rows = _rowsMatching(indexStats, 0, leaves)
+        indexPages = indexStats.height - 1 + leaves
+
+        if set(referencedColumns).issubset(recordColumns):
+            plans.append({"method": "index-only", "tree": indexName, "estimatedPages": indexPages, "estimatedRows": rows})
+        elif not withoutRowid:
+            # the rowids are fetched with one batched descent of the table: pages per level of the table tree
+            levels = [1]
+            if tableStats.height > 1:
+                levels += [tableStats.interiorPages / (tableStats.height - 1)] * (tableStats.height - 2) + [tableStats.leafCount]
+            tablePages = sum(_pagesTouched(pages, rows) for pages in levels)
+            plans.append({"method": "index+table", "tree": indexName,
+                          "estimatedPages": indexPages + tablePages, "estimatedRows": rows})
+
+    # the key order of an index estimates a range better than the default selectivity
+    if op == "range" and len(plans) > 1:
+        plans[0]["estimatedRows"] = plans[1]["estimatedRows"]
+
+    return sorted(plans, key=lambda plan: plan["estimatedPages"])
+
+def executePlan(fpt, pageSize, schema, table, plan, predicate, referencedColumns):
+    """
+    run the plan and return the referenced columns of the matching rows as tuples
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param schema: the catalog returned by parseSchema
+        @param table: the table name
+        @param plan: one of the plans returned by candidatePlans
+        @param predicate: the predicate tuple
+        @param referencedColumns: every column the query reads
+    """
+    op, column = predicate[0], predicate[1]
+    lower, upper = (predicate[2], predicate[2]) if op == "eq" else (predicate[2], predicate[3])
+    columns, _, _ = tableColumns(schema[table]["sql"])
+    columnNames = [name for name, _ in columns]
+    position = columnNames.index(column)
+    projection = [columnNames.index(name) for name in referencedColumns]
+    treeBitstream = ConstBitStream(readPage(schema[plan["tree"]]["rootPage"], fpt, pageSize))
+    recordAccessMethod(plan["method"])
+    # compared in SQLite's order, a NULL column is below every bound and never matches
+    lowerKey, upperKey = keyOrder(lower), keyOrder(upper)
+
+    def _between(value):
+        return value is not None and lowerKey <= keyOrder(value) <= upperKey
+
+    def _project(record, positions=projection):
+        return tuple(record[i] for i in positions)
+
+    if plan["method"] == "scan":
+        rows = []
+
+        def _collect(record):
+            if record and _between(record[position]):
+                rows.append(_project(record))
+            return None
+
+        btreeScan(treeBitstream, fpt, _collect, pageSize)
+        return rows
+
+    def _inRange(record):
+        return record and _between(record[0])
+
+    if plan["method"] == "clustered-index":
+        return indexBtreeRangeSearch(treeBitstream, fpt, lower, upper,
+                                     lambda record: [_project(record)] if _inRange(record) else [], pageSize)
+
+    if plan["method"] == "index-only":
+        recordColumns = indexColumns(schema, plan["tree"])
+        positions = [recordColumns.index(name) for name in referencedColumns]
+        return indexBtreeRangeSearch(treeBitstream, fpt, lower, upper,
+                                     lambda record: [_project(record, positions)] if _inRange(record) else [], pageSize)
+
+    # index+table: the rowid is the last field of the index record
+    rowids = indexBtreeRangeSearch(treeBitstream, fpt, lower, upper,
+                                   lambda record: [record[-1]] if _inRange(record) else [], pageSize)
+    found = {}
+    tableBitstream = ConstBitStream(readPage(schema[table]["rootPage"], fpt, pageSize))
+    tableBtreeGetMany(tableBitstream, fpt, sorted(set(rowids)), found, pageSize)
+    return [_project(found[rowid]) for rowid in rowids if rowid in found]
+
+def _pagesReadSoFar():
+    return (headerPageType.getReadCounts() + dataPageType.getReadCounts() +
+            indexInternalPageType.getReadCounts() + indexLeafPageType.getReadCounts())
+
+def planQuery(fpt, pageSize, table, predicate, referencedColumns, statistics=None, explain=False):
+    """
+    choose the access path with the fewest estimated page reads and run it
+
+    return the matching rows as tuples of the referenced columns; with explain
+    every candidate plan is printed with its estimate, followed by the actual
+    page reads (readCounts) of the chosen one
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param table: the table name
+        @param predicate: ("eq", column, value) or ("range", column, lower, upper)
+        @param referencedColumns: every column the query reads
+        @param statistics: (schema, statistics) from collectStatistics, collected now if not given
+        @param explain: print the plans and the estimated vs actual page reads
+    """
+    schema, treeStats = statistics or collectStatistics(fpt, pageSize)
+    plans = candidatePlans(schema, treeStats, table, predicate, referencedColumns)
+    chosen = plans[0]
+
+    before = _pagesReadSoFar()
+    rows = executePlan(fpt, pageSize, schema, table, chosen, predicate, referencedColumns)
+    actual = _pagesReadSoFar() - before
+
+    if explain:
+        print("EXPLAIN {} WHERE {}".format(table, predicate))
+        for plan in plans:
+            print("  {} {:<16} on {:<30} estimated pages: {:>8.1f}  estimated rows: {:>8.1f}".format(
+                "*" if plan is chosen else " ", plan["method"], plan["tree"], plan["estimatedPages"], plan["estimatedRows"]))
+        print("  actual pages read: {}  actual rows: {}".format(actual, len(rows)))
+    return rows
@@ -0,0 +1,119 @@
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from constants import *
+from metrics import currentMetrics
+
+class prefetchingFile:
+    """
+    wrap a db file pointer so the child pages of every decoded interior page
+    are read by a small thread pool while the traversal is still parsing cells
+
+    btreeScan hands the child pointers of each interior page to schedule();
+    the pages are queued and read ahead of the traversal into a bounded cache
+    of at most prefetchDepth pages (read or in flight)
+
+        @param fpt: the file pointer of the db file (opened in "rb")
+        @param pageSize: the page size of the database
+        @param prefetchDepth: max number of prefetched pages held or in flight
+        @param numThreads: number of reader threads
+    """
+    def __init__(self, fpt, pageSize, prefetchDepth=PREFETCH_DEPTH, numThreads=PREFETCH_THREADS):
+        self.fpt = fpt
+        self.fd = fpt.fileno()
+        self.pageSize = pageSize
+        self.prefetchDepth = max(1, prefetchDepth)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, numThreads))
+
+        # page -> future of its bytes, oldest first; pages waiting for a free slot
+        self.cache = OrderedDict()
+        self.pending = deque()
+
+        self.resetStats()
+
+    def schedule(self, pageNums):
+        """
+        queue the child pages of an interior page for prefetching; they are
+        visited before anything queued earlier so they go to the front
+            @param pageNums: the child page numbers in visiting order
+        """
+        wanted = set(pageNums)
+
+        # make room for the new children by dropping older speculative reads
+        while len(self.cache) >= self.prefetchDepth:
+            stale = next((pageNum for pageNum in self.cache if pageNum not in wanted), None)
+            if stale is None:
+                break
+            self.cache.pop(stale).cancel()
+            self.dropped += 1
+
+        self.pending.extendleft(reversed([pageNum for pageNum in pageNums if pageNum not in self.cache]))
+        self._topUp()
+
+    def fetchPage(self, pageNum, pageSize):
+        """
+        return the page as bytes, waiting for its prefetch if it is in flight
+            @param pageNum: the page number to fetch
+            @param pageSize: the page size of the database
+        """
+        future = self.cache.pop(pageNum, None)
+        if future is not None and not future.cancelled():
+            if not future.done():
+                self.stalls += 1
+            page = future.result()
+            self.prefetchHits += 1
+        else:
+            page = os.pread(self.fd, pageSize, (pageNum - 1) * pageSize)
+            self.misses += 1
+
+        # the reader threads run outside the query context, count their reads when served
+        metrics = currentMetrics()
+        if metrics is not None:
+            metrics.recordPhysicalRead(1, len(page))
+
+        self._topUp()
+        return page
+
+    def _topUp(self):
+        """submit queued pages to the pool until prefetchDepth pages are held or in flight"""
+        while self.pending and len(self.cache) < self.prefetchDepth:
+            pageNum = self.pending.popleft()
+            if pageNum in self.cache:
+                continue
+            self.cache[pageNum] = self.pool.submit(os.pread, self.fd, self.pageSize, (pageNum - 1) * self.pageSize)
+
+    def reset(self):
+        """forget every queued and prefetched page, typically between scans"""
+        for future in self.cache.values():
+            future.cancel()
+        self.cache.clear()
+        self.pending.clear()
+
+    def stats(self):
+        """return the prefetch statistics since the last reset"""
+        return {"prefetchHits": self.prefetchHits,
+                "stalls": self.stalls,
+                "misses": self.misses,
+                "dropped": self.dropped}
+
+    def resetStats(self):
+        """reset the prefetch statistics"""
+        self.prefetchHits = 0
+        self.stalls = 0
+        self.misses = 0
+        self.dropped = 0
+
+    def close(self):
+        self.reset()
+        self.pool.shutdown(wait=True)
+        self.fpt.close()
+
+    def __getattr__(self, name):
+        # behave like the wrapped file pointer for everything else (seek, read ...)
+        return getattr(self.fpt, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
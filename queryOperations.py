@@ -1,6 +1,9 @@
 from bitstring import BitArray, ConstBitStream
 from constants import *
 from utils import *
+from catalog import tableColumns, indexColumns, coveringIndex
+from keyCompare import keyComparator, indexComparator
+from bisect import bisect_left, bisect_right
 import sys
 
 
@@ -36,7 +39,23 @@ def _pageInfo(currentPageBitstream):
 
     return (pageType, numCells, toPosition, rightMostPointer)
 
-def btreeScan(currentPageBitstream, fpt, ops, pageSize):
+def _childPointers(currentPageBitstream, numCells, toPosition, rightMostPointer):
+    """
+    return the child page numbers of an interior page in traversal order
+        @param currentPageBitstream: the bitstream reader of an interior page
+        @param numCells: number of cells in the page
+        @param toPosition: the offset of the cell pointer array
+        @param rightMostPointer: the right most pointer of the page
+    """
+    children = []
+    for i in range(0, numCells):
+        cellOffset = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', i * 2 + toPosition)
+        # the left child pointer is the first four bytes of an interior cell
+        children.append(bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:{}'.format(POINTER_SIZE), cellOffset))
+    children.append(rightMostPointer)
+    return children
+
+def btreeScan(currentPageBitstream, fpt, ops, pageSize, level=0):
     """
     -scan operation for all query and databases
     -this operation only search for the rowid table btrees index btree only for WITHOUT ROWID table
@@ -48,9 +67,14 @@ def btreeScan(currentPageBitstream, fpt, ops, pageSize):
         @param fpt: the file pointer of a page
         @param ops: operation function for each record
         @param pageSize: the page size of the db
+        @param level: the depth of the current page in the btree (0 = root)
     """
     pageType, numCells, toPosition, rightMostPointer = _pageInfo(currentPageBitstream)
-    readCounts(pageType)
+    readCounts(pageType, level)
+
+    # let a read-ahead/prefetching page source know which pages come next
+    if rightMostPointer and hasattr(fpt, 'schedule'):
+        fpt.schedule(_childPointers(currentPageBitstream, numCells, toPosition, rightMostPointer))
 
     # read each cell offset within the page from the cell pointer array
     for i in range(0, numCells):
@@ -63,7 +87,7 @@ def btreeScan(currentPageBitstream, fpt, ops, pageSize):
         # recursively traverse
         if nxtChildPage:
             nxtPagebitstream = ConstBitStream(readPage(nxtChildPage, fpt, pageSize))
-            if btreeScan(nxtPagebitstream, fpt, ops, pageSize):
+            if btreeScan(nxtPagebitstream, fpt, ops, pageSize, level + 1):
                 return record
 
         # in the leaf/interior page, try to find the matching query condition: LAST_NAME
@@ -72,11 +96,61 @@ def btreeScan(currentPageBitstream, fpt, ops, pageSize):
 
     if rightMostPointer:
         nxtPagebitstream = ConstBitStream(readPage(rightMostPointer, fpt, pageSize))
-        if btreeScan(nxtPagebitstream, fpt, ops, pageSize):
+        if btreeScan(nxtPagebitstream, fpt, ops, pageSize, level + 1):
             return record
     return None
 
-def tableBtreeEqualitySearch(currentPageBitstream, fpt, rowid, pageSize):
+def orderedScan(currentPageBitstream, fpt, ops, pageSize, descending=False, level=0):
+    """
+    visit the records of a btree in key order, or in reverse key order from the
+    right most leaf when descending; ops is only called with records and the
+    traversal stops as soon as ops returns a truthy value
+
+    return the record ops stopped at, None otherwise
+        @param currentPageBitstream: the bitstream reader of a page
+        @param fpt: the file pointer of a page
+        @param ops: operation function for each record
+        @param pageSize: the page size of the db
+        @param descending: visit the records from the largest key to the smallest
+        @param level: the depth of the current page in the btree (0 = root)
+    """
+    pageType, numCells, toPosition, rightMostPointer = _pageInfo(currentPageBitstream)
+    readCounts(pageType, level)
+
+    def _visitChild(childPage):
+        nxtPagebitstream = ConstBitStream(readPage(childPage, fpt, pageSize))
+        return orderedScan(nxtPagebitstream, fpt, ops, pageSize, descending, level + 1)
+
+    if descending and rightMostPointer:
+        stoppedAt = _visitChild(rightMostPointer)
+        if stoppedAt is not None:
+            return stoppedAt
+
+    cells = range(numCells - 1, -1, -1) if descending else range(0, numCells)
+    for i in cells:
+        cellOffset = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', i * 2 + toPosition)
+        nxtChildPage, record = parse_cell_content(cellOffset, currentPageBitstream, pageType, fpt, pageSize)
+
+        # the left child of a cell holds the smaller keys: before the cell ascending, after it descending
+        if nxtChildPage and not descending:
+            stoppedAt = _visitChild(nxtChildPage)
+            if stoppedAt is not None:
+                return stoppedAt
+
+        # interior cells of an index btree carry a record too, table interior cells do not
+        if record and ops(record):
+            return record
+
+        if nxtChildPage and descending:
+            stoppedAt = _visitChild(nxtChildPage)
+            if stoppedAt is not None:
+                return stoppedAt
+
+    if rightMostPointer and not descending:
+        return _visitChild(rightMostPointer)
+    return None
+
+def tableBtreeEqualitySearch(currentPageBitstream, fpt, rowid, pageSize, level=0, ops=printFullnameOnly):
     """
     -equality search in a table btree for (a,a) and (a, b)
         based on the Emp_ID (the indexed column)
@@ -87,9 +161,11 @@ def tableBtreeEqualitySearch(currentPageBitstream, fpt, rowid, pageSize):
         @param fpt: the file pointer of a page
         @param rowid: look for a record with this rowid
         @param pageSize: the page size of the db
+        @param level: the depth of the current page in the btree (0 = root)
+        @param ops: the operation to be done for the found record, prints the full name by default
     """
     pageType, numCells, toPosition, rightMostPointer = _pageInfo(currentPageBitstream)
-    readCounts(pageType)
+    readCounts(pageType, level)
     # read each cell offset within the page from the cell pointer array
     for i in range(0, numCells):
 
@@ -107,8 +183,7 @@ def tableBtreeEqualitySearch(currentPageBitstream, fpt, rowid, pageSize):
             if rowid <= currentRowid:
                 # keep traverse to the left of this cell
                 nxtPagebitstream = ConstBitStream(readPage(nxtChildPage, fpt, pageSize))
-                tableBtreeEqualitySearch(nxtPagebitstream, fpt, rowid, pageSize)
-                return 
+                return tableBtreeEqualitySearch(nxtPagebitstream, fpt, rowid, pageSize, level + 1, ops)
             # when the rowid > currentRowid ==> iterate nxt cell to try
             continue
 
@@ -120,22 +195,21 @@ def tableBtreeEqualitySearch(currentPageBitstream, fpt, rowid, pageSize):
        
         if currentRowid == rowid:
             # found the record
-            print("Full Name: {} {} {}".format(record[FIRST_NAME_INDEX],
-                                               record[MIDDLE_NAME_INDEX],
-                                               record[LAST_NAME_INDEX]))
-            return
+            ops(record)
+            return record
         elif currentRowid > rowid: # ==> the rest of cell in this page has greater rowid
-            return
+            return None
          # iterate the nxt cell to check equality
 
     if rightMostPointer:
         nxtPagebitstream = ConstBitStream(readPage(rightMostPointer, fpt, pageSize))
-        tableBtreeEqualitySearch(nxtPagebitstream, fpt, rowid, pageSize)
+        return tableBtreeEqualitySearch(nxtPagebitstream, fpt, rowid, pageSize, level + 1, ops)
     else:
         # sanity check for debug
         print("record not found")
+    return None
 
-def indexBtreeEqualitySearch(currentPageBitstream, fpt, empID, ops, pageSize):
+def indexBtreeEqualitySearch(currentPageBitstream, fpt, empID, ops, pageSize, comparator=None, level=0):
     """
     equality search in the index btree (c,b) and (d, c)
         may need to search through this to get the rowid then
@@ -149,10 +223,12 @@ def indexBtreeEqualitySearch(currentPageBitstream, fpt, empID, ops, pageSize):
                 assume empID is the indexed column; should be sorted in the index btree
         @param ops: the operation to be done for each record
         @param pageSize: the page size of the db
+        @param comparator: the keyComparator of the index, BINARY ascending columns by default
+        @param level: the depth of the current page in the btree (0 = root)
     """
-
+    comparator = comparator or keyComparator([])
     pageType, numCells, toPosition, rightMostPointer = _pageInfo(currentPageBitstream)
-    readCounts(pageType)
+    readCounts(pageType, level)
     # store the child pointer of the previous cell
     result = -1
     # determine the direction of traversing the cells
@@ -173,26 +249,27 @@ def indexBtreeEqualitySearch(currentPageBitstream, fpt, empID, ops, pageSize):
         # if found a matching record ==> no need to search
         result = ops(record)
         if result:
-            break
+            # an interior cell holds a key too: do not go on to the right most pointer
+            return result
 
         # need to traversethe pointer of the cell since we want to find the best matching        
-        if empID < record[0]:
+        if comparator.compare((empID,), record) < 0:
 
             # by the sorted properties and in the leaf page ==> empID << record for all cells
             if not nxtChildPage:
                 break
             nxtPagebitstream = ConstBitStream(readPage(nxtChildPage, fpt, pageSize))
-            return indexBtreeEqualitySearch(nxtPagebitstream, fpt, empID, ops, pageSize)
+            return indexBtreeEqualitySearch(nxtPagebitstream, fpt, empID, ops, pageSize, comparator, level + 1)
 
         # if empID > record[0], iterate the nxt cell; let the cell key get closer to the empID from the left
 
     if rightMostPointer:
         nxtPagebitstream = ConstBitStream(readPage(rightMostPointer, fpt, pageSize))
-        return indexBtreeEqualitySearch(nxtPagebitstream, fpt, empID, ops, pageSize)
+        return indexBtreeEqualitySearch(nxtPagebitstream, fpt, empID, ops, pageSize, comparator, level + 1)
 
     return result
 
-def indexBtreeRangeSearch(currentPageBitstream, fpt, lower, upper, ops, pageSize):
+def indexBtreeRangeSearch(currentPageBitstream, fpt, lower, upper, ops, pageSize, comparator=None, level=0):
     """
     range search in a index btree for (c,c) and (d, c)
     find the smallest rowid that is bigger than or equal to lowerbound
@@ -204,11 +281,14 @@ def indexBtreeRangeSearch(currentPageBitstream, fpt, lower, upper, ops, pageSize
         @param upper: upper bound of the range search
         @param ops: the operation to be done for each record
         @param pageSize: the page size of the db 
+        @param comparator: the keyComparator of the index, BINARY ascending columns by default
+        @param level: the depth of the current page in the btree (0 = root)
     """
+    comparator = comparator or keyComparator([])
     result = []
 
     pageType, numCells, toPosition, rightMostPointer = _pageInfo(currentPageBitstream)
-    readCounts(pageType)
+    readCounts(pageType, level)
     # determine the direction of traversing the cells
     start, end, step = 0, numCells, 1
 
@@ -221,26 +301,348 @@ def indexBtreeRangeSearch(currentPageBitstream, fpt, lower, upper, ops, pageSize
         nxtChildPage, record = parse_cell_content(cellOffset, currentPageBitstream, pageType, fpt, pageSize)
 
         if nxtChildPage:
-            if lower <= record[0] or upper <= record[0]:
+            # only the first column is compared, like SQLite compares a key prefix
+            if comparator.compare(record, (lower,)) >= 0 or comparator.compare(record, (upper,)) >= 0:
                 nxtPagebitstream = ConstBitStream(readPage(nxtChildPage, fpt, pageSize))
-                result.extend(indexBtreeRangeSearch(nxtPagebitstream, fpt, lower, upper, ops, pageSize))
-            elif record[0] < lower or record[0] < upper:
+                result.extend(indexBtreeRangeSearch(nxtPagebitstream, fpt, lower, upper, ops, pageSize, comparator, level + 1))
+            else:
                 # try the next cell within the same page
                 continue
         
         result.extend(ops(record))
 
         # since the keys are sorted in ascending order ==> no need to search anymore
-        if upper < record[0]:
+        if comparator.compare(record, (upper,)) > 0:
             break
         # if lower > records ==> iterate the nxt cell in the same page and keep checking
     
     # also look for the extra pointer within each interiro page
     if rightMostPointer:
         nxtPagebitstream = ConstBitStream(readPage(rightMostPointer, fpt, pageSize))
-        result.extend(indexBtreeRangeSearch(nxtPagebitstream, fpt, lower, upper, ops, pageSize))
+        result.extend(indexBtreeRangeSearch(nxtPagebitstream, fpt, lower, upper, ops, pageSize, comparator, level + 1))
     return result
 
+def indexBtreeKeyRangeSearch(currentPageBitstream, fpt, lower, upper, ops, pageSize, comparator=None, level=0):
+    """
+    range search on the full key of an index btree (or a WITHOUT ROWID table) in SQLite's
+    record order: multi-column keys, NULL < numbers < text < blob, collations and DESC columns
+
+    the bounds are key prefixes and both are inclusive, so (last name,) as both bounds
+    seeks every record of that last name and (last name, first name) a single person;
+    lower is the bound that comes first in the index order, which for a DESC column is
+    the largest value. ops is called with every record in range, in index order, and
+    the search stops as soon as it returns a truthy value
+
+    return True if the search stopped (past upper or by ops), False otherwise
+        @param currentPageBitstream: the bitstream for the index page;
+                start from the root page of a index tree
+        @param fpt: the file pointer of a page
+        @param lower: tuple of the first key in range, None for no lower bound
+        @param upper: tuple of the last key in range, None for no upper bound
+        @param ops: the operation to be done for each record in range
+        @param pageSize: the page size of the db
+        @param comparator: the keyComparator of the index, BINARY ascending columns by default
+        @param level: the depth of the current page in the btree (0 = root)
+    """
+    comparator = comparator or keyComparator([])
+    pageType, numCells, toPosition, rightMostPointer = _pageInfo(currentPageBitstream)
+    readCounts(pageType, level)
+
+    for i in range(0, numCells):
+        cellOffset = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', i * 2 + toPosition)
+        nxtChildPage, record = parse_cell_content(cellOffset, currentPageBitstream, pageType, fpt, pageSize)
+
+        # the left child holds the keys before the cell: skip it when the cell is still below lower
+        afterLower = lower is None or comparator.compare(record, lower) >= 0
+        if nxtChildPage and afterLower:
+            nxtPagebitstream = ConstBitStream(readPage(nxtChildPage, fpt, pageSize))
+            if indexBtreeKeyRangeSearch(nxtPagebitstream, fpt, lower, upper, ops, pageSize, comparator, level + 1):
+                return True
+
+        # the keys are sorted ==> every later cell is past upper too
+        if upper is not None and comparator.compare(record, upper) > 0:
+            return True
+
+        # interior cells of an index btree carry a record too
+        if afterLower and ops(record):
+            return True
+
+    if rightMostPointer:
+        nxtPagebitstream = ConstBitStream(readPage(rightMostPointer, fpt, pageSize))
+        return indexBtreeKeyRangeSearch(nxtPagebitstream, fpt, lower, upper, ops, pageSize, comparator, level + 1)
+    return False
+
+def compositeKeyQuery(fpt, pageSize, indexName, lower, upper, limit=None):
+    """
+    return the table records whose key in the index lies within [lower, upper], in index order,
+    e.g. every employee named ("Rowe", "Adam") through an index on (Last_Name, First_Name)
+
+    on a rowid table the rowids found in the index are fetched with one shared descent of the table,
+    on a WITHOUT ROWID table with one seek of the clustered btree per primary key;
+    the name of a WITHOUT ROWID table searches its clustered btree directly
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param indexName: the index name, or the name of a WITHOUT ROWID table
+        @param lower: tuple of the first key in range, None for no lower bound
+        @param upper: tuple of the last key in range, None for no upper bound
+        @param limit: stop after this many records, every record in range by default
+    """
+    schema = parseSchema(fpt, pageSize)
+    entry = schema[indexName]
+    comparator = indexComparator(schema, indexName)
+    indexPagestream = ConstBitStream(readPage(entry['rootPage'], fpt, pageSize))
+    records = []
+
+    def _collect(record):
+        records.append(record)
+        return limit is not None and len(records) >= limit
+
+    if entry['type'] == 'table':
+        recordAccessMethod("composite-clustered-index")
+        indexBtreeKeyRangeSearch(indexPagestream, fpt, lower, upper, _collect, pageSize, comparator)
+        return records
+
+    recordAccessMethod("composite-index+table")
+    indexBtreeKeyRangeSearch(indexPagestream, fpt, lower, upper, _collect, pageSize, comparator)
+    tableName = entry['tableName']
+    _, primaryKey, withoutRowid = tableColumns(schema[tableName]['sql'])
+    tablePageBitstream = ConstBitStream(readPage(schema[tableName]['rootPage'], fpt, pageSize))
+
+    if withoutRowid:
+        # the index record ends with the primary key: one seek of the clustered btree per record
+        keyPositions = [indexColumns(schema, indexName).index(name) for name in primaryKey]
+        tableComparator = indexComparator(schema, tableName)
+        rows = []
+        for record in records:
+            key = tuple(record[position] for position in keyPositions)
+            indexBtreeKeyRangeSearch(tablePageBitstream, fpt, key, key, lambda row: rows.append(row) or True, pageSize, tableComparator)
+        return rows
+
+    # the rowid is the last field of the index record
+    rows = {}
+    tableBtreeGetMany(tablePageBitstream, fpt, sorted(set(record[-1] for record in records)), rows, pageSize)
+    return [rows[record[-1]] for record in records if record[-1] in rows]
+
+def tableBtreeGetMany(currentPageBitstream, fpt, rowids, found, pageSize, level=0):
+    """
+    batched equality search in a table btree: the sorted rowids are split across
+    the child pointers of each interior page so every page is read at most once
+
+        @param currentPageBitstream: the bitstream reader of a page
+        @param fpt: the file pointer of a page
+        @param rowids: the rowids to look up, sorted ascending without duplicates
+        @param found: dictionary filled with rowid -> record
+        @param pageSize: the page size of the db
+        @param level: the depth of the current page in the btree (0 = root)
+    """
+    pageType, numCells, toPosition, rightMostPointer = _pageInfo(currentPageBitstream)
+    readCounts(pageType, level)
+    start = 0
+
+    for i in range(0, numCells):
+        if start == len(rowids):
+            return
+
+        cellOffset = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', i * 2 + toPosition)
+
+        if pageType == INTERIROR_TABLE_BTREE_PAGE_FLAG:
+            # every rowid <= the cell key belongs to the left child of the cell
+            nxtChildPage = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:{}'.format(POINTER_SIZE), cellOffset)
+            currentRowid, _, _ = readVarintAtOffset(cellOffset + POINTER_SIZE, currentPageBitstream)
+            end = bisect_right(rowids, currentRowid, start)
+            if end > start:
+                nxtPagebitstream = ConstBitStream(readPage(nxtChildPage, fpt, pageSize))
+                tableBtreeGetMany(nxtPagebitstream, fpt, rowids[start:end], found, pageSize, level + 1)
+            start = end
+            continue
+
+        # in the leaf page, only decode the cells that are asked for
+        _, _, varintBytes = readVarintAtOffset(cellOffset, currentPageBitstream)
+        currentRowid, _, _ = readVarintAtOffset(cellOffset + varintBytes, currentPageBitstream)
+        while start < len(rowids) and rowids[start] < currentRowid:
+            start += 1
+        if start < len(rowids) and rowids[start] == currentRowid:
+            _, found[currentRowid] = parse_cell_content(cellOffset, currentPageBitstream, pageType, fpt, pageSize)
+            start += 1
+
+    if rightMostPointer and start < len(rowids):
+        nxtPagebitstream = ConstBitStream(readPage(rightMostPointer, fpt, pageSize))
+        tableBtreeGetMany(nxtPagebitstream, fpt, rowids[start:], found, pageSize, level + 1)
+
+def indexBtreeGetMany(currentPageBitstream, fpt, keys, found, pageSize, level=0):
+    """
+    batched equality search in an index btree (the PK autoindex or a WITHOUT ROWID table):
+    the sorted keys are split across the child pointers of each interior page
+    so every page is read at most once
+
+        @param currentPageBitstream: the bitstream for the index page
+        @param fpt: the file pointer of a page
+        @param keys: the keys (first column of the index record) sorted ascending without duplicates
+        @param found: dictionary filled with key -> index record
+        @param pageSize: the page size of the db
+        @param level: the depth of the current page in the btree (0 = root)
+    """
+    pageType, numCells, toPosition, rightMostPointer = _pageInfo(currentPageBitstream)
+    readCounts(pageType, level)
+    start = 0
+
+    for i in range(0, numCells):
+        if start == len(keys):
+            return
+
+        cellOffset = bitstreamReadAtOffset(currentPageBitstream, int, 'bytes:2', i * 2 + toPosition)
+        nxtChildPage, record = parse_cell_content(cellOffset, currentPageBitstream, pageType, fpt, pageSize)
+
+        # the keys smaller than the cell key belong to the left child of the cell
+        end = bisect_left(keys, record[0], start)
+        if nxtChildPage and end > start:
+            nxtPagebitstream = ConstBitStream(readPage(nxtChildPage, fpt, pageSize))
+            indexBtreeGetMany(nxtPagebitstream, fpt, keys[start:end], found, pageSize, level + 1)
+        start = end
+
+        # index interior cells hold an entry too
+        if start < len(keys) and keys[start] == record[0]:
+            found[record[0]] = record
+            start += 1
+
+    if rightMostPointer and start < len(keys):
+        nxtPagebitstream = ConstBitStream(readPage(rightMostPointer, fpt, pageSize))
+        indexBtreeGetMany(nxtPagebitstream, fpt, keys[start:], found, pageSize, level + 1)
+
+def getMany(fpt, pageSize, keys, byRowid=False):
+    """
+    batched point lookup of many employees with one shared descent of each btree
+
+    return the records in the order of keys, None for the keys that do not exist
+    -by rowid: one descent of the table btree
+    -WITHOUT ROWID table: one descent of the clustered btree
+    -rowid table with the Emp ID index: one descent of the index, then one of the table for the rowids found
+    -no index: one scan
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param keys: the Emp IDs (or rowids if byRowid) to look up, in any order
+        @param byRowid: the keys are rowids of the table btree
+    """
+    schema = parseSchema(fpt, pageSize)
+    columns, primaryKey, withoutRowid = tableColumns(schema['Employee']['sql'])
+    keyColumn = columns[EMP_ID_INDEX][0]
+    sortedKeys = sorted(set(keys))
+    tablePageBitstream = ConstBitStream(readPage(schema['Employee']['rootPage'], fpt, pageSize))
+    found = {}
+
+    if byRowid:
+        recordAccessMethod("batched-rowid")
+        tableBtreeGetMany(tablePageBitstream, fpt, sortedKeys, found, pageSize)
+        return [found.get(key) for key in keys]
+
+    indexName = coveringIndex(schema, 'Employee', [keyColumn], keyColumn)
+    if withoutRowid and primaryKey[:1] == [keyColumn]:
+        recordAccessMethod("batched-clustered-index")
+        indexBtreeGetMany(tablePageBitstream, fpt, sortedKeys, found, pageSize)
+    elif indexName:
+        recordAccessMethod("batched-index+table")
+        indexPagestream = ConstBitStream(readPage(schema[indexName]['rootPage'], fpt, pageSize))
+        indexRecords = {}
+        indexBtreeGetMany(indexPagestream, fpt, sortedKeys, indexRecords, pageSize)
+
+        # the rowid is the last field of the index record
+        rows = {}
+        tableBtreeGetMany(tablePageBitstream, fpt, sorted(record[-1] for record in indexRecords.values()), rows, pageSize)
+        for key, record in indexRecords.items():
+            found[key] = rows.get(record[-1])
+    else:
+        recordAccessMethod("scan")
+        wanted = set(sortedKeys)
+
+        def _collect(record):
+            if record and record[0] in wanted:
+                found[record[0]] = record
+                # stop the scan once every key is found
+                return len(found) == len(wanted)
+            return None
+
+        btreeScan(tablePageBitstream, fpt, _collect, pageSize)
+
+    return [found.get(key) for key in keys]
+
+def indexOnlyRangeSearch(currentPageBitstream, fpt, lower, upper, positions, pageSize):
+    """
+    range search answered from a covering index alone, the table btree is never read
+
+    return a list of tuples with the index record fields at positions for every key in [lower, upper]
+        @param currentPageBitstream: the bitstream of the root page of the index
+        @param fpt: the file pointer of a page
+        @param lower: lower bound of the range search
+        @param upper: upper bound of the range search
+        @param positions: the positions of the wanted columns within the index record
+        @param pageSize: the page size of the db
+    """
+    recordAccessMethod("index-only")
+
+    def _project(record):
+        if record and lower <= record[0] and record[0] <= upper:
+            return [tuple(record[position] for position in positions)]
+        return []
+
+    return indexBtreeRangeSearch(currentPageBitstream, fpt, lower, upper, _project, pageSize)
+
+def empIDRangeQuery(fpt, pageSize, lower, upper, referencedColumns):
+    """
+    return the referenced columns of every employee with lower <= Emp ID <= upper as tuples
+
+    the cheapest access path the file offers is used:
+    -index-only when an index ordered on Emp ID holds every referenced column
+    -the clustered btree when the table is WITHOUT ROWID on Emp ID
+    -the Emp ID index followed by one table lookup per rowid
+    -a scan otherwise
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param lower: lower bound of the Emp ID range
+        @param upper: upper bound of the Emp ID range
+        @param referencedColumns: the (cleaned) column names the query reads, e.g. ["Emp_ID"]
+    """
+    schema = parseSchema(fpt, pageSize)
+    columns, primaryKey, withoutRowid = tableColumns(schema['Employee']['sql'])
+    columnNames = [name for name, _ in columns]
+    keyColumn = columnNames[EMP_ID_INDEX]
+    positions = [columnNames.index(name) for name in referencedColumns]
+    tablePageBitstream = ConstBitStream(readPage(schema['Employee']['rootPage'], fpt, pageSize))
+
+    def _project(record):
+        return tuple(record[position] for position in positions)
+
+    indexName = coveringIndex(schema, 'Employee', referencedColumns, keyColumn)
+    if indexName:
+        indexPositions = [indexColumns(schema, indexName).index(name) for name in referencedColumns]
+        indexPagestream = ConstBitStream(readPage(schema[indexName]['rootPage'], fpt, pageSize))
+        return indexOnlyRangeSearch(indexPagestream, fpt, lower, upper, indexPositions, pageSize)
+
+    if withoutRowid and primaryKey[:1] == [keyColumn]:
+        recordAccessMethod("clustered-index")
+        return indexBtreeRangeSearch(tablePageBitstream, fpt, lower, upper,
+                                     lambda record: [_project(record)] if record and lower <= record[0] <= upper else [], pageSize)
+
+    indexName = coveringIndex(schema, 'Employee', [keyColumn], keyColumn)
+    if indexName:
+        recordAccessMethod("index+table")
+        indexPagestream = ConstBitStream(readPage(schema[indexName]['rootPage'], fpt, pageSize))
+        rowids = indexBtreeRangeSearch(indexPagestream, fpt, lower, upper,
+                                       lambda record: [record[-1]] if record and lower <= record[0] <= upper else [], pageSize)
+        return [_project(tableBtreeEqualitySearch(tablePageBitstream, fpt, rowid, pageSize, ops=lambda record: None)) for rowid in rowids]
+
+    recordAccessMethod("scan")
+    rows = []
+
+    def _collect(record):
+        if record and lower <= record[0] <= upper:
+            rows.append(_project(record))
+        return None
+
+    btreeScan(tablePageBitstream, fpt, _collect, pageSize)
+    return rows
 
 def lastNameMatching(record):
     """there may be multiple record with the same last name"""
@@ -277,12 +679,15 @@ def readResetBookkeepings():
     print("     Index internal page read counts: {}".format(indexInternalPageType.getReadCounts()))
     print("     Index leaf page read counts: {}".format(indexLeafPageType.getReadCounts()))
     print("     Average page accessing time in miliseconds: {}ms".format(pageAccessTimer.getAvgPageAccessTime()))
+    if accessMethodCounts:
+        print("     Access methods: {}".format(", ".join("{} x{}".format(method, count) for method, count in accessMethodCounts.items())))
 
     headerPageType.resetReadCounts()
     dataPageType.resetReadCounts()
     indexInternalPageType.resetReadCounts()
     indexLeafPageType.resetReadCounts()
     pageAccessTimer.resetAll()    
+    accessMethodCounts.clear()
 
 '''The following are the 12 query operations (3 queries for each of the 4 databases)'''
 
@@ -298,6 +703,7 @@ def db_A_Query_A(pageSize):
     with open(DB_PATH1, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
+        recordAccessMethod("scan")
         btreeScan(tablePageBitstream, db_binary, lastNameMatching, pageSize)
 
 
@@ -312,6 +718,7 @@ def db_A_Query_B(pageSize):
     with open(DB_PATH1, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
+        recordAccessMethod("scan")
         btreeScan(tablePageBitstream, db_binary, empidMatching, pageSize)
     
 def db_A_Query_C(pageSize):
@@ -325,6 +732,7 @@ def db_A_Query_C(pageSize):
     with open(DB_PATH1, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary,pageSize))
+        recordAccessMethod("scan")
         btreeScan(tablePageBitstream, db_binary, empidRangeMatching, pageSize)
     
 
@@ -340,6 +748,7 @@ def db_B_Query_A(pageSize):
     with open(DB_PATH2, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
+        recordAccessMethod("scan")
         btreeScan(tablePageBitstream, db_binary, lastNameMatching, pageSize)
 
 def db_B_Query_B(pageSize):
@@ -354,6 +763,7 @@ def db_B_Query_B(pageSize):
     with open(DB_PATH2, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
+        recordAccessMethod("scan")
         btreeScan(tablePageBitstream, db_binary, empidMatching, pageSize)
     
 def db_B_Query_C(pageSize):
@@ -368,6 +778,7 @@ def db_B_Query_C(pageSize):
     with open(DB_PATH2, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
+        recordAccessMethod("scan")
         btreeScan(tablePageBitstream, db_binary, empidRangeMatching, pageSize)
     
 def db_C_Query_A(pageSize):
@@ -381,6 +792,7 @@ def db_C_Query_A(pageSize):
     with open(DB_PATH3, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
+        recordAccessMethod("scan")
         btreeScan(tablePageBitstream, db_binary, lastNameMatching, pageSize)
 
 def db_C_Query_B(pageSize):
@@ -401,6 +813,7 @@ def db_C_Query_B(pageSize):
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
         indexPagestream = ConstBitStream(readPage(employeeTableRootPage['sqlite_autoindex_Employee_1'], db_binary, pageSize))
+        recordAccessMethod("index+table")
         # get the rowid of the record first
         rowid = indexBtreeEqualitySearch(indexPagestream, db_binary, EMP_ID, _findMatchingEmpID_rowidTable, pageSize)
         # find the record corresponding to that rowid
@@ -425,6 +838,7 @@ def db_C_Query_C(pageSize):
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
         indexPagestream = ConstBitStream(readPage(employeeTableRootPage['sqlite_autoindex_Employee_1'], db_binary, pageSize))
+        recordAccessMethod("index+table")
         # use index to find the rowid of the corresponding EMP_ID
         rowids = indexBtreeRangeSearch(indexPagestream, db_binary, EMP_ID_RANGE[0], EMP_ID_RANGE[1], _rangeSearchIndex_regular, pageSize)
         # use the rowid to find the record in the table btree one at a time
@@ -443,6 +857,7 @@ def db_D_Query_A(pageSize):
     with open(DB_PATH4, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
+        recordAccessMethod("scan")
         btreeScan(tablePageBitstream, db_binary, lastNameMatching, pageSize)
     # find a record with last name where the index btree is sorted in EMP_ID ==> use scan operation
 
@@ -464,6 +879,7 @@ def db_D_Query_B(pageSize):
     with open(DB_PATH4, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))        
+        recordAccessMethod("clustered-index")
         indexBtreeEqualitySearch(tablePageBitstream, db_binary, EMP_ID, _findMatchingEmpID_withoutrowid, pageSize)
     
 
@@ -484,8 +900,45 @@ def db_D_Query_C(pageSize):
     with open(DB_PATH4, "rb") as db_binary:
         employeeTableRootPage = parseRootPage(db_binary, pageSize)
         tablePageBitstream = ConstBitStream(readPage(employeeTableRootPage['Employee'], db_binary, pageSize))
+        recordAccessMethod("clustered-index")
         indexBtreeRangeSearch(tablePageBitstream, db_binary, EMP_ID_RANGE[0], EMP_ID_RANGE[1], _rangeSearchIndex_withoutrowid, pageSize)
 
+def db_C_Query_Count(pageSize):
+    """
+    DB: With primary index on "Emp ID" column (Unclusterd Index) with page size of 4KB
+    Ops: count the employees with "Emp ID" between #171800 and #171899 (answered from the index only)
+    """
+    print("DB: With primary index on \"Emp ID\" column (Unclusterd Index) with page size of 4KB")
+    print("Count the employees with \"Emp ID\" between #171800 and #171899 (This is an index-only Range search)")
+
+    with open(DB_PATH3, "rb") as db_binary:
+        rows = empIDRangeQuery(db_binary, pageSize, EMP_ID_RANGE[0], EMP_ID_RANGE[1], ["Emp_ID"])
+        print("Count: {}".format(len(rows)))
+
+def db_C_Query_Exists(pageSize):
+    """
+    DB: With primary index on "Emp ID" column (Unclusterd Index) with page size of 4KB
+    Ops: check whether employee #181162 exists (answered from the index only)
+    """
+    print("DB: With primary index on \"Emp ID\" column (Unclusterd Index) with page size of 4KB")
+    print("Check whether employee #181162 exists (This is an index-only Equality search)")
+
+    with open(DB_PATH3, "rb") as db_binary:
+        rows = empIDRangeQuery(db_binary, pageSize, EMP_ID, EMP_ID, ["Emp_ID"])
+        print("Exists: {}".format(len(rows) > 0))
+
+def db_C_Query_List(pageSize):
+    """
+    DB: With primary index on "Emp ID" column (Unclusterd Index) with page size of 4KB
+    Ops: list the "Emp ID" of all employees between #171800 and #171899 (answered from the index only)
+    """
+    print("DB: With primary index on \"Emp ID\" column (Unclusterd Index) with page size of 4KB")
+    print("List the \"Emp ID\" of all employees between #171800 and #171899 (This is an index-only Range search)")
+
+    with open(DB_PATH3, "rb") as db_binary:
+        for (empID,) in empIDRangeQuery(db_binary, pageSize, EMP_ID_RANGE[0], EMP_ID_RANGE[1], ["Emp_ID"]):
+            print("Emp ID: {}".format(empID))
+
 if __name__ == "__main__":
     # redirect all the print outputs to a file
     sys.stdout = open('./output.txt', 'w')
@@ -524,4 +977,13 @@ if __name__ == "__main__":
     readResetBookkeepings()
     print("")
     db_D_Query_C(PAGE_SIZE_4K)
+    readResetBookkeepings()
+    print("")
+    db_C_Query_Count(PAGE_SIZE_4K)
+    readResetBookkeepings()
+    print("")
+    db_C_Query_Exists(PAGE_SIZE_4K)
+    readResetBookkeepings()
+    print("")
+    db_C_Query_List(PAGE_SIZE_4K)
     readResetBookkeepings()
\ No newline at end of file
@@ -0,0 +1,343 @@
+import struct
+from bisect import bisect_right
+from constants import *
+from utils import readPage, readCounts, determineinCellPayload, SERIAL_TYPE_SIZES
+from catalog import tableColumns, indexColumns
+
+def _intDecoder(size):
+    def _decode(buf, pos):
+        return int.from_bytes(buf[pos:pos + size], "big", signed=True)
+    return _decode
+
+# value of the fixed size serial types 0-11 read at buf[pos:]
+SERIAL_TYPE_DECODERS = (
+    lambda buf, pos: None,
+    _intDecoder(1), _intDecoder(2), _intDecoder(3), _intDecoder(4), _intDecoder(6), _intDecoder(8),
+    lambda buf, pos: struct.unpack_from(">d", buf, pos)[0],
+    lambda buf, pos: 0,
+    lambda buf, pos: 1,
+    lambda buf, pos: None,
+    lambda buf, pos: None,
+)
+
+def readVarint(buf, pos):
+    """
+    decode the varint at buf[pos:] without a bitstream
+
+    return (value, position after the varint)
+        @param buf: the bytes of a page or a payload
+        @param pos: the offset of the varint
+    """
+    value = 0
+    for i in range(8):
+        byte = buf[pos + i]
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos + i + 1
+    return (value << 8) | buf[pos + 8], pos + 9
+
+def _serialTypes(buf, pos, numColumns):
+    """
+    return (serial types, offset of the record body) of the record header at buf[pos:]
+
+    the header is usually a single byte size followed by one byte per column,
+    in which case the header bytes are the serial types themselves
+    """
+    headerSize = buf[pos]
+    if headerSize < 0x80:
+        end = pos + headerSize
+        types = buf[pos + 1:end]
+        if len(types) == numColumns and max(types, default=0) < 0x80:
+            return types, end
+
+    headerSize, p = readVarint(buf, pos)
+    end = pos + headerSize
+    types = []
+    while p < end:
+        serialType, p = readVarint(buf, p)
+        types.append(serialType)
+    # columns added by ALTER TABLE after the row was written are NULL
+    types.extend([0] * (numColumns - len(types)))
+    return types, end
+
+def recordColumnOrder(sql):
+    """
+    return the [(column name, declared type)] in the order the columns are stored in a table record;
+    WITHOUT ROWID tables store the primary key columns first
+
+        @param sql: the CREATE TABLE statement of the table
+    """
+    columns, primaryKey, withoutRowid = tableColumns(sql)
+    if not withoutRowid:
+        return columns
+    byName = dict(columns)
+    return [(name, byName[name]) for name in primaryKey] + [column for column in columns if column[0] not in primaryKey]
+
+def _isIntegerAffinity(declaredType):
+    return "INT" in declaredType.upper()
+
+def compileDecoder(columns, projection=None, rowType="tuple", rowidAlias=None):
+    """
+    generate a decode(buf, pos, rowid=None) function specialized for one record layout
+
+    the generated code is straight-line: one block per column up to the last
+    projected one, sizes come from the precomputed serial type table and the
+    value conversion is chosen from the declared column type at compile time
+
+        @param columns: [(column name, declared type)] in record order
+        @param projection: the column names to return, all columns by default
+        @param rowType: "tuple" or "slots" (objects of a generated class with __slots__)
+        @param rowidAlias: the INTEGER PRIMARY KEY column stored as NULL and read from the rowid
+    """
+    names = [name for name, _ in columns]
+    wanted = list(projection) if projection is not None else names
+    positions = [names.index(name) for name in wanted]
+    # an empty projection (count(*) alone) reads nothing and returns empty rows
+    lastColumn = max(positions, default=-1)
+
+    lines = ["def decode(buf, pos, rowid=None):"]
+    if positions:
+        lines.append("    types, q = _serialTypes(buf, pos, {})".format(len(names)))
+
+    for i in range(0, lastColumn + 1):
+        lines.append("    t = types[{}]".format(i))
+        lines.append("    n = SIZES[t] if t < 12 else (t - 12) >> 1")
+        if i in positions:
+            if names[i] == rowidAlias:
+                lines.append("    v{} = rowid".format(i))
+            elif _isIntegerAffinity(columns[i][1]):
+                lines.append("    v{} = DECODERS[t](buf, q) if t < 12 else (buf[q:q + n].decode() if t & 1 else buf[q:q + n])".format(i))
+            else:
+                lines.append("    v{} = buf[q:q + n].decode() if t > 12 and t & 1 else (DECODERS[t](buf, q) if t < 12 else buf[q:q + n])".format(i))
+        if i < lastColumn:
+            lines.append("    q += n")
+
+    values = ", ".join("v{}".format(position) for position in positions)
+    lines.append("    return ROW({})".format(values) if rowType == "slots" else "    return ({},)".format(values) if positions else "    return ()")
+    source = "\n".join(lines) + "\n"
+
+    namespace = {"_serialTypes": _serialTypes, "SIZES": SERIAL_TYPE_SIZES, "DECODERS": SERIAL_TYPE_DECODERS}
+    if rowType == "slots":
+        namespace["ROW"] = _rowClass(wanted)
+    exec(compile(source, "<decoder {}>".format(",".join(wanted)), "exec"), namespace)
+
+    decode = namespace["decode"]
+    decode.source = source
+    return decode
+
+def _rowClass(columnNames):
+    """generate a light weight row class with one slot per column"""
+    slots = tuple(columnNames)
+
+    def __init__(self, *values):
+        for name, value in zip(slots, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, i):
+        return getattr(self, slots[i])
+
+    def __repr__(self):
+        return "Row({})".format(", ".join("{}={!r}".format(name, getattr(self, name)) for name in slots))
+
+    return type("Row", (), {"__slots__": slots, "__init__": __init__, "__getitem__": __getitem__, "__repr__": __repr__})
+
+# (table sql, projection, row type) -> generated decoder
+_decoderCache = {}
+
+def decoderFor(schema, table, projection=None, rowType="tuple"):
+    """
+    return the cached decoder of a table (and projection), compiling it on first use
+        @param schema: the catalog returned by parseSchema
+        @param table: the table name
+        @param projection: the column names to return, all columns by default
+        @param rowType: "tuple" or "slots"
+    """
+    sql = schema[table]["sql"]
+    key = (sql, tuple(projection) if projection is not None else None, rowType)
+    decode = _decoderCache.get(key)
+    if decode is None:
+        columns, primaryKey, withoutRowid = tableColumns(sql)
+        rowidAlias = None
+        if not withoutRowid and len(primaryKey) == 1 and dict(columns)[primaryKey[0]].upper() == "INTEGER":
+            rowidAlias = primaryKey[0]
+        decode = compileDecoder(recordColumnOrder(sql), projection, rowType, rowidAlias)
+        _decoderCache[key] = decode
+    return decode
+
+def indexDecoderFor(schema, indexName, projection=None, rowType="tuple"):
+    """
+    return the cached decoder of the records of an index, compiling it on first use;
+    the columns are the ones of catalog.indexColumns, "rowid" included
+
+        @param schema: the catalog returned by parseSchema
+        @param indexName: the index name
+        @param projection: the column names to return, all columns by default
+        @param rowType: "tuple" or "slots"
+    """
+    entry = schema[indexName]
+    key = ("index", entry["tableName"], indexName, tuple(projection) if projection is not None else None, rowType)
+    decode = _decoderCache.get(key)
+    if decode is None:
+        declaredTypes = dict(tableColumns(schema[entry["tableName"]]["sql"])[0])
+        columns = [(name, declaredTypes.get(name, "INTEGER")) for name in indexColumns(schema, indexName)]
+        decode = compileDecoder(columns, projection, rowType)
+        _decoderCache[key] = decode
+    return decode
+
+def _payload(page, pos, payloadSize, pageType, fpt, pageSize):
+    """return the whole payload starting at page[pos:], following the overflow chain if needed"""
+    inCellPayload, overflowPayload = determineinCellPayload(pageType, payloadSize, pageSize)
+    if not overflowPayload:
+        return page, pos
+
+    chunks = [page[pos:pos + inCellPayload]]
+    nxtOverflowPage = int.from_bytes(page[pos + inCellPayload:pos + inCellPayload + POINTER_SIZE], "big")
+    while overflowPayload > 0 and nxtOverflowPage:
+        overflowPage = readPage(nxtOverflowPage, fpt, pageSize)
+        readCounts(pageType)
+        chunk = min(overflowPayload, pageSize - POINTER_SIZE - RESERVED_PER_PAGE)
+        chunks.append(overflowPage[POINTER_SIZE:POINTER_SIZE + chunk])
+        overflowPayload -= chunk
+        nxtOverflowPage = int.from_bytes(overflowPage[:POINTER_SIZE], "big")
+    return b"".join(chunks), 0
+
+def decodeCells(page, decode, fpt, pageSize, headerOffset=0):
+    """
+    yield (child page or None, decoded row or None) for every cell of a btree page given as bytes
+
+        @param page: the bytes of the page
+        @param decode: a decoder from compileDecoder/decoderFor
+        @param fpt: the file pointer of the db, for overflow pages
+        @param pageSize: the page size of the db
+        @param headerOffset: 100 for page 1, 0 otherwise
+    """
+    pageType = page[headerOffset]
+    numCells = int.from_bytes(page[headerOffset + BTREE_NUM_CELLS_OFFSET:headerOffset + BTREE_NUM_CELLS_OFFSET + 2], "big")
+    isLeaf = pageType in (LEAF_TABLE_BTREE_PAGE_FLAG, LEAF_INDEX_BTREE_PAGE_FLAG)
+    cellPointers = headerOffset + (LEAF_BTREE_PAGE_HEADER_SIZE if isLeaf else INTERIOR_BTREE_PAGE_HEADER_SIZE)
+
+    for i in range(0, numCells):
+        cellOffset = int.from_bytes(page[cellPointers + i * 2:cellPointers + i * 2 + 2], "big")
+
+        if pageType == LEAF_TABLE_BTREE_PAGE_FLAG:
+            payloadSize, p = readVarint(page, cellOffset)
+            rowid, p = readVarint(page, p)
+            buf, pos = _payload(page, p, payloadSize, pageType, fpt, pageSize)
+            yield None, decode(buf, pos, rowid)
+        elif pageType == INTERIROR_TABLE_BTREE_PAGE_FLAG:
+            yield int.from_bytes(page[cellOffset:cellOffset + POINTER_SIZE], "big"), None
+        else:
+            child = None
+            p = cellOffset
+            if pageType == INTERIOR_INDEX_BTREE_PAGE_FLAG:
+                child = int.from_bytes(page[cellOffset:cellOffset + POINTER_SIZE], "big")
+                p += POINTER_SIZE
+            payloadSize, p = readVarint(page, p)
+            buf, pos = _payload(page, p, payloadSize, pageType, fpt, pageSize)
+            yield child, decode(buf, pos)
+
+def _headerOffset(pageNum):
+    """the btree header of page 1 follows the 100 byte database file header"""
+    return DATABASE_FILE_HEADER_SIZE if pageNum == 1 else 0
+
+def compiledScan(fpt, pageSize, rootPage, decode, ops, level=0):
+    """
+    btreeScan on raw page bytes with a compiled decoder: ops is called with each
+    decoded row in tree order and the scan stops when ops returns a truthy value
+
+    return the row ops stopped at, None otherwise
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param rootPage: the page to scan from
+        @param decode: a decoder from compileDecoder/decoderFor
+        @param ops: operation function for each row
+        @param level: the depth of the current page in the btree (0 = root)
+    """
+    page = readPage(rootPage, fpt, pageSize)
+    h = _headerOffset(rootPage)
+    readCounts(page[h], level)
+
+    for child, row in decodeCells(page, decode, fpt, pageSize, h):
+        if child:
+            stoppedAt = compiledScan(fpt, pageSize, child, decode, ops, level + 1)
+            if stoppedAt is not None:
+                return stoppedAt
+        if row is not None and ops(row):
+            return row
+
+    if page[h] in (INTERIROR_TABLE_BTREE_PAGE_FLAG, INTERIOR_INDEX_BTREE_PAGE_FLAG):
+        rightMostPointer = int.from_bytes(page[h + 8:h + 12], "big")
+        return compiledScan(fpt, pageSize, rightMostPointer, decode, ops, level + 1)
+    return None
+
+def compiledRows(fpt, pageSize, rootPage, decode, level=0):
+    """
+    generator version of compiledScan: yield the decoded rows of a btree in key order,
+    so that several trees can be read side by side (merge join)
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param rootPage: the page to scan from
+        @param decode: a decoder from compileDecoder/decoderFor/indexDecoderFor
+        @param level: the depth of the current page in the btree (0 = root)
+    """
+    page = readPage(rootPage, fpt, pageSize)
+    h = _headerOffset(rootPage)
+    readCounts(page[h], level)
+
+    for child, row in decodeCells(page, decode, fpt, pageSize, h):
+        if child:
+            yield from compiledRows(fpt, pageSize, child, decode, level + 1)
+        if row is not None:
+            yield row
+
+    if page[h] in (INTERIROR_TABLE_BTREE_PAGE_FLAG, INTERIOR_INDEX_BTREE_PAGE_FLAG):
+        yield from compiledRows(fpt, pageSize, int.from_bytes(page[h + 8:h + 12], "big"), decode, level + 1)
+
+def compiledGetMany(fpt, pageSize, rootPage, rowids, decode, found, level=0):
+    """
+    tableBtreeGetMany with a compiled decoder: the sorted rowids are split across
+    the child pointers of each interior page so every page is read at most once
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param rootPage: the root page of the table btree
+        @param rowids: the rowids to look up, sorted ascending without duplicates
+        @param decode: a decoder from compileDecoder/decoderFor
+        @param found: dictionary filled with rowid -> decoded row
+        @param level: the depth of the current page in the btree (0 = root)
+    """
+    page = readPage(rootPage, fpt, pageSize)
+    h = _headerOffset(rootPage)
+    pageType = page[h]
+    readCounts(pageType, level)
+    numCells = int.from_bytes(page[h + BTREE_NUM_CELLS_OFFSET:h + BTREE_NUM_CELLS_OFFSET + 2], "big")
+
+    if pageType == INTERIROR_TABLE_BTREE_PAGE_FLAG:
+        start = 0
+        for i in range(0, numCells):
+            if start == len(rowids):
+                return
+            cellPointer = h + INTERIOR_BTREE_PAGE_HEADER_SIZE + i * 2
+            cellOffset = int.from_bytes(page[cellPointer:cellPointer + 2], "big")
+            # every rowid <= the cell key belongs to the left child of the cell
+            currentRowid, _ = readVarint(page, cellOffset + POINTER_SIZE)
+            end = bisect_right(rowids, currentRowid, start)
+            if end > start:
+                child = int.from_bytes(page[cellOffset:cellOffset + POINTER_SIZE], "big")
+                compiledGetMany(fpt, pageSize, child, rowids[start:end], decode, found, level + 1)
+            start = end
+        if start < len(rowids):
+            compiledGetMany(fpt, pageSize, int.from_bytes(page[h + 8:h + 12], "big"), rowids[start:], decode, found, level + 1)
+        return
+
+    # in the leaf page, only decode the cells that are asked for
+    wanted = set(rowids)
+    for i in range(0, numCells):
+        cellPointer = h + LEAF_BTREE_PAGE_HEADER_SIZE + i * 2
+        cellOffset = int.from_bytes(page[cellPointer:cellPointer + 2], "big")
+        payloadSize, p = readVarint(page, cellOffset)
+        rowid, p = readVarint(page, p)
+        if rowid in wanted:
+            buf, pos = _payload(page, p, payloadSize, pageType, fpt, pageSize)
+            found[rowid] = decode(buf, pos, rowid)
@@ -0,0 +1,170 @@
+import os
+import pickle
+from collections import OrderedDict
+from bitstring import ConstBitStream
+from constants import *
+from queryOperations import btreeScan
+from utils import parseRootPage, readPage, fileSignature, isWalMode
+
+def normalizePredicate(predicate):
+    """
+    return a canonical hashable form of a predicate so equivalent queries share a cache entry
+
+    predicates are nested tuples:
+        ("eq", column, value), ("range", column, lower, upper), ("in", column, [values]),
+        ("and", p1, p2, ...), ("or", p1, p2, ...)
+
+    the bounds of a range are kept as given: a reversed range is an empty query, not the same one
+
+        @param predicate: the predicate tuple
+    """
+    op = predicate[0].lower()
+    if op in ("and", "or"):
+        children = sorted((normalizePredicate(child) for child in predicate[1:]), key=repr)
+        # a single child is the child itself
+        return children[0] if len(children) == 1 else (op,) + tuple(children)
+
+    column = predicate[1].strip()
+    if op == "range":
+        return (op, column, predicate[2], predicate[3])
+    if op == "in":
+        return (op, column, tuple(sorted(set(predicate[2]), key=repr)))
+    return (op, column) + tuple(predicate[2:])
+
+class queryResultCache:
+    """
+    LRU cache of query results keyed by (database file, table, normalized predicate)
+
+    every lookup reads the file change counter from the database header along with the
+    inode, size and modification time of the file, and drops the entry if any of them moved
+    since the result was cached, so a hit never touches a btree page; a database in WAL mode
+    is not cached, its commits do not move the change counter until a checkpoint
+
+        @param maxEntries: max number of cached queries
+        @param maxRows: max number of rows cached over all queries
+        @param persistPath: optional pickle file the cache is loaded from and saved to
+    """
+    def __init__(self, maxEntries=RESULT_CACHE_ENTRIES, maxRows=RESULT_CACHE_ROWS, persistPath=None):
+        self.maxEntries = maxEntries
+        self.maxRows = maxRows
+        self.persistPath = persistPath
+
+        # key -> (file signature, rows as a tuple), least recently used first
+        self.entries = OrderedDict()
+        self.cachedRows = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.bypassed = 0
+
+        if persistPath and os.path.exists(persistPath):
+            self.load()
+
+    def query(self, dbPath, table, predicate, compute):
+        """
+        return the rows of the query as a new list of tuples, from the cache if the file did not change;
+        the rows are tuples so that a caller cannot change the cached ones
+
+            @param dbPath: path of the database file
+            @param table: the table (or index) name the query runs on
+            @param predicate: the predicate tuple, see normalizePredicate
+            @param compute: function(db_binary) -> list of rows, runs the query on a miss
+        """
+        key = (os.path.abspath(dbPath), table, normalizePredicate(predicate))
+
+        with open(dbPath, "rb") as db_binary:
+            if isWalMode(db_binary):
+                self.bypassed += 1
+                return [tuple(row) for row in compute(db_binary)]
+            signature = fileSignature(db_binary)
+
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == signature:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    return list(entry[1])
+                self._drop(key)
+                self.invalidations += 1
+
+            self.misses += 1
+            rows = tuple(tuple(row) for row in compute(db_binary))
+
+        self._put(key, signature, rows)
+        return list(rows)
+
+    def invalidate(self, dbPath=None):
+        """
+        drop every entry of dbPath, or the whole cache when no path is given
+            @param dbPath: path of the database file
+        """
+        path = os.path.abspath(dbPath) if dbPath else None
+        for key in [key for key in self.entries if path is None or key[0] == path]:
+            self._drop(key)
+
+    def _put(self, key, signature, rows):
+        # results larger than the whole budget are not worth caching
+        if len(rows) > self.maxRows:
+            return
+        self.entries[key] = (signature, rows)
+        self.cachedRows += len(rows)
+
+        while len(self.entries) > self.maxEntries or self.cachedRows > self.maxRows:
+            self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        _, rows = self.entries.pop(key)
+        self.cachedRows -= len(rows)
+
+    def save(self):
+        """write the cache to persistPath, replacing the previous file atomically"""
+        if not self.persistPath:
+            return
+        tmpPath = self.persistPath + ".tmp"
+        with open(tmpPath, "wb") as out:
+            pickle.dump(list(self.entries.items()), out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, self.persistPath)
+
+    def load(self):
+        """load the cache from persistPath; stale entries are dropped on their next lookup"""
+        with open(self.persistPath, "rb") as f:
+            for key, (signature, rows) in pickle.load(f):
+                self._put(key, signature, tuple(rows))
+
+    def stats(self):
+        """return the hit/miss statistics of the cache"""
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "bypassed": self.bypassed,
+                "entries": len(self.entries),
+                "cachedRows": self.cachedRows}
+
+def cachedScan(cache, dbPath, pageSize, table, predicate, matches):
+    """
+    run a full btreeScan of table in front of the cache, e.g. the "Rowe" scan:
+
+        cachedScan(cache, DB_PATH1, PAGE_SIZE_4K, 'Employee', ("eq", "Last_Name", LAST_NAME),
+                   lambda record: record[LAST_NAME_INDEX] == LAST_NAME)
+
+        @param cache: a queryResultCache
+        @param dbPath: path of the database file
+        @param pageSize: the page size of the database
+        @param table: the table name
+        @param predicate: the predicate tuple identifying the query
+        @param matches: function(record) -> bool evaluating the predicate
+    """
+    def _compute(db_binary):
+        rows = []
+
+        def _collect(record):
+            if record and matches(record):
+                rows.append(record)
+            return None
+
+        rootPages = parseRootPage(db_binary, pageSize)
+        btreeScan(ConstBitStream(readPage(rootPages[table], db_binary, pageSize)), db_binary, _collect, pageSize)
+        return rows
+
+    return cache.query(dbPath, table, predicate, _compute)
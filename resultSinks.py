@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import io
+import json
+import queue
+import sys
+import threading
+from timeit import default_timer as time
+from constants import *
+from utils import parseSchema, SERIAL_TYPE_SIZES
+from btreeWriter import encodeRecord
+from recordDecoder import SERIAL_TYPE_DECODERS, _serialTypes, compiledRows, decoderFor, recordColumnOrder
+
+class resultSink:
+    """
+    destination of the rows of a query, written in batches (lists of row tuples)
+
+    the formatted batches are kept in memory and written to the output once they reach
+    bufferBytes, so a large result costs a few large writes instead of one per row
+
+        @param out: a path, or an open file (text for the text formats, binary for the binary one)
+        @param bufferBytes: the formatted bytes kept before they are written
+    """
+    binary = False
+
+    def __init__(self, out=None, bufferBytes=RESULT_SINK_BUFFER_BYTES):
+        self.ownsOutput = isinstance(out, str)
+        if self.ownsOutput:
+            out = open(out, "wb" if self.binary else "w", newline="" if not self.binary else None)
+        self.out = out
+        self.bufferBytes = bufferBytes
+        self.pending = []
+        self.pendingBytes = 0
+        self.rows = 0
+        self.batches = 0
+        self.bytesWritten = 0
+        self.seconds = 0.0
+
+    def write(self, batch):
+        """
+        format and buffer a batch of rows
+            @param batch: a list of row tuples
+        """
+        startTime = time()
+        chunk = self.format(batch)
+        self.rows += len(batch)
+        self.batches += 1
+        if chunk:
+            self.pending.append(chunk)
+            self.pendingBytes += len(chunk)
+            if self.pendingBytes >= self.bufferBytes:
+                self._writePending()
+        self.seconds += time() - startTime
+
+    def format(self, batch):
+        """return the batch formatted as one str (or bytes for a binary sink)"""
+        raise NotImplementedError
+
+    def _writePending(self):
+        if self.pending:
+            self.out.write(("" if not self.binary else b"").join(self.pending))
+            self.bytesWritten += self.pendingBytes
+            self.pending = []
+            self.pendingBytes = 0
+
+    def flush(self):
+        startTime = time()
+        self._writePending()
+        if self.out is not None:
+            self.out.flush()
+        self.seconds += time() - startTime
+
+    def close(self):
+        self.flush()
+        if self.ownsOutput:
+            self.out.close()
+
+    def stats(self):
+        """return the rows, batches and bytes written, and the seconds spent formatting and writing"""
+        return {"rows": self.rows, "batches": self.batches, "bytesWritten": self.bytesWritten + self.pendingBytes,
+                "seconds": self.seconds}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class csvSink(resultSink):
+    """
+    rows as CSV lines, with an optional header line
+        @param out: a path or an open text file
+        @param columns: the column names written as the header line, none by default
+        @param bufferBytes: the formatted bytes kept before they are written
+    """
+    def __init__(self, out, columns=None, bufferBytes=RESULT_SINK_BUFFER_BYTES):
+        super().__init__(out, bufferBytes)
+        self.text = io.StringIO()
+        self.writer = csv.writer(self.text)
+        if columns:
+            self.writer.writerow(columns)
+
+    def format(self, batch):
+        self.writer.writerows(batch)
+        chunk = self.text.getvalue()
+        self.text.seek(0)
+        self.text.truncate()
+        return chunk
+
+def _jsonValue(value):
+    # blobs as hex text, json has no bytes
+    return value.hex()
+
+class jsonLinesSink(resultSink):
+    """
+    one JSON document per row: an array, or an object when the column names are given
+        @param out: a path or an open text file
+        @param columns: the column names, rows are written as arrays by default
+        @param bufferBytes: the formatted bytes kept before they are written
+    """
+    def __init__(self, out, columns=None, bufferBytes=RESULT_SINK_BUFFER_BYTES):
+        super().__init__(out, bufferBytes)
+        self.columns = columns
+        self.encoder = json.JSONEncoder(default=_jsonValue, separators=(",", ":"))
+
+    def format(self, batch):
+        encode = self.encoder.encode
+        if self.columns:
+            return "".join(encode(dict(zip(self.columns, row))) + "\n" for row in batch)
+        return "".join(encode(row) + "\n" for row in batch)
+
+class binarySink(resultSink):
+    """
+    every row as a 4 byte big endian length followed by the row in the SQLite record format,
+    read back with readBinaryRows
+        @param out: a path or an open binary file
+        @param bufferBytes: the formatted bytes kept before they are written
+    """
+    binary = True
+
+    def format(self, batch):
+        chunks = []
+        for row in batch:
+            record = encodeRecord(row)
+            chunks.append(len(record).to_bytes(4, "big"))
+            chunks.append(record)
+        return b"".join(chunks)
+
+class nullSink(resultSink):
+    """count the rows and drop them, to time a query without its output"""
+    def __init__(self):
+        super().__init__(None)
+
+    def format(self, batch):
+        return None
+
+def readBinaryRows(path):
+    """
+    yield the rows of a file written by binarySink as tuples
+        @param path: the path of the file, or a binary file open at the first row
+    """
+    if isinstance(path, str):
+        with open(path, "rb") as f:
+            yield from readBinaryRows(f)
+        return
+
+    while True:
+        prefix = path.read(4)
+        if len(prefix) < 4:
+            return
+        record = path.read(int.from_bytes(prefix, "big"))
+        serialTypes, pos = _serialTypes(record, 0, 0)
+        row = []
+        for serialType in serialTypes:
+            if serialType < 12:
+                row.append(SERIAL_TYPE_DECODERS[serialType](record, pos))
+                pos += SERIAL_TYPE_SIZES[serialType]
+            else:
+                size = (serialType - 12) >> 1
+                data = record[pos:pos + size]
+                row.append(data.decode("utf-8") if serialType & 1 else data)
+                pos += size
+        yield tuple(row)
+
+class boundedQueueSink:
+    """
+    hand the batches to another sink written by a background thread through a bounded queue
+
+    the query and the formatting/writing overlap, and when the consumer falls behind by
+    maxBatches the query blocks on write until there is room again (back-pressure), so a
+    slow consumer bounds the memory held instead of letting the batches pile up
+
+        @param sink: the sink the batches are written to
+        @param maxBatches: the batches waiting at most
+    """
+    def __init__(self, sink, maxBatches=RESULT_SINK_QUEUE_BATCHES):
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=maxBatches)
+        self.error = None
+        self.blockedSeconds = 0.0
+        self.thread = threading.Thread(target=self._consume, daemon=True)
+        self.thread.start()
+
+    def _consume(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            if self.error is None:
+                try:
+                    self.sink.write(batch)
+                except Exception as e:
+                    # raised in the producer on its next write or on close, keep draining
+                    self.error = e
+
+    def write(self, batch):
+        """
+        queue a batch, blocking while maxBatches batches are waiting
+            @param batch: a list of row tuples
+        """
+        if self.error is not None:
+            raise self.error
+        startTime = time()
+        self.queue.put(batch)
+        self.blockedSeconds += time() - startTime
+
+    def close(self):
+        try:
+            self.queue.put(None)
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+        finally:
+            # the output of the wrapped sink is closed even when a write failed
+            self.sink.close()
+
+    def stats(self):
+        """return the stats of the wrapped sink and the seconds the query was blocked on a full queue"""
+        stats = self.sink.stats()
+        stats["blockedSeconds"] = self.blockedSeconds
+        return stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class batchingOps:
+    """
+    ops callback for the scan and search functions (btreeScan, indexBtreeRangeSearch, compiledScan ...)
+    that sends the matching rows to a sink in batches instead of printing them
+
+    it always returns an empty list: the scans go on, and the range searches accumulate nothing,
+    so call flush once the search returns to write the last partial batch
+
+        @param sink: a resultSink or a boundedQueueSink
+        @param matches: function(record) -> bool, every row by default
+        @param project: function(record) -> row tuple written, the record as a tuple by default
+        @param batchSize: the rows per batch
+    """
+    def __init__(self, sink, matches=None, project=None, batchSize=RESULT_SINK_BATCH_ROWS):
+        self.sink = sink
+        self.matches = matches
+        self.project = project or tuple
+        self.batchSize = batchSize
+        self.batch = []
+
+    def __call__(self, record):
+        if record and (self.matches is None or self.matches(record)):
+            self.batch.append(self.project(record))
+            if len(self.batch) >= self.batchSize:
+                self.sink.write(self.batch)
+                self.batch = []
+        return []
+
+    def flush(self):
+        if self.batch:
+            self.sink.write(self.batch)
+            self.batch = []
+
+def scanBatches(fpt, pageSize, table, matches=None, batchSize=RESULT_SINK_BATCH_ROWS):
+    """
+    yield the matching rows of a full scan of table (compiled decoding) in lists of batchSize rows
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param table: the table name
+        @param matches: function(record) -> bool, every row by default
+        @param batchSize: the rows per batch
+    """
+    schema = parseSchema(fpt, pageSize)
+    batch = []
+    for row in compiledRows(fpt, pageSize, schema[table]["rootPage"], decoderFor(schema, table)):
+        if matches is None or matches(row):
+            batch.append(row)
+            if len(batch) >= batchSize:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def streamScan(fpt, pageSize, table, sink, matches=None, batchSize=RESULT_SINK_BATCH_ROWS):
+    """
+    write the matching rows of a full scan of table into a sink
+
+    return the number of rows written
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param table: the table name
+        @param sink: a resultSink or a boundedQueueSink
+        @param matches: function(record) -> bool, every row by default
+        @param batchSize: the rows per batch
+    """
+    rows = 0
+    for batch in scanBatches(fpt, pageSize, table, matches, batchSize):
+        sink.write(batch)
+        rows += len(batch)
+    return rows
+
+RESULT_SINK_FORMATS = {"csv": csvSink, "jsonl": jsonLinesSink, "binary": binarySink}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="stream a full scan of a table into a result sink")
+    parser.add_argument("db", help="the database file")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE_4K)
+    parser.add_argument("--table", default="Employee")
+    parser.add_argument("--format", choices=sorted(RESULT_SINK_FORMATS) + ["null"], default="csv")
+    parser.add_argument("--output", help="output file, stdout by default")
+    parser.add_argument("--batch-rows", type=int, default=RESULT_SINK_BATCH_ROWS)
+    parser.add_argument("--queue-batches", type=int, default=0,
+                        help="write from a background thread through a queue of this many batches")
+    args = parser.parse_args()
+
+    with open(args.db, "rb") as db_binary:
+        if args.format == "null":
+            sink = nullSink()
+        else:
+            sinkClass = RESULT_SINK_FORMATS[args.format]
+            out = args.output or (sys.stdout.buffer if sinkClass.binary else sys.stdout)
+            if sinkClass is binarySink:
+                sink = sinkClass(out)
+            else:
+                columns = [name for name, _ in recordColumnOrder(parseSchema(db_binary, args.page_size)[args.table]["sql"])]
+                sink = sinkClass(out, columns)
+        if args.queue_batches:
+            sink = boundedQueueSink(sink, args.queue_batches)
+
+        startTime = time()
+        with sink:
+            streamScan(db_binary, args.page_size, args.table, sink, batchSize=args.batch_rows)
+        print("{} in {:.3f}s".format(sink.stats(), time() - startTime), file=sys.stderr)
@@ -0,0 +1,250 @@
+import math
+import random
+from constants import *
+from utils import parseSchema, readPage, readCounts, recordAccessMethod
+from queryOperations import readResetBookkeepings
+from aggregate import _number
+from recordDecoder import decodeCells, decoderFor, recordColumnOrder
+
+class randomWalkSampler:
+    """
+    sample the leaves of a btree with random root-to-leaf walks: every walk picks one of the
+    children of each interior page uniformly, so it ends on a leaf with probability the product
+    of 1 / fanout along its path; the pages read are kept, a page read twice costs its budget once
+
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param rootPage: the root page of the btree
+        @param decode: a decoder from compileDecoder/decoderFor for the rows of the leaves
+        @param seed: random seed of the walks
+    """
+    def __init__(self, fpt, pageSize, rootPage, decode, seed=None):
+        self.fpt = fpt
+        self.pageSize = pageSize
+        self.rootPage = rootPage
+        self.decode = decode
+        self.rng = random.Random(seed)
+        # page number -> children of an interior page, or decoded rows of a leaf
+        self.pages = {}
+        # levels of the tree, known after the first walk
+        self.height = None
+
+    def pagesRead(self):
+        return len(self.pages)
+
+    def _visit(self, pageNum, level):
+        """return ("interior", children) or ("leaf", rows) of a page, reading it on the first visit only"""
+        visited = self.pages.get(pageNum)
+        if visited is not None:
+            return visited
+
+        page = readPage(pageNum, self.fpt, self.pageSize)
+        readCounts(page[0], level)
+        if page[0] in (INTERIROR_TABLE_BTREE_PAGE_FLAG, INTERIOR_INDEX_BTREE_PAGE_FLAG):
+            children = [child for child, _ in decodeCells(page, self.decode, self.fpt, self.pageSize)]
+            visited = ("interior", children + [int.from_bytes(page[8:12], "big")])
+        else:
+            visited = ("leaf", [row for _, row in decodeCells(page, self.decode, self.fpt, self.pageSize)])
+        self.pages[pageNum] = visited
+        return visited
+
+    def walk(self):
+        """
+        return (leaf page number, rows of the leaf, probability of reaching the leaf) for one random walk
+        """
+        pageNum, probability, level = self.rootPage, 1.0, 0
+        kind, content = self._visit(pageNum, level)
+        while kind == "interior":
+            probability /= len(content)
+            pageNum = self.rng.choice(content)
+            level += 1
+            kind, content = self._visit(pageNum, level)
+        self.height = level + 1
+        return pageNum, content, probability
+
+def _studentTProbability(t, degrees):
+    """P(|T| < t) for Student's t with an integer number of degrees of freedom (Abramowitz & Stegun 26.7.3-4)"""
+    theta = math.atan(t / math.sqrt(degrees))
+    cos2 = math.cos(theta) ** 2
+    if degrees % 2:
+        term, series = 1.0, 1.0 if degrees > 1 else 0.0
+        for k in range(3, degrees - 1, 2):
+            term *= cos2 * (k - 1) / k
+            series += term
+        return 2 / math.pi * (theta + math.sin(theta) * math.cos(theta) * series)
+    term, series = 1.0, 1.0
+    for k in range(2, degrees, 2):
+        term *= cos2 * (k - 1) / k
+        series += term
+    return math.sin(theta) * series
+
+def _studentTQuantile(confidence, degrees):
+    """return t such that P(|T| < t) = confidence with degrees of freedom, found by bisection"""
+    low, high = 0.0, 1.0
+    while _studentTProbability(high, degrees) < confidence:
+        low, high = high, high * 2
+    for _ in range(60):
+        middle = (low + high) / 2
+        if _studentTProbability(middle, degrees) < confidence:
+            low = middle
+        else:
+            high = middle
+    return high
+
+def _interval(walkEstimates, t):
+    """return (mean, low, high) of Hansen-Hurwitz estimates, one per walk, with a Student t confidence interval"""
+    n = len(walkEstimates)
+    mean = sum(walkEstimates) / n
+    if n < 2:
+        return mean, -math.inf, math.inf
+    variance = sum((estimate - mean) ** 2 for estimate in walkEstimates) / (n - 1)
+    halfWidth = t * math.sqrt(variance / n)
+    return mean, mean - halfWidth, mean + halfWidth
+
+def _ratioInterval(numerators, denominators, t):
+    """return (ratio, low, high) of the ratio of two totals estimated from the same walks (delta method)"""
+    n = len(numerators)
+    total = sum(denominators)
+    if not total:
+        return None, None, None
+    ratio = sum(numerators) / total
+    if n < 2:
+        return ratio, 0.0, 1.0
+    residual = sum((y - ratio * x) ** 2 for y, x in zip(numerators, denominators)) / (n - 1)
+    halfWidth = t * math.sqrt(residual / n) / (total / n)
+    return ratio, max(0.0, ratio - halfWidth), min(1.0, ratio + halfWidth)
+
+def _distinctEstimate(values, totalRows):
+    """
+    GEE estimate of the number of distinct values among totalRows rows from the sampled values:
+    sqrt(N / n) * f1 + sum of fj for j >= 2, where fj values were seen exactly j times;
+    the bounds are the distinct values seen and N / n * f1 + sum of fj for j >= 2
+    """
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    sampled = len(values)
+    if not sampled:
+        return 0, 0, 0
+    singletons = sum(1 for count in counts.values() if count == 1)
+    repeated = len(counts) - singletons
+    scale = max(1.0, totalRows / sampled)
+    return (math.sqrt(scale) * singletons + repeated, len(counts), scale * singletons + repeated)
+
+def approximateQuery(fpt, pageSize, table, matches=None, sumColumn=None, distinctColumn=None,
+                     pageBudget=SAMPLE_PAGE_BUDGET, confidence=SAMPLE_CONFIDENCE, seed=None):
+    """
+    approximate SELECT count(*), sum(sumColumn), count(DISTINCT distinctColumn) FROM table WHERE matches(record)
+    from random root-to-leaf walks that read at most pageBudget pages
+
+    every walk gives an unbiased estimate of each total: the sum over the rows of its leaf
+    divided by the probability of reaching the leaf; the answer is the mean over the walks,
+    with a Student t confidence interval from their spread. rows held in the interior cells of
+    an index btree (a WITHOUT ROWID table) are not sampled, under one row per leaf
+
+    return {"count", "sum", "distinct", "fraction", "rows": {"estimate", "low", "high"} or None,
+            "walks", "leavesSampled", "rowsSampled", "pagesRead"}; fraction is the share of the rows
+            that match, distinct is estimated from the matching rows of the distinct leaves sampled
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param table: the table name
+        @param matches: function(record) -> bool over the full record in record order, every row by default
+        @param sumColumn: the (cleaned) column name to sum, no sum by default
+        @param distinctColumn: the (cleaned) column name to count the distinct values of
+        @param pageBudget: the most pages read, the sqlite_master page excluded; the first walk is always taken
+        @param confidence: the confidence level of the intervals, e.g. 0.95
+        @param seed: random seed of the walks
+    """
+    schema = parseSchema(fpt, pageSize)
+    columnNames = [name for name, _ in recordColumnOrder(schema[table]["sql"])]
+    sumPosition = None if sumColumn is None else columnNames.index(sumColumn)
+    distinctPosition = None if distinctColumn is None else columnNames.index(distinctColumn)
+    matches = matches or (lambda record: True)
+
+    recordAccessMethod("sample")
+    sampler = randomWalkSampler(fpt, pageSize, schema[table]["rootPage"], decoderFor(schema, table), seed)
+    rowEstimates, countEstimates, sumEstimates = [], [], []
+    leaves = {}
+
+    # a walk reads at most one page per level; walks over pages already read are free,
+    # the cap stops a tree smaller than the budget from being walked forever
+    while len(rowEstimates) < pageBudget * SAMPLE_WALKS_PER_PAGE:
+        if sampler.height is not None and sampler.pagesRead() + sampler.height > pageBudget:
+            break
+        pageNum, rows, probability = sampler.walk()
+        matching = leaves.get(pageNum)
+        if matching is None:
+            matching = leaves[pageNum] = [row for row in rows if matches(row)]
+        rowEstimates.append(len(rows) / probability)
+        countEstimates.append(len(matching) / probability)
+        if sumPosition is not None:
+            sumEstimates.append(sum(_number(row[sumPosition]) for row in matching) / probability)
+
+    # the walk variance is estimated from the walks themselves: t quantile with n - 1 degrees of freedom
+    t = _studentTQuantile(confidence, max(1, len(rowEstimates) - 1))
+
+    def _result(values):
+        estimate, low, high = values
+        return None if estimate is None else {"estimate": estimate, "low": low, "high": high}
+
+    result = {"rows": _result(_interval(rowEstimates, t)),
+              "count": _result(_interval(countEstimates, t)),
+              "sum": _result(_interval(sumEstimates, t)) if sumEstimates else None,
+              "fraction": _result(_ratioInterval(countEstimates, rowEstimates, t)),
+              "distinct": None,
+              "walks": len(rowEstimates),
+              "leavesSampled": len(leaves),
+              "rowsSampled": sum(len(sampler.pages[pageNum][1]) for pageNum in leaves),
+              "pagesRead": sampler.pagesRead()}
+    # a number of rows is never negative
+    for key in ("count", "rows"):
+        result[key]["low"] = max(0, result[key]["low"])
+
+    if distinctPosition is not None:
+        values = [row[distinctPosition] for matching in leaves.values() for row in matching]
+        # the matching rows of the table, estimated from the same walks
+        estimate, low, high = _distinctEstimate(values, result["count"]["estimate"])
+        result["distinct"] = {"estimate": estimate, "low": low, "high": high}
+    return result
+
+def printEstimate(name, estimate):
+    if estimate is not None:
+        print("{}: ~{:.1f} [{:.1f}, {:.1f}]".format(name, estimate["estimate"], estimate["low"], estimate["high"]))
+
+def db_A_Query_ApproximateLastName(pageSize):
+    """
+    DB: Without any index with page size of 4KB
+    Ops: estimate how many employees have the last name "Rowe" and how many distinct states they live in
+        (random root-to-leaf walks within a page budget instead of a scan)
+    """
+    print("DB: Without any index with page size of 4KB")
+    print("Estimate the number of employees whose last name is \"Rowe\" (this is a sample of {} pages at most)".format(SAMPLE_PAGE_BUDGET))
+
+    with open(DB_PATH1, "rb") as db_binary:
+        result = approximateQuery(db_binary, pageSize, 'Employee', lambda record: record[LAST_NAME_INDEX] == LAST_NAME,
+                                  distinctColumn='State')
+        printEstimate("Count", result["count"])
+        printEstimate("Distinct states", result["distinct"])
+        print("Pages read: {}, walks: {}".format(result["pagesRead"], result["walks"]))
+
+def db_A_Query_ApproximateRange(pageSize):
+    """
+    DB: Without any index with page size of 4KB
+    Ops: estimate the fraction of the employees in the "Emp ID" range (random root-to-leaf walks)
+    """
+    print("DB: Without any index with page size of 4KB")
+    print("Estimate the fraction of the employees whose \"Emp ID\" is in the range (this is a sample of {} pages at most)".format(SAMPLE_PAGE_BUDGET))
+
+    with open(DB_PATH1, "rb") as db_binary:
+        result = approximateQuery(db_binary, pageSize, 'Employee',
+                                  lambda record: EMP_ID_RANGE[0] <= record[EMP_ID_INDEX] <= EMP_ID_RANGE[1])
+        printEstimate("Fraction", result["fraction"])
+        printEstimate("Count", result["count"])
+        print("Pages read: {}, walks: {}".format(result["pagesRead"], result["walks"]))
+
+if __name__ == "__main__":
+    db_A_Query_ApproximateLastName(PAGE_SIZE_4K)
+    readResetBookkeepings()
+    print("")
+    db_A_Query_ApproximateRange(PAGE_SIZE_4K)
+    readResetBookkeepings()
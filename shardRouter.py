@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import argparse
+import heapq
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer as time
+from constants import *
+from metrics import metricsContext
+from utils import parseSchema, fileSignature
+from keyCompare import keyOrder
+from planner import collectStatistics, planQuery
+from recordDecoder import compiledScan, decoderFor, recordColumnOrder
+
+class shardManifest:
+    """
+    the shards of a table partitioned by key range: one SQLite file per shard with the
+    inclusive range [lower, upper] of the key column its rows hold, kept as a json file
+
+        {"table": "Employee", "keyColumn": "Emp_ID",
+         "shards": [{"path": ..., "pageSize": 4096, "lower": 1, "upper": 50000}, ...]}
+
+        @param path: optional json file the manifest is loaded from and saved to
+        @param table: the partitioned table
+        @param keyColumn: the (cleaned) column name the shards are partitioned on
+    """
+    def __init__(self, path=None, table='Employee', keyColumn=SHARD_KEY_COLUMN):
+        self.path = path
+        self.table = table
+        self.keyColumn = keyColumn
+        self.shards = []
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def addShard(self, path, pageSize, lower=None, upper=None):
+        """
+        add a shard; without a range the smallest and largest key of the file are read with a scan
+            @param path: path of the shard database file
+            @param pageSize: the page size of the shard
+            @param lower: smallest key held by the shard
+            @param upper: largest key held by the shard
+        """
+        if lower is None or upper is None:
+            lower, upper = shardKeyRange(path, pageSize, self.table, self.keyColumn)
+        self.shards.append({"path": path, "pageSize": pageSize, "lower": lower, "upper": upper})
+        self.shards.sort(key=lambda shard: keyOrder(shard["lower"]))
+
+    def prune(self, predicate):
+        """
+        return the shards whose key range can hold rows matching the predicate, in key order
+            @param predicate: ("eq", column, value) or ("range", column, lower, upper)
+        """
+        if predicate[1] != self.keyColumn:
+            return list(self.shards)
+        lower, upper = (predicate[2], predicate[2]) if predicate[0] == "eq" else (predicate[2], predicate[3])
+        return [shard for shard in self.shards
+                if keyOrder(shard["lower"]) <= keyOrder(upper) and keyOrder(lower) <= keyOrder(shard["upper"])]
+
+    def save(self, path=None):
+        """write the manifest to path (or the path it was loaded from), replacing the previous file atomically"""
+        path = path or self.path
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w") as out:
+            json.dump({"table": self.table, "keyColumn": self.keyColumn, "shards": self.shards}, out, indent=2)
+        os.replace(tmpPath, path)
+
+    def load(self):
+        with open(self.path) as f:
+            manifest = json.load(f)
+        self.table = manifest["table"]
+        self.keyColumn = manifest["keyColumn"]
+        self.shards = sorted(manifest["shards"], key=lambda shard: keyOrder(shard["lower"]))
+
+def shardKeyRange(path, pageSize, table, keyColumn):
+    """
+    return (smallest, largest) value of keyColumn in the table of a shard, read with a full scan
+        @param path: path of the shard database file
+        @param pageSize: the page size of the shard
+        @param table: the table name
+        @param keyColumn: the (cleaned) column name
+    """
+    with open(path, "rb") as db_binary:
+        schema = parseSchema(db_binary, pageSize)
+        position = [name for name, _ in recordColumnOrder(schema[table]["sql"])].index(keyColumn)
+        keys = []
+        compiledScan(db_binary, pageSize, schema[table]["rootPage"], decoderFor(schema, table),
+                     lambda record: keys.append(record[position]))
+    if not keys:
+        raise ValueError("{} holds no rows of {}".format(path, table))
+    return min(keys, key=keyOrder), max(keys, key=keyOrder)
+
+# planner statistics of the shards queried by this worker process: path -> (file signature, (schema, statistics));
+# a shard rebuilt by the bulk loader keeps change counter 1, so the counter alone cannot tell
+_shardStatistics = {}
+
+def _queryShard(path, pageSize, table, predicate, referencedColumns, keyPosition):
+    """
+    run the query on one shard in a worker process with the planner
+
+    return (the rows sorted on the key, seconds spent in the worker, logical page reads)
+    """
+    startTime = time()
+    with metricsContext(path) as metrics, open(path, "rb") as db_binary:
+        signature = fileSignature(db_binary)
+        cached = _shardStatistics.get(path)
+        if cached is None or cached[0] != signature:
+            # the schema is parsed again too: a rebuilt shard has other root pages
+            cached = _shardStatistics[path] = (signature, collectStatistics(db_binary, pageSize))
+        rows = planQuery(db_binary, pageSize, table, predicate, referencedColumns, cached[1])
+    rows.sort(key=lambda row: keyOrder(row[keyPosition]))
+    return rows, time() - startTime, metrics.logicalReads
+
+def _overlappingGroups(shards):
+    """split shards sorted by lower into runs whose key ranges overlap, the runs follow each other in key order"""
+    groups = []
+    for shard in shards:
+        if groups and keyOrder(shard["lower"]) <= keyOrder(max((s["upper"] for s in groups[-1]), key=keyOrder)):
+            groups[-1].append(shard)
+        else:
+            groups.append([shard])
+    return groups
+
+class shardRouter:
+    """
+    fan a query out to the shards of a shardManifest and merge the answers in key order
+
+    the shards the predicate cannot match are pruned with the manifest, the others are
+    queried concurrently in a process pool (each with the planner's B-tree access path),
+    and the sorted answers are merged with a k-way heap merge; shards with disjoint key
+    ranges are streamed one after the other as soon as their answer arrives, so the first
+    rows are yielded before the slowest shard is done
+
+        @param manifest: a shardManifest
+        @param workers: size of the process pool, the number of CPUs by default
+    """
+    def __init__(self, manifest, workers=None):
+        self.manifest = manifest
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        # the latency report of the last query, complete once its rows are consumed
+        self.lastReport = None
+
+    def query(self, predicate, referencedColumns):
+        """
+        yield the referenced columns of the matching rows of every shard in key order
+
+        self.lastReport is {"shards": [{"path", "rows", "workerSeconds", "seconds", "pagesRead"}],
+        "pruned", "firstRowSeconds", "seconds"}; seconds of a shard run from the submission
+        of the query to its answer, the overall seconds up to the last row
+            @param predicate: ("eq", column, value) or ("range", column, lower, upper)
+            @param referencedColumns: every column the query reads; the key column is added to
+                    order the merge when missing and dropped from the rows yielded
+        """
+        keyColumn = self.manifest.keyColumn
+        columns = list(referencedColumns) if keyColumn in referencedColumns else list(referencedColumns) + [keyColumn]
+        keyPosition = columns.index(keyColumn)
+        dropKey = keyColumn not in referencedColumns
+
+        shards = self.manifest.prune(predicate)
+        report = {"shards": [], "pruned": len(self.manifest.shards) - len(shards), "firstRowSeconds": None, "seconds": None}
+        self.lastReport = report
+        startTime = time()
+        futures = [self.pool.submit(_queryShard, shard["path"], shard["pageSize"], self.manifest.table,
+                                    predicate, columns, keyPosition) for shard in shards]
+        answers = dict(zip((id(shard) for shard in shards), futures))
+
+        def _answer(shard):
+            rows, workerSeconds, pagesRead = answers[id(shard)].result()
+            report["shards"].append({"path": shard["path"], "rows": len(rows), "workerSeconds": workerSeconds,
+                                     "seconds": time() - startTime, "pagesRead": pagesRead})
+            return rows
+
+        for group in _overlappingGroups(shards):
+            merged = heapq.merge(*[_answer(shard) for shard in group], key=lambda row: keyOrder(row[keyPosition]))
+            for row in merged:
+                if report["firstRowSeconds"] is None:
+                    report["firstRowSeconds"] = time() - startTime
+                yield row[:keyPosition] + row[keyPosition + 1:] if dropKey else row
+        report["seconds"] = time() - startTime
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def printShardReport(report):
+    for shard in report["shards"]:
+        print("{:<40} rows: {:>7}  pages read: {:>6}  worker: {:>8.3f}s  answered after: {:>8.3f}s".format(
+            shard["path"], shard["rows"], shard["pagesRead"], shard["workerSeconds"], shard["seconds"]))
+    print("shards queried: {}, pruned: {}, first row after: {}, total: {:.3f}s".format(
+        len(report["shards"]), report["pruned"],
+        "-" if report["firstRowSeconds"] is None else "{:.3f}s".format(report["firstRowSeconds"]), report["seconds"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="query the shards of a manifest by Emp ID range")
+    parser.add_argument("manifest", help="the json manifest of the shards")
+    parser.add_argument("lower", type=int)
+    parser.add_argument("upper", type=int)
+    parser.add_argument("--columns", default="Emp_ID,First_Name,Last_Name")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    manifest = shardManifest(args.manifest)
+    with shardRouter(manifest, args.workers) as router:
+        for row in router.query(("range", manifest.keyColumn, args.lower, args.upper), args.columns.split(",")):
+            print(row)
+        printShardReport(router.lastReport)
@@ -0,0 +1,212 @@
+import heapq
+from bitstring import ConstBitStream
+from constants import *
+from utils import parseSchema, readPage, recordAccessMethod, printEmpIDFullname
+from catalog import tableColumns, tableIndexes, indexColumns
+from queryOperations import btreeScan, orderedScan, tableBtreeGetMany, readResetBookkeepings
+from recordDecoder import recordColumnOrder
+
+# rowids fetched from the table per batch when a top-k is driven by an index, doubled while rows are rejected
+TOP_K_MAX_BATCH = 1024
+
+def _orderKey(value):
+    """sort key of a column value: NULL sorts before every other value like in SQLite"""
+    return (0,) if value is None else (1, value)
+
+class _reversedKey:
+    """wrap a key so that heapq, a min-heap, keeps the largest key at the root"""
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+class boundedHeap:
+    """
+    keep the k first records in the requested order out of a stream of any length,
+    in O(k) memory; the root of the heap is the worst record kept so far, so a new
+    record either replaces it or is dropped in O(log k)
+
+    records with equal keys keep the order in which they were pushed
+
+        @param k: the number of records to keep
+        @param descending: keep the largest keys instead of the smallest
+    """
+    def __init__(self, k, descending=False):
+        self.k = k
+        self.descending = descending
+        self.heap = []
+        self.pushed = 0
+
+    def push(self, key, record):
+        """
+        offer a record to the heap
+            @param key: the order by value of the record
+            @param record: the record
+        """
+        self.pushed += 1
+        key = _orderKey(key)
+        # ties: the record pushed last is the worst, so -pushed sorts it first out
+        entry = (key if self.descending else _reversedKey(key), -self.pushed, record)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif self.k > 0:
+            heapq.heappushpop(self.heap, entry)
+
+    def results(self):
+        """return the kept records, best first"""
+        return [record for _, _, record in sorted(self.heap, reverse=True)]
+
+def orderedAccessPath(schema, table, column):
+    """
+    return how the records of table can be read in column order:
+    ("table", root page) when the table btree itself is ordered on column (WITHOUT ROWID on column),
+    ("index", index name) when an index of a rowid table starts with column,
+    None when only a scan and a sort can order the records
+
+        @param schema: the catalog returned by parseSchema
+        @param table: the table name
+        @param column: the order by column
+    """
+    _, primaryKey, withoutRowid = tableColumns(schema[table]["sql"])
+    if withoutRowid and primaryKey[:1] == [column]:
+        return ("table", schema[table]["rootPage"])
+
+    if not withoutRowid:
+        for indexName in tableIndexes(schema, table):
+            if indexColumns(schema, indexName)[0] == column:
+                return ("index", indexName)
+    return None
+
+def topK(fpt, pageSize, table, k, orderBy, matches=None, descending=False):
+    """
+    SELECT * FROM table WHERE matches(record) ORDER BY orderBy [DESC] LIMIT k
+
+    -the table btree ordered on orderBy: ordered traversal, stops after k qualifying records
+    -an index ordered on orderBy: ordered index traversal, the rowids are fetched from the
+        table in batches and the traversal stops after k qualifying records
+    -otherwise: one scan feeding a heap bounded to k records
+
+    return the records in order
+        @param fpt: the file pointer of the db
+        @param pageSize: the page size of the db
+        @param table: the table name
+        @param k: the number of records to return
+        @param orderBy: the (cleaned) column name to order on, e.g. "Emp_ID"
+        @param matches: function(record) -> bool, every record qualifies by default
+        @param descending: order from the largest to the smallest value
+    """
+    if k <= 0:
+        return []
+    matches = matches or (lambda record: True)
+
+    schema = parseSchema(fpt, pageSize)
+    position = [name for name, _ in recordColumnOrder(schema[table]["sql"])].index(orderBy)
+    tablePageBitstream = ConstBitStream(readPage(schema[table]["rootPage"], fpt, pageSize))
+    accessPath = orderedAccessPath(schema, table, orderBy)
+    rows = []
+
+    if accessPath and accessPath[0] == "table":
+        recordAccessMethod("top-k clustered-index")
+
+        def _collect(record):
+            if matches(record):
+                rows.append(record)
+            return len(rows) == k
+
+        orderedScan(tablePageBitstream, fpt, _collect, pageSize, descending)
+        return rows
+
+    if accessPath and accessPath[0] == "index":
+        recordAccessMethod("top-k index+table")
+        indexPagestream = ConstBitStream(readPage(schema[accessPath[1]]["rootPage"], fpt, pageSize))
+        pending = []
+        batch = [k]
+
+        def _flush():
+            # one shared descent of the table for the rowids of the batch, then keep the index order
+            found = {}
+            tableBtreeGetMany(tablePageBitstream, fpt, sorted(set(pending)), found, pageSize)
+            before = len(rows)
+            for rowid in pending:
+                record = found.get(rowid)
+                if record is not None and len(rows) < k and matches(record):
+                    rows.append(record)
+            if len(rows) < k and len(rows) - before < len(pending):
+                # rows were rejected: the predicate is selective, fetch more per batch
+                batch[0] = min(batch[0] * 2, TOP_K_MAX_BATCH)
+            del pending[:]
+
+        def _collectRowid(record):
+            # the rowid is the last field of the index record
+            pending.append(record[-1])
+            if len(pending) >= batch[0]:
+                _flush()
+            return len(rows) == k
+
+        orderedScan(indexPagestream, fpt, _collectRowid, pageSize, descending)
+        if pending and len(rows) < k:
+            _flush()
+        return rows
+
+    recordAccessMethod("top-k heap")
+    heap = boundedHeap(k, descending)
+
+    def _offer(record):
+        if record and matches(record):
+            heap.push(record[position], record)
+        return None
+
+    btreeScan(tablePageBitstream, fpt, _offer, pageSize)
+    return heap.results()
+
+def db_D_Query_TopK(pageSize):
+    """
+    DB: With primary index on "Emp ID" column but defined as clustered (use CREATE INDEX WITHOUT ROWID) with page size of 4KB
+    ops: print the first 10 employees by "Emp ID" whose last name is "Rowe" (ordered traversal, stops after 10 rows)
+    """
+    print("DB: With primary index on \"Emp ID\" column but defined as clustered with page size of 4KB")
+    print("Query and print the first 10 employees by \"Emp ID\" whose last name is \"Rowe\" (this is a Top-K on the btree order)")
+
+    with open(DB_PATH4, "rb") as db_binary:
+        for record in topK(db_binary, pageSize, 'Employee', 10, 'Emp_ID', lambda record: record[LAST_NAME_INDEX] == LAST_NAME):
+            printEmpIDFullname(record)
+
+def db_C_Query_TopK(pageSize):
+    """
+    DB: With primary index on "Emp ID" column (Unclusterd Index) with page size of 4KB
+    ops: print the 10 employees with the largest "Emp ID" (reverse index traversal, then table lookups)
+    """
+    print("DB: With primary index on \"Emp ID\" column (Unclusterd Index) with page size of 4KB")
+    print("Query and print the 10 employees with the largest \"Emp ID\" (this is a descending Top-K on the index order)")
+
+    with open(DB_PATH3, "rb") as db_binary:
+        for record in topK(db_binary, pageSize, 'Employee', 10, 'Emp_ID', descending=True):
+            printEmpIDFullname(record)
+
+def db_A_Query_TopK(pageSize):
+    """
+    DB: Without any index with page size of 4KB
+    ops: print the first 10 employees by last name (scan with a bounded heap)
+    """
+    print("DB: Without any index with page size of 4KB")
+    print("Query and print the first 10 employees by last name (this is a Top-K with a bounded heap)")
+
+    with open(DB_PATH1, "rb") as db_binary:
+        for record in topK(db_binary, pageSize, 'Employee', 10, 'Last_Name'):
+            printEmpIDFullname(record)
+
+if __name__ == "__main__":
+    db_A_Query_TopK(PAGE_SIZE_4K)
+    readResetBookkeepings()
+    print("")
+    db_C_Query_TopK(PAGE_SIZE_4K)
+    readResetBookkeepings()
+    print("")
+    db_D_Query_TopK(PAGE_SIZE_4K)
+    readResetBookkeepings()
@@ -1,6 +1,8 @@
+import os
 from constants import *
 from bitstring import BitArray, ConstBitStream
 from timeit import default_timer as time
+from metrics import currentMetrics
 
 def readPage(pageNum, fpt, pageSize):
     """record time required to retrieve the page
@@ -12,17 +14,28 @@ def readPage(pageNum, fpt, pageSize):
     - store number of time certain page type is read
     
         @param pageNum: the absolute offset of the page  
-        @param fpt: the file pointer of the db file
+        @param fpt: the file pointer of the db file, or a page source
+                (read-ahead, prefetch, cache) that implements fetchPage
     """
-    fpt.seek(pageSize * (pageNum - 1), 0)
+    # page sources serve the page themselves instead of seek + read
+    fetchPage = getattr(fpt, 'fetchPage', None)
+    if fetchPage is None:
+        fpt.seek(pageSize * (pageNum - 1), 0)
 
     startTime = time()
-    page = fpt.read(pageSize)
+    page = fetchPage(pageNum, pageSize) if fetchPage else fpt.read(pageSize)
     elapsedTime = (time() - startTime) * 1000
     
     # accumulate the page access time for each query operation
     pageAccessTimer.accumulatePageAccessTime(elapsedTime)
 
+    metrics = currentMetrics()
+    if metrics is not None:
+        metrics.recordLogicalRead(elapsedTime)
+        # page sources account for their own physical reads
+        if fetchPage is None:
+            metrics.recordPhysicalRead(1, len(page))
+
     return page
 
 def parseRootPage(fpt, pageSize):
@@ -33,6 +46,16 @@ def parseRootPage(fpt, pageSize):
         @param fpt: the file pointer of the database file
         @param pageSize: the page size of the database
     """
+    return {name: entry["rootPage"] for name, entry in parseSchema(fpt, pageSize).items()}
+
+def parseSchema(fpt, pageSize):
+    """
+    return the sqlite_master catalog as a dictionary of table/index name to
+    {"type", "tableName", "rootPage", "sql"}; sql is empty for automatic indexes
+
+        @param fpt: the file pointer of the database file
+        @param pageSize: the page size of the database
+    """
     # read in the whole root page into memory
     bitstream = ConstBitStream(readPage(1, fpt, pageSize))
     readCounts(-1)
@@ -55,12 +78,48 @@ def parseRootPage(fpt, pageSize):
         # goes to the sqlite master table and find out the root page number; sqlite_master table is a table btree page
         _,record = parse_cell_content(cellPosition, bitstream, pageFlag, fpt, pageSize, isSqliteMaster=True)
         
-        # store the table/index name and its root page
-        tables.setdefault(record[1], record[-2])
+        # store the table/index name with its root page and definition
+        tables.setdefault(record[1], {"type": record[0], "tableName": record[2], "rootPage": record[3], "sql": record[4]})
 
-    # return the root page num
     return tables
 
+def readFileChangeCounter(fpt):
+    """
+    return the file change counter of the database (4 bytes at offset 24 of the header),
+    sqlite increments it on every committed write in rollback journal mode
+
+    the header is read directly and is not counted as a page read
+        @param fpt: the file pointer of the database file
+    """
+    original = fpt.tell()
+    fpt.seek(24, 0)
+    counter = int.from_bytes(fpt.read(4), byteorder="big")
+    fpt.seek(original, 0)
+    return counter
+
+def isWalMode(fpt):
+    """
+    whether the database is in WAL mode (file format write/read versions at offsets 18 and 19 are 2);
+    in WAL mode commits go to the -wal file and the change counter only moves at a checkpoint
+
+        @param fpt: the file pointer of the database file
+    """
+    original = fpt.tell()
+    fpt.seek(18, 0)
+    versions = fpt.read(2)
+    fpt.seek(original, 0)
+    return versions == b"\x02\x02"
+
+def fileSignature(fpt):
+    """
+    return (change counter, inode, size, modification time in ns) of the database file:
+    a file rebuilt or replaced keeping the same change counter still gets another signature
+
+        @param fpt: the file pointer of the database file
+    """
+    info = os.fstat(fpt.fileno())
+    return (readFileChangeCounter(fpt), info.st_ino, info.st_size, info.st_mtime_ns)
+
 def parse_cell_content(cellOffset, bitstream, pageFlag, fpt, pageSize, isSqliteMaster=False):
     """
     parse the cell contents into a tuple like (child pointer if exists, record itself)
@@ -79,6 +138,11 @@ def parse_cell_content(cellOffset, bitstream, pageFlag, fpt, pageSize, isSqliteM
 
     leftChildPointer = None
     record = None
+
+    metrics = currentMetrics()
+    if metrics is not None:
+        metrics.cellsExamined += 1
+
     if pageFlag == INTERIROR_TABLE_BTREE_PAGE_FLAG:
 
         # get the pointer at the begining of the cell relative to absCellPos
@@ -131,6 +195,19 @@ def absPageOffset(pageNum, pageSize):
     """
     return (pageNum - 1) * pageSize
 
+# body size in bytes of the fixed size serial types 0-11 (10 and 11 are reserved)
+SERIAL_TYPE_SIZES = (0, 1, 2, 3, 4, 6, 8, 8, 0, 0, 0, 0)
+
+def serialToByteSize(serialType):
+    """
+    return the the tuple of (serialType, size) refers to the table
+        @param serialType: the serial type in the record header
+    """
+    if serialType < 12:
+        return (serialType, SERIAL_TYPE_SIZES[serialType])
+    # blobs are even and text is odd from 12 on
+    return (serialType, (serialType - 12) >> 1)
+
 def parseRecord(recordOffset, bitstream, totalRecordSize, pageType, fpt, pageSize, isSqliteMaster=False):
     """
     return a triple (payloadHeaderSize, serialMapper, record)
@@ -154,26 +231,6 @@ def parseRecord(recordOffset, bitstream, totalRecordSize, pageType, fpt, pageSiz
     # read the column size accroding tot he varint
     serialMapper = []
 
-    def _serialToByteSize(serialType):
-        """
-        return the the tuple of (serialType, size) refers to the table
-            @param serialType: the serial type in the record header
-        """
-        if serialType >= 0 and serialType <= 4:
-            size = serialType
-        elif serialType == 5 or serialType == 7:
-            size = serialType + 1
-        elif serialType == 6:
-            size = 8
-        elif serialType in [0, 8 ,9 ,12, 13]:
-            size = 0
-        elif serialType >= 12 and serialType % 2 == 0:
-            size = (serialType - 12) / 2
-        elif serialType >= 13 and serialType % 2 == 1:
-            size = (serialType - 13) / 2
-        
-        return (serialType, size)
-
     # there are payloadHeaderSize - headerVarintSize remaining bytes for serial types in the header and parse the serial num in the record
     headerRemainingBytes = payloadHeaderSize - headerVarintSize
     currentReadOffset = recordOffset + headerVarintSize
@@ -181,7 +238,7 @@ def parseRecord(recordOffset, bitstream, totalRecordSize, pageType, fpt, pageSiz
         
         serialNum, recordBodyOffset, usedBytes = readVarintAtOffset(currentReadOffset, bitstream)
         # store the corresponding value of the serialNum
-        serialMapper.append(_serialToByteSize(serialNum))
+        serialMapper.append(serialToByteSize(serialNum))
         headerRemainingBytes -= usedBytes
         
         # update next offset position to be read
@@ -196,7 +253,7 @@ def parseRecord(recordOffset, bitstream, totalRecordSize, pageType, fpt, pageSiz
     
     # parse the record body into a list in which each index represents a column value in the row record
     recordBodySize = inCellPayload - payloadHeaderSize
-    record = parseRecordBody(recordBodySize, overflowPayload, serialMapper, bitstream, fpt, pageType, isSqliteMaster)
+    record = parseRecordBody(recordBodySize, overflowPayload, serialMapper, bitstream, fpt, pageSize, pageType, isSqliteMaster)
 
     # reset back to original position
     bitstreamSeek(bitstream, originalPos, 0)
@@ -218,16 +275,20 @@ def parseRecordBody(recordBodySize, overflowPayload, serialMapper, bitstream, fp
     """
     _record = []
 
+    metrics = currentMetrics()
+    if metrics is not None:
+        metrics.bytesDecoded += recordBodySize + overflowPayload
+
     # read the whole concatenated record body bytes in the payload body and the overflow pages
     recordBodyStream = ConstBitStream(bitstream.read('bytes:{}'.format(recordBodySize)))
 
     if overflowPayload > 0:
        
-        # read the last four bytes at offsets recordBodySize relative to the recordBodyAbsOffset ==> read the last four bytes
-        rootOverflowPagePointer = bitstreamReadAtOffset(bitstream, int, "bytes:{}".format(POINTER_SIZE), recordBodySize)
+        # the first overflow page number is in the four bytes right after the in-cell payload
+        rootOverflowPagePointer = bitstreamReadAtOffset(bitstream, int, "bytes:{}".format(POINTER_SIZE), bitstream.bytepos)
     
         # get the bitstream of the root overflow page at PAGE_SIZE at a time
-        overflowBitstream = ConstBitStream(readPage(absPageOffset(rootOverflowPagePointer, pageSize), fpt, pageSize))
+        overflowBitstream = ConstBitStream(readPage(rootOverflowPagePointer, fpt, pageSize))
         readCounts(pageType)
 
         # traverse the chain of overflow pages
@@ -246,7 +307,7 @@ def parseRecordBody(recordBodySize, overflowPayload, serialMapper, bitstream, fp
             
             # get the next overflow page bitstream if available
             if nxtOverflowPage > 0:
-                overflowBitstream = ConstBitStream(readPage(absPageOffset(nxtOverflowPage, pageSize), fpt, pageSize))
+                overflowBitstream = ConstBitStream(readPage(nxtOverflowPage, fpt, pageSize))
                 readCounts(pageType)
 
 
@@ -255,13 +316,20 @@ def parseRecordBody(recordBodySize, overflowPayload, serialMapper, bitstream, fp
         attributeLength = int(attributeLength)
         formatStr = "bytes:{}".format(attributeLength)
 
-        # handle special case of serial type of 8 and 9 ==> value is integer 0 and 1
-        if serialType == 8:
+        # handle special case of serial type of 0, 8 and 9 ==> value is NULL, integer 0 and 1
+        if serialType == 0:
+            _record.append(None)
+        elif serialType == 8:
             _record.append(0)
         elif serialType == 9:
             _record.append(1)
-        elif (i == 0 and not isSqliteMaster) or (i == 3 and isSqliteMaster) or (serialType > 0 and serialType < 8):
-            formatStr = "uintbe:{}".format(attributeLength * 8)
+        # the serial type alone tells the storage class: a text key is text even in the first column
+        elif serialType < 7:
+            formatStr = "intbe:{}".format(attributeLength * 8)
+            _record.append(recordBodyStream.read(formatStr))
+        elif serialType == 7:
+            _record.append(recordBodyStream.read("floatbe:64"))
+        elif serialType % 2 == 0:
             _record.append(recordBodyStream.read(formatStr))
         else:
             _record.append(recordBodyStream.read(formatStr).decode('utf-8'))
@@ -324,9 +392,9 @@ def determineinCellPayload(pageType, P, pageSize):
     if pageType == INTERIROR_TABLE_BTREE_PAGE_FLAG or pageType == LEAF_TABLE_BTREE_PAGE_FLAG:
         X = U - 35
     else:
-        X = ((U - 12)* 64 / 255) - 23
+        X = ((U - 12)* 64 // 255) - 23
 
-    M =  ((U - 12) * 32 / 255) - 23
+    M =  ((U - 12) * 32 // 255) - 23
 
     K = M + (( P - M) % ( U - 4))
 
@@ -408,11 +476,28 @@ def printFullnameOnly(record):
                                         record[LAST_NAME_INDEX]))
 
 
-def readCounts(pageFlag):
+def recordAccessMethod(method):
+    """
+    bookkeeping of the access methods (scan, index+table, clustered-index, index-only ...) used by a query
+        @param method: the name of the access method
+    """
+    accessMethodCounts[method] = accessMethodCounts.get(method, 0) + 1
+
+    metrics = currentMetrics()
+    if metrics is not None:
+        metrics.recordAccessMethod(method)
+
+def readCounts(pageFlag, level=None):
     """
     increment the readcounts according to the page type
         @param pageFlag: the page type to determine the readcounts of the object
+        @param level: the depth of the page in its btree (0 = root) if known
     """
+    # per query instrumentation, if a metrics context is active
+    metrics = currentMetrics()
+    if metrics is not None:
+        metrics.recordPageVisit(pageFlag, level)
+
     # a special case for root page read counts
     if pageFlag < 0:
         headerPageType.incrementReadCounts()
@@ -464,3 +549,5 @@ indexInternalPageType = page()
 indexLeafPageType = page()
 # store all the page access time into this list and perform the average
 pageAccessTimer = pageAccesingTime()
+# number of times each access method was used
+accessMethodCounts = {}
@@ -0,0 +1,185 @@
+import os
+import struct
+from constants import *
+from metrics import currentMetrics
+
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+WAL_MAGIC_LITTLE_ENDIAN = 0x377f0682
+WAL_MAGIC_BIG_ENDIAN = 0x377f0683
+
+def walChecksum(data, s0, s1, bigEndian):
+    """
+    continue the cumulative wal checksum over data (a multiple of 8 bytes)
+        @param data: the bytes to checksum
+        @param s0: first checksum word so far
+        @param s1: second checksum word so far
+        @param bigEndian: the checksum words are big endian (magic 0x377f0683)
+    """
+    words = struct.unpack("{}{}I".format(">" if bigEndian else "<", len(data) // 4), data)
+    for i in range(0, len(words), 2):
+        s0 = (s0 + words[i] + s1) & 0xFFFFFFFF
+        s1 = (s1 + words[i + 1] + s0) & 0xFFFFFFFF
+    return s0, s1
+
+class walFile:
+    """
+    page source for a database in journal_mode=WAL that serves the newest
+    committed version of every page without checkpointing
+
+    the -wal file is scanned frame by frame; frames are only trusted when their
+    salts match the wal header and the cumulative checksum is valid, and only
+    the frames up to the last commit frame are used. the result is an in-memory
+    map page number -> offset of its latest committed frame; every other page
+    comes from the main db file
+
+        @param fpt: the file pointer of the main db file (opened in "rb")
+        @param walPath: path of the wal file, "<db path>-wal" by default
+    """
+    def __init__(self, fpt, walPath=None):
+        self.fpt = fpt
+        self.fd = fpt.fileno()
+        self.walPath = walPath or fpt.name + "-wal"
+        self.walFpt = None
+        self.walReads = 0
+        self.dbReads = 0
+        self._reset()
+        self.refresh()
+
+    def _reset(self):
+        # state of the scan, kept so that refresh() only parses the frames appended since
+        self.salts = None
+        self.bigEndian = True
+        self.walPageSize = 0
+        self.scannedTo = WAL_HEADER_SIZE
+        self.checksum = (0, 0)
+        self.uncommitted = {}
+        self.frames = {}
+        self.dbSizeInPages = None
+        self.commits = 0
+
+    def refresh(self):
+        """
+        pick up the frames committed since the last refresh; call it before a query
+        to see the latest snapshot. return the number of committed frames now mapped
+        """
+        if not os.path.exists(self.walPath):
+            if self.walFpt:
+                self.walFpt.close()
+                self.walFpt = None
+            self._reset()
+            return 0
+
+        if self.walFpt is None:
+            self.walFpt = open(self.walPath, "rb")
+        walFd = self.walFpt.fileno()
+
+        header = os.pread(walFd, WAL_HEADER_SIZE, 0)
+        if len(header) < WAL_HEADER_SIZE:
+            self._reset()
+            return 0
+
+        magic, version, pageSize, checkpointSeq, salt1, salt2, cksum1, cksum2 = struct.unpack(">8I", header)
+        if magic not in (WAL_MAGIC_LITTLE_ENDIAN, WAL_MAGIC_BIG_ENDIAN):
+            self._reset()
+            return 0
+
+        if self.salts != (salt1, salt2):
+            # a new wal (first refresh, or the wal was restarted after a checkpoint)
+            self._reset()
+            self.bigEndian = magic == WAL_MAGIC_BIG_ENDIAN
+            self.walPageSize = pageSize or 65536
+            if walChecksum(header[:24], 0, 0, self.bigEndian) != (cksum1, cksum2):
+                return 0
+            self.salts = (salt1, salt2)
+            self.checksum = (cksum1, cksum2)
+
+        frameSize = WAL_FRAME_HEADER_SIZE + self.walPageSize
+        walSize = os.fstat(walFd).st_size
+        if walSize < self.scannedTo:
+            # the wal shrank under the same salts: the frames mapped so far are gone, scan it again
+            salts, checksum = self.salts, (cksum1, cksum2)
+            self._reset()
+            self.bigEndian = magic == WAL_MAGIC_BIG_ENDIAN
+            self.walPageSize = pageSize or 65536
+            self.salts, self.checksum = salts, checksum
+
+        while self.scannedTo + frameSize <= walSize:
+            frame = os.pread(walFd, frameSize, self.scannedTo)
+            pageNum, commitSize, frameSalt1, frameSalt2, frameCksum1, frameCksum2 = struct.unpack(">6I", frame[:WAL_FRAME_HEADER_SIZE])
+
+            if (frameSalt1, frameSalt2) != self.salts:
+                break
+            s0, s1 = walChecksum(frame[:8], self.checksum[0], self.checksum[1], self.bigEndian)
+            s0, s1 = walChecksum(frame[WAL_FRAME_HEADER_SIZE:], s0, s1, self.bigEndian)
+            if (s0, s1) != (frameCksum1, frameCksum2):
+                # a torn or stale frame ends the valid part of the wal
+                break
+
+            self.checksum = (s0, s1)
+            self.uncommitted[pageNum] = self.scannedTo + WAL_FRAME_HEADER_SIZE
+            self.scannedTo += frameSize
+
+            if commitSize:
+                # a commit frame makes every frame before it visible
+                self.frames.update(self.uncommitted)
+                self.uncommitted = {}
+                self.dbSizeInPages = commitSize
+                self.commits += 1
+
+        return len(self.frames)
+
+    def fetchPage(self, pageNum, pageSize):
+        """
+        return the newest committed version of the page
+            @param pageNum: the page number to fetch
+            @param pageSize: the page size of the database
+        """
+        offset = self.frames.get(pageNum)
+        if offset is not None:
+            # re-check the frame salts: the wal may have been restarted or truncated by a checkpoint
+            frameHeader = os.pread(self.walFpt.fileno(), WAL_FRAME_HEADER_SIZE, offset - WAL_FRAME_HEADER_SIZE)
+            if len(frameHeader) < WAL_FRAME_HEADER_SIZE or struct.unpack(">4I", frameHeader[:16])[2:] != self.salts:
+                # the checkpoint copied the pages back into the db file, map what the wal holds now
+                self.refresh()
+                offset = self.frames.get(pageNum)
+
+        if offset is not None:
+            page = os.pread(self.walFpt.fileno(), pageSize, offset)
+            if len(page) == pageSize:
+                self.walReads += 1
+                self._recordPhysicalRead(page)
+                return page
+
+        page = os.pread(self.fd, pageSize, (pageNum - 1) * pageSize)
+        self.dbReads += 1
+        self._recordPhysicalRead(page)
+        return page
+
+    def _recordPhysicalRead(self, page):
+        metrics = currentMetrics()
+        if metrics is not None:
+            metrics.recordPhysicalRead(1, len(page))
+
+    def stats(self):
+        """return the wal statistics"""
+        return {"committedFrames": len(self.frames),
+                "commits": self.commits,
+                "dbSizeInPages": self.dbSizeInPages,
+                "walReads": self.walReads,
+                "dbReads": self.dbReads}
+
+    def close(self):
+        if self.walFpt:
+            self.walFpt.close()
+        self.fpt.close()
+
+    def __getattr__(self, name):
+        # behave like the wrapped file pointer for everything else (seek, read ...)
+        return getattr(self.fpt, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()